@@ -0,0 +1,277 @@
+# finance-app-master/account_sync_scheduler.py
+import asyncio
+import logging
+import signal
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import case, func, or_, select, update
+
+import models
+from database import AsyncSessionLocal
+from bank_client import bank_clients, BankUnavailableError
+from bank_registry import bank_registry
+from accounts_api import sync_connection_accounts
+from config import (
+    ACCOUNT_SYNC_INTERVAL,
+    ACCOUNT_SYNC_BUDGET,
+    ACCOUNT_SYNC_CONCURRENCY,
+    ACCOUNT_SYNC_STALE_AFTER,
+    ACCOUNT_SYNC_IDLE_STALE_AFTER,
+    ACCOUNT_SYNC_RECENT_VIEW,
+    ACCOUNT_SYNC_LEASE,
+)
+
+logger = logging.getLogger("uvicorn")
+
+
+def _seconds(value: float):
+    return func.make_interval(0, 0, 0, 0, 0, 0, value)
+
+
+class BankStats:
+    def __init__(self):
+        self.synced = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        self.last_synced_at: Optional[datetime] = None
+
+    def snapshot(self) -> dict:
+        return {
+            "synced": self.synced,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "last_synced_at": self.last_synced_at,
+        }
+
+
+class AccountSyncScheduler:
+    """
+    Фоновая синхронизация счетов всех активных подключений, чтобы клиенту
+    не нужно было запрашивать банки при каждом запуске приложения.
+
+    Раз в interval выбирается не больше budget устаревших подключений
+    (бюджет запросов к банкам). Бюджет действует в пределах процесса,
+    поэтому синхронизацию выполняет один отдельный процесс
+    (python account_sync_scheduler.py), а в процессах API она по умолчанию
+    выключена (ACCOUNT_SYNC_ENABLED). Устаревшее — синхронизированное
+    раньше stale_after назад, если клиент открывал его за последние
+    recent_view, и раньше idle_stale_after назад для остальных. Выбор
+    справедливый: банки чередуются по кругу (первое подключение каждого
+    банка, затем второе...), а внутри банка сначала идет по одному
+    подключению каждого пользователя; при прочих равных первыми идут
+    недавно просмотренные. Выбранные строки помечаются
+    accounts_sync_started_at (аренда на lease секунд) одним UPDATE —
+    другие экземпляры их не возьмут, а после неудачи подключение
+    повторяется не раньше, чем истечет аренда.
+    """
+
+    def __init__(
+        self,
+        interval: float = ACCOUNT_SYNC_INTERVAL,
+        budget: int = ACCOUNT_SYNC_BUDGET,
+        concurrency: int = ACCOUNT_SYNC_CONCURRENCY,
+        stale_after: float = ACCOUNT_SYNC_STALE_AFTER,
+        idle_stale_after: float = ACCOUNT_SYNC_IDLE_STALE_AFTER,
+        recent_view: float = ACCOUNT_SYNC_RECENT_VIEW,
+        lease: float = ACCOUNT_SYNC_LEASE,
+    ):
+        self.interval = interval
+        self.budget = budget
+        self.concurrency = max(1, concurrency)
+        self.stale_after = stale_after
+        self.idle_stale_after = idle_stale_after
+        self.recent_view = recent_view
+        self.lease = lease
+        self._runner: Optional[asyncio.Task] = None
+        self._banks: Dict[str, BankStats] = defaultdict(BankStats)
+        self.stats = {"runs": 0, "claimed": 0, "last_run_at": None, "last_run_ms": None}
+
+    def _pick(self):
+        """id подключений для следующей пачки — в порядке справедливой очереди."""
+        cb = models.ConnectedBank
+        now = func.now()
+        recently_viewed = cb.last_viewed_at >= now - _seconds(self.recent_view)
+        stale_before = case(
+            (recently_viewed, now - _seconds(self.stale_after)),
+            else_=now - _seconds(self.idle_stale_after),
+        )
+        candidates = (
+            select(
+                cb.id,
+                cb.bank_name,
+                cb.last_viewed_at,
+                # Номер подключения среди подключений того же пользователя в том же банке
+                func.row_number().over(
+                    partition_by=(cb.bank_name, cb.user_id),
+                    order_by=(cb.last_viewed_at.desc().nulls_last(), cb.accounts_synced_at.nulls_first(), cb.id),
+                ).label("user_rank"),
+            )
+            .where(
+                cb.status == "active",
+                cb.consent_id.is_not(None),
+                or_(cb.accounts_synced_at.is_(None), cb.accounts_synced_at < stale_before),
+                or_(cb.accounts_sync_started_at.is_(None), cb.accounts_sync_started_at < now - _seconds(self.lease)),
+            )
+            .subquery()
+        )
+        ranked = select(
+            candidates.c.id,
+            candidates.c.last_viewed_at,
+            # Место в очереди банка: сначала по одному подключению каждого пользователя
+            func.row_number().over(
+                partition_by=candidates.c.bank_name,
+                order_by=(candidates.c.user_rank, candidates.c.last_viewed_at.desc().nulls_last(), candidates.c.id),
+            ).label("bank_rank"),
+        ).subquery()
+        return (
+            select(ranked.c.id)
+            .order_by(ranked.c.bank_rank, ranked.c.last_viewed_at.desc().nulls_last(), ranked.c.id)
+            .limit(self.budget)
+        )
+
+    async def _claim(self) -> list:
+        cb = models.ConnectedBank
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                update(cb)
+                .where(
+                    cb.id.in_(self._pick().scalar_subquery()),
+                    # Повторная проверка после ожидания блокировки строки: ее мог забрать другой экземпляр
+                    or_(cb.accounts_sync_started_at.is_(None), cb.accounts_sync_started_at < func.now() - _seconds(self.lease)),
+                )
+                .values(accounts_sync_started_at=func.now())
+                .returning(cb.id, cb.bank_name)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        return rows
+
+    async def _sync(self, connection_id: int, bank_name: str) -> None:
+        stats = self._banks[bank_name]
+        try:
+            async with AsyncSessionLocal() as db:
+                conn = await db.get(models.ConnectedBank, connection_id)
+                if conn is None or conn.status != "active" or not conn.consent_id:
+                    return
+                bank_config = await bank_registry.fetch_by_name(conn.bank_name)
+                if not bank_config:
+                    raise HTTPException(status_code=500, detail="Bank configuration not found.")
+                # Снимается тем же коммитом, что сохраняет счета; после неудачи аренда остается
+                conn.accounts_sync_started_at = None
+                await sync_connection_accounts(db, conn, bank_config)
+            stats.synced += 1
+            stats.last_synced_at = datetime.now(timezone.utc)
+        except HTTPException as e:
+            stats.failed += 1
+            stats.last_error = f"{e.status_code}: {e.detail}"
+        except BankUnavailableError as e:
+            # Банк отклонен выключателем: аренда остается и откладывает повтор
+            stats.failed += 1
+            stats.last_error = str(e)
+        except Exception as e:
+            stats.failed += 1
+            stats.last_error = str(e)
+            logger.error(f"Background accounts sync for connection {connection_id} failed: {e}")
+
+    async def run_once(self) -> int:
+        """Синхронизирует одну пачку подключений. Возвращает ее размер."""
+        started = time.perf_counter()
+        rows = await self._claim()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def sync(connection_id: int, bank_name: str) -> None:
+            async with semaphore:
+                await self._sync(connection_id, bank_name)
+
+        await asyncio.gather(*(sync(connection_id, bank_name) for connection_id, bank_name in rows))
+
+        self.stats["runs"] += 1
+        self.stats["claimed"] += len(rows)
+        self.stats["last_run_at"] = datetime.now(timezone.utc)
+        self.stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return len(rows)
+
+    async def _run_loop(self) -> None:
+        while True:
+            started = time.monotonic()
+            try:
+                await self.run_once()
+            except Exception as e:
+                logger.error(f"Background accounts sync run failed: {e}")
+            # Не больше budget подключений за interval, даже если очередь не пуста
+            await asyncio.sleep(max(self.interval - (time.monotonic() - started), 0))
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    async def backlog(self) -> Dict[str, int]:
+        """Число устаревших подключений, ожидающих синхронизации, по банкам."""
+        picked = self._pick().limit(None).subquery()
+        async with AsyncSessionLocal() as db:
+            rows = await db.execute(
+                select(models.ConnectedBank.bank_name, func.count())
+                .where(models.ConnectedBank.id.in_(select(picked.c.id)))
+                .group_by(models.ConnectedBank.bank_name)
+            )
+            return {bank_name: count for bank_name, count in rows}
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._runner is not None,
+            "interval_s": self.interval,
+            "budget": self.budget,
+            "concurrency": self.concurrency,
+            "stats": dict(self.stats),
+            "banks": {name: stats.snapshot() for name, stats in self._banks.items()},
+        }
+
+
+# Единственный экземпляр на процесс
+account_sync_scheduler = AccountSyncScheduler()
+
+
+async def main() -> None:
+    """Отдельный процесс синхронизации счетов: python account_sync_scheduler.py"""
+    from bank_tokens import bank_token_cache
+    from database import async_engine
+
+    logging.basicConfig(level=logging.INFO)
+    await bank_clients.start()
+    await bank_registry.start()
+    await bank_token_cache.start()
+    await account_sync_scheduler.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(account_sync_scheduler.interval, 1))
+            except asyncio.TimeoutError:
+                logger.info(f"Accounts sync: {account_sync_scheduler.snapshot()}")
+    finally:
+        await account_sync_scheduler.stop()
+        await bank_token_cache.stop()
+        await bank_registry.stop()
+        await bank_clients.stop()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
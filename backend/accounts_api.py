@@ -1,44 +1,56 @@
 # finance-app-master/accounts_api.py
+import asyncio
+import time
 import httpx
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from sqlalchemy import literal_column, select, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import Optional, List
-from datetime import date
+from datetime import date, datetime, timedelta, timezone
 import models
-from database import get_db
+from database import get_db, get_async_db
 from deps import user_is_admin_or_self, get_current_user
-from utils import get_bank_token
+from utils import get_bank_token, logger
+from bank_client import bank_clients, BankUnavailableError, DEGRADED_HEADER
+from bank_registry import bank_registry, BankInfo
 from schemas import AccountListResponse, AccountSchema, AccountUpdate
+from config import ACCOUNT_REFRESH_FRESH_FOR
 
 router = APIRouter(
     prefix="/users/{user_id}/accounts",
     tags=["accounts"]
 )
 
-@router.post("/{connection_id}/refresh", summary="Обновить и сохранить счета из банка в БД")
-async def refresh_and_save_accounts(
-    user_id: int,
-    connection_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_user)
-):
+# Плоская проекция для AccountSchema: поля счета и его подключения одним JOIN,
+# без построения ORM-объектов Account/ConnectedBank
+ACCOUNT_PROJECTION = (
+    *(models.Account.__table__.c[name] for name in AccountSchema.model_fields if name in models.Account.__table__.c),
+    models.ConnectedBank.bank_name,
+    models.ConnectedBank.bank_client_id,
+    models.ConnectedBank.bank_id,
+)
+
+
+async def sync_connection_accounts(db: AsyncSession, conn: models.ConnectedBank, bank_config: BankInfo) -> dict:
     """
-    Принудительно запрашивает данные о счетах и балансах у банка
-    для конкретного подключения и сохраняет/обновляет их в базе данных.
+    Запрашивает у банка счета и балансы подключения, сохраняет их одним
+    upsert и отмечает время синхронизации (accounts_synced_at).
+    Общая часть эндпоинта обновления и фоновой account_sync_scheduler.py.
     """
-    conn = db.query(models.ConnectedBank).filter(
-        models.ConnectedBank.id == connection_id,
-        models.ConnectedBank.user_id == user_id
-    ).first()
+    timings = {}
+    phase_started = time.perf_counter()
 
-    if not conn or conn.status != "active" or not conn.consent_id:
-        raise HTTPException(status_code=404, detail="Active connection not found or consent is missing.")
+    def finish_phase(name: str):
+        nonlocal phase_started
+        now = time.perf_counter()
+        timings[name] = round((now - phase_started) * 1000, 1)
+        phase_started = now
 
-    bank_config = db.query(models.Bank).filter(models.Bank.name == conn.bank_name).first()
-    if not bank_config:
-         raise HTTPException(status_code=500, detail="Bank configuration not found.")
+    bank_access_token = await get_bank_token(conn.bank_name)
+    finish_phase("bank_token")
 
-    bank_access_token = await get_bank_token(conn.bank_name, db)
     headers = {
         "Authorization": f"Bearer {bank_access_token}",
         "X-Requesting-Bank": bank_config.client_id,
@@ -48,63 +60,138 @@ async def refresh_and_save_accounts(
     params = {"client_id": conn.bank_client_id}
     
     accounts_list = []
-    async with httpx.AsyncClient() as client:
-        try:
-            accounts_url = f"{bank_config.base_url}/accounts"
-            accounts_response = await client.get(accounts_url, headers=headers, params=params)
-            accounts_response.raise_for_status()
-            accounts_list = accounts_response.json().get("data", {}).get("account", [])
-        except (httpx.RequestError, httpx.HTTPStatusError) as e:
-            raise HTTPException(status_code=502, detail=f"Failed to fetch accounts from {conn.bank_name}: {e}")
-
-        updated_count = 0
-        created_count = 0
-        for acc_data in accounts_list:
-            api_acc_id = acc_data.get("accountId")
-            if not api_acc_id:
-                continue
-
-            balances_list = []
+    client = bank_clients.get(conn.bank_name)
+    try:
+        accounts_url = f"{bank_config.base_url}/accounts"
+        accounts_response = await client.get(accounts_url, headers=headers, params=params)
+        accounts_response.raise_for_status()
+        accounts_list = accounts_response.json().get("data", {}).get("account", [])
+    except (httpx.RequestError, httpx.HTTPStatusError) as e:
+        raise HTTPException(status_code=502, detail=f"Failed to fetch accounts from {conn.bank_name}: {e}")
+    finish_phase("fetch_accounts")
+
+    # Один счет может прийти дважды — оставляем последнюю версию
+    accounts_by_id = {acc_data["accountId"]: acc_data for acc_data in accounts_list if acc_data.get("accountId")}
+
+    # Балансы запрашиваем параллельно, но не больше лимита на банк
+    semaphore = bank_clients.semaphore(conn.bank_name)
+
+    async def fetch_balances(api_acc_id: str) -> list:
+        async with semaphore:
             try:
                 balances_url = f"{bank_config.base_url}/accounts/{api_acc_id}/balances"
                 balances_response = await client.get(balances_url, headers=headers, params=params)
                 balances_response.raise_for_status()
-                balances_list = balances_response.json().get("data", {}).get("balance", [])
+                return balances_response.json().get("data", {}).get("balance", [])
             except (httpx.RequestError, httpx.HTTPStatusError):
-                pass 
+                return []
 
-            db_account = db.query(models.Account).filter_by(api_account_id=api_acc_id, connection_id=conn.id).first()
+    balances_lists = await asyncio.gather(*(fetch_balances(api_acc_id) for api_acc_id in accounts_by_id))
+    finish_phase("fetch_balances")
 
-            if db_account:
-                db_account.status = acc_data.get("status")
-                db_account.currency = acc_data.get("currency")
-                db_account.nickname = acc_data.get("nickname")
-                db_account.owner_data = acc_data.get("account")
-                db_account.balance_data = balances_list
-                updated_count += 1
-            else: 
-                new_db_account = models.Account(
-                    connection_id=conn.id,
-                    api_account_id=api_acc_id,
-                    status=acc_data.get("status"),
-                    currency=acc_data.get("currency"),
-                    account_type=acc_data.get("accountType"),
-                    account_subtype=acc_data.get("accountSubType"),
-                    nickname=acc_data.get("nickname"),
-                    opening_date=acc_data.get("openingDate"),
-                    owner_data=acc_data.get("account"),
-                    balance_data=balances_list
-                )
-                db.add(new_db_account)
+    # Один INSERT ... ON CONFLICT на все счета вместо SELECT + INSERT/UPDATE на каждый
+    updated_count = 0
+    created_count = 0
+    if accounts_by_id:
+        rows = [
+            {
+                "connection_id": conn.id,
+                "api_account_id": api_acc_id,
+                "status": acc_data.get("status"),
+                "currency": acc_data.get("currency"),
+                "account_type": acc_data.get("accountType"),
+                "account_subtype": acc_data.get("accountSubType"),
+                "nickname": acc_data.get("nickname"),
+                "opening_date": acc_data.get("openingDate"),
+                "owner_data": acc_data.get("account"),
+                "balance_data": balances_list,
+            }
+            for (api_acc_id, acc_data), balances_list in zip(accounts_by_id.items(), balances_lists)
+        ]
+        stmt = insert(models.Account).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Account.connection_id, models.Account.api_account_id],
+            set_={
+                "status": stmt.excluded.status,
+                "currency": stmt.excluded.currency,
+                "nickname": stmt.excluded.nickname,
+                "owner_data": stmt.excluded.owner_data,
+                "balance_data": stmt.excluded.balance_data,
+            },
+        ).returning(literal_column("xmax = 0").label("inserted"))
+
+        for inserted in (await db.execute(stmt)).scalars():
+            if inserted:
                 created_count += 1
-    
-    db.commit()
+            else:
+                updated_count += 1
+
+    conn.accounts_synced_at = datetime.now(timezone.utc)
+    await db.commit()
+    finish_phase("db_upsert")
+    logger.info(f"Accounts refresh for connection {conn.id}: {timings} ms")
+
+    return {"created": created_count, "updated": updated_count, "timings_ms": timings}
 
+
+@router.post("/{connection_id}/refresh", summary="Обновить и сохранить счета из банка в БД")
+async def refresh_and_save_accounts(
+    user_id: int,
+    connection_id: int,
+    response: Response,
+    force: bool = Query(False, description="Запросить банк, даже если счета недавно синхронизированы"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Принудительно запрашивает данные о счетах и балансах у банка
+    для конкретного подключения и сохраняет/обновляет их в базе данных.
+
+    Счета держит свежими фоновая синхронизация (account_sync_scheduler.py),
+    поэтому если они синхронизированы не раньше ACCOUNT_REFRESH_FRESH_FOR
+    секунд назад, банк не запрашивается (status="fresh"), если не передан
+    force=true. Вызов отмечает подключение как просмотренное (last_viewed_at):
+    такие подключения фоновая синхронизация обновляет в первую очередь.
+    Пока банк недоступен (см. bank_client.py), ответ — status="degraded"
+    с заголовком X-Bank-Degraded: в базе остаются счета на момент synced_at.
+    """
+    conn = await db.scalar(select(models.ConnectedBank).where(
+        models.ConnectedBank.id == connection_id,
+        models.ConnectedBank.user_id == user_id
+    ))
+
+    if not conn or conn.status != "active" or not conn.consent_id:
+        raise HTTPException(status_code=404, detail="Active connection not found or consent is missing.")
+
+    bank_config = await bank_registry.fetch_by_name(conn.bank_name)
+    if not bank_config:
+         raise HTTPException(status_code=500, detail="Bank configuration not found.")
+
+    now = datetime.now(timezone.utc)
+    conn.last_viewed_at = now
+    if not force and conn.accounts_synced_at and now - conn.accounts_synced_at < timedelta(seconds=ACCOUNT_REFRESH_FRESH_FOR):
+        await db.commit()
+        return {
+            "status": "fresh",
+            "message": f"Accounts for connection {connection_id} are up to date.",
+            "synced_at": conn.accounts_synced_at,
+        }
+
+    try:
+        result = await sync_connection_accounts(db, conn, bank_config)
+    except BankUnavailableError as e:
+        await db.commit()
+        response.headers[DEGRADED_HEADER] = conn.bank_name
+        return {
+            "status": "degraded",
+            "message": str(e),
+            "synced_at": conn.accounts_synced_at,
+            "retry_after": e.retry_after,
+        }
     return {
         "status": "success",
         "message": f"Accounts for connection {connection_id} refreshed.",
-        "created": created_count,
-        "updated": updated_count
+        **result,
     }
 
 
@@ -120,17 +207,22 @@ def get_saved_accounts(
     Возвращает список счетов пользователя, сохраненных в базе данных.
     Доступна фильтрация по названию банка и ID счета.
     """
-    query = db.query(models.Account).join(models.ConnectedBank).filter(models.ConnectedBank.user_id == user_id)
+    # Один запрос независимо от числа счетов
+    query = (
+        select(*ACCOUNT_PROJECTION)
+        .join_from(models.Account, models.ConnectedBank)
+        .where(models.ConnectedBank.user_id == user_id)
+    )
 
     if bank_name:
-        query = query.filter(models.ConnectedBank.bank_name == bank_name)
+        query = query.where(models.ConnectedBank.bank_name == bank_name)
     
     if api_account_id:
-        query = query.filter(models.Account.api_account_id == api_account_id)
+        query = query.where(models.Account.api_account_id == api_account_id)
 
-    accounts_from_db = query.all()
+    accounts_from_db = db.execute(query).mappings().all()
     
-    return AccountListResponse(count=len(accounts_from_db), accounts=accounts_from_db)
+    return {"count": len(accounts_from_db), "accounts": accounts_from_db}
   
 
 # 2. ДОБАВЛЯЕМ НОВЫЙ МЕТОД ДЛЯ ОБНОВЛЕНИЯ
@@ -145,23 +237,25 @@ def update_account_details(
     """
     Обновляет пользовательские данные для счета, такие как дата выписки и платежа.
     """
-    # Ищем счет и проверяем, что он принадлежит текущему пользователю
-    db_account = db.query(models.Account).join(models.ConnectedBank).filter(
-        models.Account.id == account_id,
-        models.ConnectedBank.user_id == user_id
-    ).first()
+    # Счет должен принадлежать пользователю: условие на подключение в том же запросе
+    owned = (
+        (models.Account.id == account_id)
+        & (models.Account.connection_id == models.ConnectedBank.id)
+        & (models.ConnectedBank.user_id == user_id)
+    )
+    update_dict = update_data.model_dump(exclude_unset=True)
+    if update_dict:
+        # UPDATE ... FROM connected_banks ... RETURNING: обновление и ответ одним запросом
+        db_account = db.execute(
+            update(models.Account).where(owned).values(**update_dict).returning(*ACCOUNT_PROJECTION)
+        ).mappings().first()
+        db.commit()
+    else:
+        db_account = db.execute(select(*ACCOUNT_PROJECTION).where(owned)).mappings().first()
 
     if not db_account:
         raise HTTPException(status_code=404, detail="Account not found or access denied.")
 
-    # Обновляем поля из полученных данных
-    update_dict = update_data.model_dump(exclude_unset=True)
-    for key, value in update_dict.items():
-        setattr(db_account, key, value)
-    
-    db.commit()
-    db.refresh(db_account)
-    
     return db_account
     # # Формируем ответ, аналогично get_saved_accounts
     # acc_dict = {
@@ -0,0 +1,100 @@
+# finance-app-master/admin_api.py
+from fastapi import APIRouter, Depends
+
+import models
+from deps import get_current_admin_user
+from bank_client import bank_clients
+from bank_tokens import bank_token_cache
+from db_pool import db_pool_monitor
+from password_hasher import password_hasher
+from principal_cache import principal_cache
+from principal_revocations import principal_revocations
+from scheduled_payment_worker import scheduled_payment_worker
+from payment_status_poller import payment_status_poller
+from consent_watcher import consent_watcher
+from consent_events import consent_events
+from account_sync_scheduler import account_sync_scheduler
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/bank-tokens", summary="Состояние кэша токенов банков (Только для администраторов)")
+def get_bank_token_cache_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """
+    Возвращает счетчики кэша токенов (hits / misses / refreshes)
+    и сроки жизни закэшированных токенов по каждому банку.
+    """
+    return bank_token_cache.snapshot()
+
+
+@router.get("/db-pool", summary="Состояние пулов соединений с БД (Только для администраторов)")
+def get_db_pool_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """
+    Возвращает для каждого пула (sync / async) занятые соединения, overflow,
+    гистограмму ожидания свободного соединения и соединения, удерживаемые
+    дольше порога, вместе с маршрутом, который их держит.
+    """
+    return db_pool_monitor.snapshot()
+
+
+@router.get("/password-hasher", summary="Состояние пула bcrypt (Только для администраторов)")
+def get_password_hasher_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """
+    Возвращает число потоков bcrypt, текущую глубину очереди
+    и счетчики выполненных / отклоненных (503) операций.
+    """
+    return password_hasher.snapshot()
+
+
+@router.get("/principal-cache", summary="Состояние кэша пользователей (Только для администраторов)")
+def get_principal_cache_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """Размер кэша аутентифицированных пользователей, число отозванных, счетчики попаданий и слушатель отзывов."""
+    return {**principal_cache.snapshot(), "revocations": principal_revocations.snapshot()}
+
+
+@router.get("/scheduled-payments-worker", summary="Исполнение автоплатежей (Только для администраторов)")
+def get_scheduled_payments_worker_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """Пропускная способность, задержка и ошибки исполнения автоплатежей по банкам (в этом процессе)."""
+    return scheduled_payment_worker.snapshot()
+
+
+@router.get("/payment-status-poller", summary="Фоновая проверка статусов платежей (Только для администраторов)")
+def get_payment_status_poller_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """Число проверенных и изменившихся статусов платежей и ошибки по банкам (в этом процессе)."""
+    return payment_status_poller.snapshot()
+
+
+@router.get("/consent-watcher", summary="Фоновая проверка согласий (Только для администраторов)")
+def get_consent_watcher_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """Проверки подключений и согласий на платежи в банках и доставка событий в SSE-потоки (в этом процессе)."""
+    return {"watcher": consent_watcher.snapshot(), "events": consent_events.snapshot()}
+
+
+@router.get("/account-sync", summary="Фоновая синхронизация счетов (Только для администраторов)")
+async def get_account_sync_state(
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """Синхронизации и ошибки по банкам (в этом процессе) и очередь устаревших подключений по банкам (общая)."""
+    return {**account_sync_scheduler.snapshot(), "backlog": await account_sync_scheduler.backlog()}
+
+
+@router.get("/bank-health", summary="Выключатели и ограничители частоты запросов к банкам (Только для администраторов)")
+async def get_bank_health(  # async: состояние читается в цикле событий, а не из пула потоков
+    current_admin: models.User = Depends(get_current_admin_user)
+):
+    """Состояние выключателя (closed/open/half_open) и заполненность ограничителя частоты по банкам (в этом процессе)."""
+    return bank_clients.snapshot()
@@ -0,0 +1,32 @@
+"""add payment history index
+
+Revision ID: 3995a79950ff
+Revises: fade286b6074
+Create Date: 2026-10-17 06:27:27.391958
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3995a79950ff'
+down_revision: Union[str, Sequence[str], None] = 'fade286b6074'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY — без блокировки записи в payments (см. c22706fa2187)
+    with op.get_context().autocommit_block():
+        op.create_index('ix_payments_user_created', 'payments', ['user_id', 'created_at', 'id'], unique=False,
+                        postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_payments_user_created', table_name='payments', postgresql_concurrently=True)
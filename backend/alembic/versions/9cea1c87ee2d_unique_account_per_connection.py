@@ -0,0 +1,68 @@
+"""Unique account per connection
+
+Revision ID: 9cea1c87ee2d
+Revises: 3f93ee99acb9
+Create Date: 2026-10-17 06:07:12.613680
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9cea1c87ee2d'
+down_revision: Union[str, Sequence[str], None] = '3f93ee99acb9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# Ссылки на accounts.id без ON DELETE CASCADE: перед удалением дублей переводятся на оставшийся счет
+ACCOUNT_REFERENCES = (
+    ("payments", "debtor_account_id"),
+    ("scheduled_payments", "debtor_account_id"),
+    ("scheduled_payments", "creditor_account_id"),
+)
+
+DUPLICATES = """
+    SELECT id, max(id) OVER (PARTITION BY connection_id, api_account_id) AS keep_id
+    FROM accounts
+    WHERE connection_id IS NOT NULL AND api_account_id IS NOT NULL
+"""
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Раньше счета сохранялись через SELECT, затем INSERT, без ограничения, поэтому в БД
+    # могут быть дубли (connection_id, api_account_id): остается самая новая строка.
+    for table, column in ACCOUNT_REFERENCES:
+        op.execute(f"""
+            WITH duplicates AS ({DUPLICATES})
+            UPDATE {table} SET {column} = duplicates.keep_id
+            FROM duplicates
+            WHERE {table}.{column} = duplicates.id AND duplicates.id <> duplicates.keep_id
+        """)
+    op.execute(f"""
+        WITH duplicates AS ({DUPLICATES})
+        DELETE FROM accounts USING duplicates
+        WHERE accounts.id = duplicates.id AND duplicates.id <> duplicates.keep_id
+    """)
+    # Уникальный индекс строится CONCURRENTLY (без блокировки записи в accounts) вне
+    # транзакции, затем становится ограничением — это только короткая блокировка.
+    # Если построение прервется (например, из-за нового дубля), в БД останется
+    # INVALID-индекс: его нужно удалить (DROP INDEX) перед повторным запуском.
+    with op.get_context().autocommit_block():
+        op.create_index('uq_accounts_connection_api_account', 'accounts', ['connection_id', 'api_account_id'],
+                        unique=True, postgresql_concurrently=True)
+    op.execute(
+        "ALTER TABLE accounts ADD CONSTRAINT uq_accounts_connection_api_account "
+        "UNIQUE USING INDEX uq_accounts_connection_api_account"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # ### commands auto generated by Alembic - please adjust! ###
+    op.drop_constraint('uq_accounts_connection_api_account', 'accounts', type_='unique')
+    # ### end Alembic commands ###
@@ -0,0 +1,40 @@
+"""add missing user_id indexes
+
+Revision ID: c22706fa2187
+Revises: 3995a79950ff
+Create Date: 2026-10-17 06:28:12.244478
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c22706fa2187'
+down_revision: Union[str, Sequence[str], None] = '3995a79950ff'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CREATE INDEX CONCURRENTLY не блокирует запись в таблицы, но не может
+    # выполняться в транзакции. Если построение прервется, в БД останется
+    # INVALID-индекс: его нужно удалить (DROP INDEX) перед повторным запуском.
+    with op.get_context().autocommit_block():
+        op.create_index(op.f('ix_connected_banks_user_id'), 'connected_banks', ['user_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_payment_consents_user_id'), 'payment_consents', ['user_id'], unique=False, postgresql_concurrently=True)
+        op.create_index(op.f('ix_scheduled_payments_user_id'), 'scheduled_payments', ['user_id'], unique=False, postgresql_concurrently=True)
+        op.create_index('ix_scheduled_payments_active_next_date', 'scheduled_payments', ['next_payment_date'], unique=False,
+                        postgresql_where=sa.text('is_active'), postgresql_concurrently=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_scheduled_payments_active_next_date', table_name='scheduled_payments', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_scheduled_payments_user_id'), table_name='scheduled_payments', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_payment_consents_user_id'), table_name='payment_consents', postgresql_concurrently=True)
+        op.drop_index(op.f('ix_connected_banks_user_id'), table_name='connected_banks', postgresql_concurrently=True)
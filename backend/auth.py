@@ -1,14 +1,16 @@
 # auth.py
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import JWTError
 from starlette.requests import Request
 from urllib.parse import unquote
 
-from database import get_db
+from database import get_async_db
 from models import User
-from security import verify_password, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, get_password_hash
+from security import create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from password_hasher import password_hasher
 from schemas import UserLogin, Token, UserCreate,UserResponse, TokenWithUser
 from datetime import timedelta
 from utils import log_request, logger
@@ -16,34 +18,42 @@ from utils import log_request, logger
 router = APIRouter(prefix="/auth", tags=["auth"])
 
 
-def authenticate_user(db: Session, email: str, password: str):
-    user = db.query(User).filter(User.email == email).first()
-    if not user or not verify_password(password, user.hashed_password):
+async def authenticate_user(db: AsyncSession, email: str, password: str):
+    user = await db.scalar(select(User).where(User.email == email))
+    if not user:
         return False
+    # bcrypt выполняется в отдельном пуле потоков, а не в event loop
+    verified, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not verified:
+        return False
+    if new_hash:
+        # Стоимость хеша изменилась (BCRYPT_ROUNDS) — сохраняем пересчитанный хеш
+        user.hashed_password = new_hash
+        await db.commit()
     return user
 
 
 @router.post("/register", response_model=UserResponse)
-def register(user: UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.email == user.email).first()
+async def register(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(User).where(User.email == user.email))
     if db_user:
         raise HTTPException(status_code=400, detail="Email already registered")
-    hashed_pw = get_password_hash(user.password)
+    hashed_pw = await password_hasher.hash(user.password)
     new_user = User(email=user.email, hashed_password=hashed_pw)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
+    await db.refresh(new_user)
     return new_user
 
 @router.post("/login", response_model=TokenWithUser) # <-- ИЗМЕНЕНИЕ 1: используем новую модель
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     email = form_data.username
     password = form_data.password
 
-    user_obj = authenticate_user(db, email, password)
+    user_obj = await authenticate_user(db, email, password)
     if not user_obj:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -53,7 +63,9 @@ async def login(
     
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
-        data={"sub": user_obj.email}, expires_delta=access_token_expires
+        # user_id и is_admin в токене позволяют проверять права без обращения к БД (см. deps.py)
+        data={"sub": user_obj.email, "user_id": user_obj.id, "is_admin": bool(user_obj.is_admin)},
+        expires_delta=access_token_expires
     )
     # v-- ИЗМЕНЕНИЕ 2: добавляем user_id в ответ --v
     return {
@@ -0,0 +1,367 @@
+# finance-app-master/bank_client.py
+import asyncio
+import httpx
+import logging
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+from config import (
+    BANK_HTTP_MAX_CONNECTIONS,
+    BANK_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    BANK_HTTP_KEEPALIVE_EXPIRY,
+    BANK_HTTP_CONNECT_TIMEOUT,
+    BANK_HTTP_READ_TIMEOUT,
+    BANK_HTTP_WRITE_TIMEOUT,
+    BANK_HTTP_POOL_TIMEOUT,
+    BANK_HTTP2,
+    BANK_FANOUT_CONCURRENCY,
+    BANK_RATE_LIMIT,
+    BANK_RATE_BURST,
+    BANK_RATE_MAX_WAIT,
+    BANK_RETRY_AFTER_MAX,
+    BANK_BREAKER_FAILURE_THRESHOLD,
+    BANK_BREAKER_RESET_TIMEOUT,
+)
+
+logger = logging.getLogger("uvicorn")
+
+# Заголовок ответа API: данные отданы из локального хранилища, потому что банк недоступен
+DEGRADED_HEADER = "X-Bank-Degraded"
+
+
+class BankUnavailableError(Exception):
+    """
+    Запрос к банку не отправлен: выключатель разомкнут или очередь
+    ограничителя частоты длиннее допустимого. Намеренно не наследует
+    httpx.RequestError, чтобы не превращаться в 502 в обработчиках
+    конкретных запросов: в main.py он отдается как 503 с Retry-After.
+    """
+
+    def __init__(self, bank_name: str, reason: str, retry_after: float):
+        super().__init__(f"Bank '{bank_name}' is temporarily unavailable ({reason}), retry in {retry_after:.0f}s")
+        self.bank_name = bank_name
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After в секундах: число секунд или HTTP-дата."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов к одному банку. Токен резервируется
+    сразу (счетчик может уйти в минус), поэтому ожидающие запросы
+    выстраиваются в очередь без блокировок. Retry-After из ответа банка
+    сдвигает начало очереди (paused_until).
+    """
+
+    def __init__(self, rate: float, burst: int, max_wait: float):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_wait = max_wait
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.waiting = 0
+        self.stats = {"acquired": 0, "delayed": 0, "rejected": 0, "retry_after": 0, "wait_ms_total": 0.0}
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self, now: float) -> float:
+        """Резервирует токен и возвращает, сколько секунд ждать."""
+        if self.rate <= 0:
+            return max(self.paused_until - now, 0.0)
+        self._refill(now)
+        self.tokens -= 1
+        return max(self.paused_until - now, -self.tokens / self.rate, 0.0)
+
+    async def acquire(self, bank_name: str) -> None:
+        delay = self._reserve(time.monotonic())
+        if delay > self.max_wait:
+            if self.rate > 0:
+                self.tokens += 1
+            self.stats["rejected"] += 1
+            raise BankUnavailableError(bank_name, "rate limited", delay)
+        self.stats["acquired"] += 1
+        if delay > 0:
+            self.stats["delayed"] += 1
+            self.stats["wait_ms_total"] += delay * 1000
+            self.waiting += 1
+            try:
+                await asyncio.sleep(delay)
+            finally:
+                self.waiting -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Не отправлять запросы seconds секунд (Retry-After)."""
+        self.stats["retry_after"] += 1
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        # Только расчет: состояние ограничителя меняет лишь цикл событий (_reserve)
+        tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        return {
+            "rate_per_s": self.rate,
+            "burst": self.burst,
+            "tokens": round(tokens, 1) if self.rate > 0 else None,
+            "waiting": self.waiting,
+            "paused_for_s": round(max(self.paused_until - now, 0.0), 1),
+            "stats": dict(self.stats, wait_ms_total=round(self.stats["wait_ms_total"], 1)),
+        }
+
+
+class CircuitBreaker:
+    """
+    Выключатель запросов к одному банку: closed -> (failure_threshold
+    ошибок подряд) -> open -> (через reset_timeout) half_open -> один
+    пробный запрос -> closed при успехе или снова open при ошибке.
+    В состоянии open запросы отклоняются сразу, без ожидания таймаутов.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.open_for = reset_timeout
+        self._probing = False
+        self.last_error: Optional[str] = None
+        self.stats = {"opened": 0, "rejected": 0, "failures": 0}
+
+    def before_request(self, bank_name: str) -> None:
+        if self.state == self.CLOSED:
+            return
+        remaining = self.opened_at + self.open_for - time.monotonic()
+        if self.state == self.OPEN and remaining <= 0:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probing:
+            self._probing = True
+            return
+        self.stats["rejected"] += 1
+        raise BankUnavailableError(bank_name, f"circuit {self.state}", max(remaining, 1.0))
+
+    def record_success(self, bank_name: str) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"Circuit for bank '{bank_name}' closed after successful probe")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, bank_name: str, error: str, retry_after: Optional[float] = None) -> None:
+        self.stats["failures"] += 1
+        self.failures += 1
+        self.last_error = error
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                self.stats["opened"] += 1
+                logger.warning(f"Circuit for bank '{bank_name}' opened after {self.failures} failures: {error}")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+            self.open_for = max(self.reset_timeout, retry_after or 0.0)
+
+    def record_cancel(self) -> None:
+        """Запрос не дошел до банка (отклонен ограничителем или отменен) — результата нет."""
+        self._probing = False
+
+    def snapshot(self) -> dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "open_for_s": round(max(self.opened_at + self.open_for - time.monotonic(), 0.0), 1) if self.state == self.OPEN else 0.0,
+            "last_error": self.last_error,
+            "stats": dict(self.stats),
+        }
+
+
+class GuardedTransport(httpx.AsyncBaseTransport):
+    """
+    Транспорт клиента банка: выключатель и ограничитель частоты перед
+    отправкой, учет ошибок и Retry-After после. Так они действуют на все
+    запросы к банку (токены, счета, платежи, фоновые задачи) без
+    изменений в местах вызова.
+    """
+
+    def __init__(self, bank_name: str, inner: httpx.AsyncBaseTransport, limiter: TokenBucket, breaker: CircuitBreaker):
+        self.bank_name = bank_name
+        self.inner = inner
+        self.limiter = limiter
+        self.breaker = breaker
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        self.breaker.before_request(self.bank_name)
+        try:
+            await self.limiter.acquire(self.bank_name)
+            response = await self.inner.handle_async_request(request)
+        except httpx.TransportError as e:
+            self.breaker.record_failure(self.bank_name, f"{type(e).__name__}: {e}")
+            raise
+        except BaseException:
+            self.breaker.record_cancel()
+            raise
+
+        retry_after = None
+        if response.status_code in (429, 503):
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                retry_after = min(retry_after, BANK_RETRY_AFTER_MAX)
+                self.limiter.pause(retry_after)
+        if response.status_code >= 500:
+            self.breaker.record_failure(self.bank_name, f"HTTP {response.status_code}", retry_after)
+        elif response.status_code == 429:
+            # Банк просит притормозить, но работает: выключатель не трогаем, Retry-After уже учтен
+            self.breaker.record_cancel()
+        else:
+            self.breaker.record_success(self.bank_name)
+        return response
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+class BankClientRegistry:
+    """
+    Реестр долгоживущих HTTP-клиентов: по одному httpx.AsyncClient
+    (и, соответственно, одному пулу keep-alive соединений) на каждый банк.
+
+    Открывается и закрывается в lifespan приложения (main.py).
+    Клиент для банка создается лениво при первом обращении; все его
+    запросы проходят через выключатель и ограничитель частоты этого банка
+    (GuardedTransport).
+    """
+
+    def __init__(
+        self,
+        max_connections: int = BANK_HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections: int = BANK_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry: float = BANK_HTTP_KEEPALIVE_EXPIRY,
+        connect_timeout: float = BANK_HTTP_CONNECT_TIMEOUT,
+        read_timeout: float = BANK_HTTP_READ_TIMEOUT,
+        write_timeout: float = BANK_HTTP_WRITE_TIMEOUT,
+        pool_timeout: float = BANK_HTTP_POOL_TIMEOUT,
+        http2: bool = BANK_HTTP2,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+        fanout_concurrency: int = BANK_FANOUT_CONCURRENCY,
+        rate_limit: float = BANK_RATE_LIMIT,
+        rate_burst: int = BANK_RATE_BURST,
+        rate_max_wait: float = BANK_RATE_MAX_WAIT,
+        breaker_failure_threshold: int = BANK_BREAKER_FAILURE_THRESHOLD,
+        breaker_reset_timeout: float = BANK_BREAKER_RESET_TIMEOUT,
+    ):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.timeout = httpx.Timeout(
+            connect=connect_timeout,
+            read=read_timeout,
+            write=write_timeout,
+            pool=pool_timeout,
+        )
+        self.http2 = http2
+        # Подменяемый транспорт (например, httpx.MockTransport в бенчмарках)
+        self.transport = transport
+        self.fanout_concurrency = fanout_concurrency
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.rate_max_wait = rate_max_wait
+        self.breaker_failure_threshold = breaker_failure_threshold
+        self.breaker_reset_timeout = breaker_reset_timeout
+        # Живут дольше клиентов: пересоздание закрытого клиента не сбрасывает состояние банка
+        self._limiters: Dict[str, TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+
+    def limiter(self, bank_name: str) -> TokenBucket:
+        limiter = self._limiters.get(bank_name)
+        if limiter is None:
+            limiter = TokenBucket(self.rate_limit, self.rate_burst, self.rate_max_wait)
+            self._limiters[bank_name] = limiter
+        return limiter
+
+    def breaker(self, bank_name: str) -> CircuitBreaker:
+        breaker = self._breakers.get(bank_name)
+        if breaker is None:
+            breaker = CircuitBreaker(self.breaker_failure_threshold, self.breaker_reset_timeout)
+            self._breakers[bank_name] = breaker
+        return breaker
+
+    def is_available(self, bank_name: str) -> bool:
+        """False, пока выключатель банка разомкнут (запросы будут отклонены сразу)."""
+        return self.breaker(bank_name).state != CircuitBreaker.OPEN
+
+    def _create_client(self, bank_name: str) -> httpx.AsyncClient:
+        logger.info(f"Opening HTTP connection pool for bank '{bank_name}' (http2={self.http2})")
+        # С явным транспортом limits и http2 клиента не действуют — задаем их транспорту
+        inner = self.transport or httpx.AsyncHTTPTransport(limits=self.limits, http2=self.http2)
+        transport = GuardedTransport(bank_name, inner, self.limiter(bank_name), self.breaker(bank_name))
+        return httpx.AsyncClient(timeout=self.timeout, transport=transport)
+
+    def get(self, bank_name: str) -> httpx.AsyncClient:
+        """Возвращает общий клиент для банка, создавая его при необходимости."""
+        client = self._clients.get(bank_name)
+        if client is None or client.is_closed:
+            client = self._create_client(bank_name)
+            self._clients[bank_name] = client
+        return client
+
+    def semaphore(self, bank_name: str) -> asyncio.Semaphore:
+        """
+        Общий для процесса лимит параллельных запросов к банку для "веерных"
+        операций: `async with bank_clients.semaphore(name): ...`
+        """
+        semaphore = self._semaphores.get(bank_name)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.fanout_concurrency)
+            self._semaphores[bank_name] = semaphore
+        return semaphore
+
+    def snapshot(self) -> dict:
+        """Состояние выключателя и ограничителя частоты по банкам."""
+        return {
+            bank_name: {
+                "circuit": self.breaker(bank_name).snapshot(),
+                "rate_limiter": self.limiter(bank_name).snapshot(),
+            }
+            for bank_name in sorted(set(self._breakers) | set(self._limiters))
+        }
+
+    async def start(self) -> None:
+        logger.info("Bank HTTP client registry started")
+
+    async def stop(self) -> None:
+        """Закрывает все пулы соединений. Вызывается при остановке приложения."""
+        clients, self._clients = self._clients, {}
+        for bank_name, client in clients.items():
+            try:
+                await client.aclose()
+            except Exception as e:
+                logger.error(f"Failed to close HTTP client for bank '{bank_name}': {e}")
+        logger.info("Bank HTTP client registry stopped")
+
+
+# Единственный экземпляр на процесс
+bank_clients = BankClientRegistry()
@@ -0,0 +1,228 @@
+# finance-app-master/bank_registry.py
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import List, Mapping, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import models
+from database import SessionLocal
+from bank_tokens import bank_token_cache
+from config import BANK_REGISTRY_RELOAD_INTERVAL, BANK_REGISTRY_MISS_RELOAD_INTERVAL
+
+logger = logging.getLogger("uvicorn")
+
+
+@dataclass(frozen=True)
+class BankInfo:
+    """Неизменяемая копия строки таблицы banks."""
+    id: int
+    name: str
+    client_id: str
+    client_secret: str
+    base_url: str
+    auto_approve: bool
+    icon_filename: Optional[str] = None
+
+    @classmethod
+    def from_model(cls, bank: models.Bank) -> "BankInfo":
+        return cls(
+            id=bank.id,
+            name=bank.name,
+            client_id=bank.client_id,
+            client_secret=bank.client_secret,
+            base_url=bank.base_url,
+            auto_approve=bool(bank.auto_approve),
+            icon_filename=bank.icon_filename,
+        )
+
+
+@dataclass(frozen=True)
+class BankSnapshot:
+    by_name: Mapping[str, BankInfo]
+    by_id: Mapping[int, BankInfo]
+    loaded_at: float
+
+
+class BankRegistry:
+    """
+    Снимок таблицы banks в памяти с индексами по имени и по id.
+
+    Загружается в lifespan приложения и перезагружается:
+    - после коммита любой сессии, изменившей строку Bank (см. слушатели ниже);
+    - периодически в фоне (изменения из других воркеров и скриптов);
+    - при запросе неизвестного банка (не чаще BANK_REGISTRY_MISS_RELOAD_INTERVAL).
+    Снимок заменяется целиком, поэтому читатели всегда видят согласованные данные.
+
+    Внутри event loop перезагрузка по запросу выполняется в фоне
+    (синхронный запрос к БД не блокирует loop): промах get_by_name /
+    get_by_id возвращает None, а банк находится уже следующим запросом.
+    Асинхронный код использует fetch_by_name / fetch_by_id: при промахе
+    они дожидаются этой (одной на процесс) перезагрузки.
+    """
+
+    def __init__(
+        self,
+        reload_interval: float = BANK_REGISTRY_RELOAD_INTERVAL,
+        miss_reload_interval: float = BANK_REGISTRY_MISS_RELOAD_INTERVAL,
+    ):
+        self.reload_interval = reload_interval
+        self.miss_reload_interval = miss_reload_interval
+        self._snapshot: Optional[BankSnapshot] = None
+        self._reloader: Optional[asyncio.Task] = None
+        self._pending_reload: Optional[asyncio.Task] = None
+
+    def load(self) -> BankSnapshot:
+        db = SessionLocal()
+        try:
+            banks = [BankInfo.from_model(bank) for bank in db.query(models.Bank).all()]
+        finally:
+            db.close()
+
+        previous = self._snapshot
+        snapshot = BankSnapshot(
+            by_name=MappingProxyType({bank.name: bank for bank in banks}),
+            by_id=MappingProxyType({bank.id: bank for bank in banks}),
+            loaded_at=time.monotonic(),
+        )
+        self._snapshot = snapshot
+
+        # Если у банка поменялись реквизиты, закэшированный токен больше не годится
+        if previous is not None:
+            for name, bank in snapshot.by_name.items():
+                old = previous.by_name.get(name)
+                if old and (old.base_url, old.client_id, old.client_secret) != (bank.base_url, bank.client_id, bank.client_secret):
+                    bank_token_cache.invalidate(name)
+        return snapshot
+
+    async def reload(self) -> BankSnapshot:
+        return await asyncio.to_thread(self.load)
+
+    async def _reload_in_background(self) -> None:
+        try:
+            await self.reload()
+        except Exception as e:
+            logger.error(f"Failed to reload bank registry: {e}")
+
+    def request_reload(self) -> Optional[BankSnapshot]:
+        """
+        Перезагружает снимок: из event loop — фоновой задачей (возвращает
+        None), из синхронного кода (потоки, скрипты) — сразу.
+        """
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self.load()
+        if self._pending_reload is None or self._pending_reload.done():
+            self._pending_reload = loop.create_task(self._reload_in_background())
+        return None
+
+    @property
+    def snapshot(self) -> BankSnapshot:
+        if self._snapshot is not None:
+            return self._snapshot
+        # Реестр еще не загружен (start() не вызывался)
+        return self.request_reload() or _EMPTY_SNAPSHOT
+
+    def _reload_on_miss(self) -> BankSnapshot:
+        snapshot = self.snapshot
+        if time.monotonic() - snapshot.loaded_at >= self.miss_reload_interval:
+            snapshot = self.request_reload() or snapshot
+        return snapshot
+
+    def get_by_name(self, name: str) -> Optional[BankInfo]:
+        bank = self.snapshot.by_name.get(name)
+        if bank is None:
+            bank = self._reload_on_miss().by_name.get(name)
+        return bank
+
+    def get_by_id(self, bank_id: int) -> Optional[BankInfo]:
+        bank = self.snapshot.by_id.get(bank_id)
+        if bank is None:
+            bank = self._reload_on_miss().by_id.get(bank_id)
+        return bank
+
+    async def _await_reload_on_miss(self) -> BankSnapshot:
+        snapshot = self.snapshot
+        if self._pending_reload is None or self._pending_reload.done():
+            if time.monotonic() - snapshot.loaded_at < self.miss_reload_interval:
+                return snapshot
+            self.request_reload()
+        # shield: отмена запроса не должна отменять общую перезагрузку
+        await asyncio.shield(self._pending_reload)
+        return self.snapshot
+
+    async def fetch_by_name(self, name: str) -> Optional[BankInfo]:
+        bank = self.snapshot.by_name.get(name)
+        if bank is None:
+            bank = (await self._await_reload_on_miss()).by_name.get(name)
+        return bank
+
+    async def fetch_by_id(self, bank_id: int) -> Optional[BankInfo]:
+        bank = self.snapshot.by_id.get(bank_id)
+        if bank is None:
+            bank = (await self._await_reload_on_miss()).by_id.get(bank_id)
+        return bank
+
+    def all(self) -> List[BankInfo]:
+        return sorted(self.snapshot.by_id.values(), key=lambda bank: bank.id)
+
+    async def _reload_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.reload_interval)
+            try:
+                await self.reload()
+            except Exception as e:
+                logger.error(f"Failed to reload bank registry: {e}")
+
+    async def start(self) -> None:
+        await self.reload()
+        logger.info(f"Bank registry loaded: {sorted(self.snapshot.by_name)}")
+        if self._reloader is None:
+            self._reloader = asyncio.create_task(self._reload_loop())
+
+    async def stop(self) -> None:
+        if self._reloader is not None:
+            self._reloader.cancel()
+            try:
+                await self._reloader
+            except asyncio.CancelledError:
+                pass
+            self._reloader = None
+        if self._pending_reload is not None:
+            self._pending_reload.cancel()
+            self._pending_reload = None
+
+
+_EMPTY_SNAPSHOT = BankSnapshot(by_name=MappingProxyType({}), by_id=MappingProxyType({}), loaded_at=float("-inf"))
+
+# Единственный экземпляр на процесс
+bank_registry = BankRegistry()
+
+
+# --- Инвалидация: перезагружаем реестр после коммита, изменившего банки ---
+@event.listens_for(Session, "after_flush")
+def _mark_banks_changed(session, flush_context):
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, models.Bank):
+            session.info["banks_changed"] = True
+            return
+
+
+@event.listens_for(Session, "after_commit")
+def _reload_banks_after_commit(session):
+    if session.info.pop("banks_changed", False):
+        # AsyncSession коммитит внутри event loop — там перезагрузка уходит в фон
+        try:
+            bank_registry.request_reload()
+        except Exception as e:
+            logger.error(f"Failed to reload bank registry after commit: {e}")
+
+
+@event.listens_for(Session, "after_rollback")
+def _forget_banks_changed(session):
+    session.info.pop("banks_changed", None)
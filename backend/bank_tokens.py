@@ -0,0 +1,330 @@
+# finance-app-master/bank_tokens.py
+import asyncio
+import logging
+import time
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, text, update
+from sqlalchemy.dialects.postgresql import insert
+
+import models
+from database import engine
+from bank_client import bank_clients
+from config import (
+    BANK_TOKEN_REFRESH_BEFORE,
+    BANK_TOKEN_REFRESH_INTERVAL,
+    BANK_TOKEN_STORE,
+    BANK_TOKEN_MINT_LEASE,
+    BANK_TOKEN_WAIT_TIMEOUT,
+)
+
+logger = logging.getLogger("uvicorn")
+
+
+@dataclass(frozen=True)
+class BankCredentials:
+    """Все, что нужно для получения токена банка (без обращения к БД)."""
+    bank_name: str
+    base_url: str
+    client_id: str
+    client_secret: str
+
+
+@dataclass(frozen=True)
+class StoredBankToken:
+    token: str
+    expires_at: datetime
+    refresh_at: datetime
+
+
+@dataclass
+class BankTokenEntry:
+    token: str
+    expires_at: datetime
+    refresh_at: datetime
+    credentials: BankCredentials
+
+
+MintFn = Callable[[], Awaitable[StoredBankToken]]
+
+
+class BankTokenStore(ABC):
+    """
+    Общее (L2) хранилище токенов за in-process кэшем BankTokenCache.
+    Реализация решает, можно ли отдать уже сохраненный токен или нужно
+    выпустить новый через mint().
+    """
+
+    @abstractmethod
+    async def get_or_mint(self, bank_name: str, mint: MintFn) -> StoredBankToken:
+        ...
+
+
+class LocalBankTokenStore(BankTokenStore):
+    """Без общего хранилища: каждый процесс выпускает свои токены."""
+
+    async def get_or_mint(self, bank_name: str, mint: MintFn) -> StoredBankToken:
+        return await mint()
+
+
+class PostgresBankTokenStore(BankTokenStore):
+    """
+    Хранит токены в таблице bank_tokens, общей для всех воркеров.
+
+    Если сохраненный токен еще не требует обновления, он просто читается.
+    Иначе воркер пытается занять аренду выпуска (minting_until) условным
+    upsert'ом в короткой транзакции — без ожидания блокировок. Занявший
+    запрашивает токен у банка, не держа ни соединения с БД, ни транзакции,
+    и сохраняет его второй короткой транзакцией. Остальные перечитывают
+    строку, пока не появится новый токен, но не дольше wait_timeout. Если
+    выпускающий воркер упадет, аренда истечет через mint_lease, и токен
+    выпустит другой.
+    """
+
+    def __init__(
+        self,
+        mint_lease: float = BANK_TOKEN_MINT_LEASE,
+        wait_timeout: float = BANK_TOKEN_WAIT_TIMEOUT,
+        poll_interval: float = 0.2,
+    ):
+        self.mint_lease = mint_lease
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+
+    @staticmethod
+    def _read(bank_name: str) -> Optional[StoredBankToken]:
+        with engine.connect() as connection:
+            row = connection.execute(
+                text("SELECT access_token, expires_at, refresh_at FROM bank_tokens WHERE bank_name = :name"),
+                {"name": bank_name},
+            ).first()
+        if row is None:
+            return None
+        return StoredBankToken(token=row.access_token, expires_at=row.expires_at, refresh_at=row.refresh_at)
+
+    def _claim(self, bank_name: str) -> bool:
+        """Занимает аренду выпуска токена, если он устарел и его еще никто не выпускает."""
+        now = datetime.utcnow()
+        table = models.BankToken
+        # Строки еще нет — создается заглушка с уже истекшим токеном, который никому не отдается
+        stmt = insert(table).values(
+            bank_name=bank_name,
+            access_token="",
+            expires_at=now,
+            refresh_at=now,
+            minting_until=now + timedelta(seconds=self.mint_lease),
+        )
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.bank_name],
+            set_={"minting_until": stmt.excluded.minting_until},
+            where=and_(
+                table.refresh_at <= now,
+                or_(table.minting_until.is_(None), table.minting_until <= now),
+            ),
+        ).returning(table.bank_name)
+        with engine.begin() as connection:
+            return connection.execute(stmt).first() is not None
+
+    @staticmethod
+    def _save(bank_name: str, stored: StoredBankToken) -> None:
+        with engine.begin() as connection:
+            connection.execute(
+                update(models.BankToken)
+                .where(models.BankToken.bank_name == bank_name)
+                .values(
+                    access_token=stored.token,
+                    expires_at=stored.expires_at,
+                    refresh_at=stored.refresh_at,
+                    minting_until=None,
+                )
+            )
+
+    @staticmethod
+    def _release(bank_name: str) -> None:
+        with engine.begin() as connection:
+            connection.execute(
+                update(models.BankToken).where(models.BankToken.bank_name == bank_name).values(minting_until=None)
+            )
+
+    async def _mint_and_save(self, bank_name: str, mint: MintFn) -> StoredBankToken:
+        try:
+            stored = await mint()
+        except BaseException:
+            # Не заставлять остальных ждать истечения аренды
+            await asyncio.to_thread(self._release, bank_name)
+            raise
+        await asyncio.to_thread(self._save, bank_name, stored)
+        return stored
+
+    async def get_or_mint(self, bank_name: str, mint: MintFn) -> StoredBankToken:
+        deadline = time.monotonic() + self.wait_timeout
+        while True:
+            stored = await asyncio.to_thread(self._read, bank_name)
+            if stored and stored.refresh_at > datetime.utcnow():
+                return stored
+            if await asyncio.to_thread(self._claim, bank_name):
+                return await self._mint_and_save(bank_name, mint)
+            # Токен выпускает другой воркер
+            if time.monotonic() >= deadline:
+                if stored and stored.expires_at > datetime.utcnow():
+                    return stored
+                raise HTTPException(status_code=503, detail=f"Timed out waiting for a token for bank '{bank_name}'.")
+            await asyncio.sleep(self.poll_interval)
+
+
+def create_token_store(kind: str = BANK_TOKEN_STORE) -> BankTokenStore:
+    if kind == "postgres":
+        return PostgresBankTokenStore()
+    if kind == "memory":
+        return LocalBankTokenStore()
+    raise ValueError(f"Unknown BANK_TOKEN_STORE: '{kind}'")
+
+
+class BankTokenCache:
+    """
+    Кэш токенов доступа к банкам.
+
+    - Single-flight: конкурентные запросы к одному банку ждут ОДИН общий
+      запрос к /auth/bank-token, а не делают каждый свой.
+    - Проактивное обновление: после refresh_at токен продолжает отдаваться
+      из кэша, а новый запрашивается в фоне (при обращении или фоновой задачей).
+    - Конфигурация банка запрашивается только при промахе кэша.
+
+    Сам кэш — это L1 внутри процесса; за ним стоит общее хранилище
+    BankTokenStore (по умолчанию Postgres), разделяемое всеми воркерами.
+    """
+
+    def __init__(
+        self,
+        store: Optional[BankTokenStore] = None,
+        refresh_before: float = BANK_TOKEN_REFRESH_BEFORE,
+        refresh_interval: float = BANK_TOKEN_REFRESH_INTERVAL,
+    ):
+        self.store = store or LocalBankTokenStore()
+        self.refresh_before = refresh_before
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[str, BankTokenEntry] = {}
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self._refresher: Optional[asyncio.Task] = None
+        self.stats = {"hits": 0, "misses": 0, "shared_waits": 0, "refreshes": 0, "refresh_errors": 0, "mints": 0}
+
+    async def get(self, bank_name: str, load_credentials: Callable[[], BankCredentials]) -> str:
+        entry = self._entries.get(bank_name)
+        now = datetime.utcnow()
+        if entry and entry.expires_at > now:
+            self.stats["hits"] += 1
+            if entry.refresh_at <= now:
+                self._schedule_refresh(entry.credentials)
+            return entry.token
+
+        self.stats["misses"] += 1
+        task = self._inflight.get(bank_name)
+        if task is not None:
+            self.stats["shared_waits"] += 1
+        else:
+            task = self._start_fetch(load_credentials())
+        # shield: отмена одного ожидающего запроса не должна отменять общий запрос токена
+        entry = await asyncio.shield(task)
+        return entry.token
+
+    def invalidate(self, bank_name: Optional[str] = None) -> None:
+        if bank_name is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(bank_name, None)
+
+    def _start_fetch(self, credentials: BankCredentials) -> asyncio.Task:
+        task = asyncio.create_task(self._fetch(credentials))
+        self._inflight[credentials.bank_name] = task
+        task.add_done_callback(lambda t, name=credentials.bank_name: self._inflight.pop(name, None))
+        return task
+
+    def _schedule_refresh(self, credentials: BankCredentials) -> None:
+        if credentials.bank_name in self._inflight:
+            return
+        self.stats["refreshes"] += 1
+        task = self._start_fetch(credentials)
+        task.add_done_callback(self._on_refresh_done)
+
+    def _on_refresh_done(self, task: asyncio.Task) -> None:
+        if task.cancelled():
+            return
+        error = task.exception()
+        if error is not None:
+            self.stats["refresh_errors"] += 1
+            logger.error(f"Background bank token refresh failed: {getattr(error, 'detail', error)}")
+
+    async def _fetch(self, credentials: BankCredentials) -> BankTokenEntry:
+        stored = await self.store.get_or_mint(credentials.bank_name, lambda: self._mint(credentials))
+        entry = BankTokenEntry(
+            token=stored.token,
+            expires_at=stored.expires_at,
+            refresh_at=stored.refresh_at,
+            credentials=credentials,
+        )
+        self._entries[credentials.bank_name] = entry
+        return entry
+
+    async def _mint(self, credentials: BankCredentials) -> StoredBankToken:
+        """Запрашивает у банка новый токен."""
+        self.stats["mints"] += 1
+        token_url = f"{credentials.base_url}/auth/bank-token"
+        params = {"client_id": credentials.client_id, "client_secret": credentials.client_secret}
+        client = bank_clients.get(credentials.bank_name)
+        response = await client.post(token_url, params=params)
+        if response.status_code != 200:
+            raise HTTPException(status_code=500, detail=f"Failed to get bank token: {response.text}")
+        token_data = response.json()
+
+        issued_at = datetime.utcnow()
+        expires_at = issued_at + timedelta(seconds=token_data['expires_in'] - 60)
+        # Обновляем заранее, но не раньше середины срока жизни токена
+        refresh_at = max(
+            expires_at - timedelta(seconds=self.refresh_before),
+            issued_at + (expires_at - issued_at) / 2,
+        )
+        return StoredBankToken(token=token_data['access_token'], expires_at=expires_at, refresh_at=refresh_at)
+
+    async def _refresh_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            now = datetime.utcnow()
+            for entry in list(self._entries.values()):
+                if entry.refresh_at <= now:
+                    self._schedule_refresh(entry.credentials)
+
+    async def start(self) -> None:
+        if self._refresher is None:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self) -> None:
+        if self._refresher is not None:
+            self._refresher.cancel()
+            try:
+                await self._refresher
+            except asyncio.CancelledError:
+                pass
+            self._refresher = None
+
+    def snapshot(self) -> dict:
+        """Состояние кэша для административного эндпоинта (без самих токенов)."""
+        return {
+            "store": type(self.store).__name__,
+            "stats": dict(self.stats),
+            "banks": {
+                name: {
+                    "expires_at": entry.expires_at,
+                    "refresh_at": entry.refresh_at,
+                    "refreshing": name in self._inflight,
+                }
+                for name, entry in self._entries.items()
+            },
+        }
+
+
+# Единственный экземпляр на процесс
+bank_token_cache = BankTokenCache(store=create_token_store())
@@ -9,6 +9,8 @@ import os
 from typing import List
 from starlette.requests import Request
 from deps import get_current_user, get_current_admin_user
+from bank_registry import bank_registry
+from dataclasses import asdict
 
 router = APIRouter(prefix="/banks", tags=["banks"])
 
@@ -58,7 +60,7 @@ def upload_bank_icon(
         file.file.close()
 
     bank.icon_filename = filename
-    db.commit()
+    db.commit()  # после коммита bank_registry перезагрузится автоматически
 
     return {"filename": filename, "path": f"/{file_path}"}
 
@@ -70,18 +72,15 @@ def upload_bank_icon(
 )
 def get_available_banks(
     request: Request,
-    db: Session = Depends(get_db),
     current_user: models.User = Depends(get_current_user)
 ):
     """
     Возвращает список всех поддерживаемых банков.
     Доступно для любого авторизованного пользователя.
     """
-    banks_from_db = db.query(models.Bank).all()
-    
     banks_with_urls = []
-    for bank in banks_from_db:
-        bank_data = bank.__dict__
+    for bank in bank_registry.all():
+        bank_data = asdict(bank)
         if bank.icon_filename:
             icon_url = f"{request.base_url}static/icons/{bank.icon_filename}"
             bank_data['icon_url'] = icon_url
@@ -0,0 +1,117 @@
+# finance-app-master/benchmarks/bench_event_loop_latency.py
+"""
+Бенчмарк задержки event loop при смешанной нагрузке "БД + банк":
+синхронная сессия (SessionLocal, как раньше в async-эндпоинтах)
+против асинхронной (AsyncSessionLocal).
+
+Каждый воркер в цикле делает запрос к БД (SELECT pg_sleep) и запрос
+к mock-банку. Параллельно зонд каждые 10 мс измеряет, насколько позже
+положенного просыпается event loop, — это задержка, которую получают
+все остальные запросы воркера, включая ожидающие ответа банка.
+
+Нужна запущенная PostgreSQL (DATABASE_URL из .env или окружения).
+
+Запуск (из папки backend):
+    python -m benchmarks.bench_event_loop_latency --workers 20 --duration 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+from sqlalchemy import text
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from database import SessionLocal, AsyncSessionLocal, engine, async_engine
+
+PROBE_INTERVAL = 0.01
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def probe(lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - started - PROBE_INTERVAL)
+
+
+async def query_sync(db_latency: float) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(text("SELECT pg_sleep(:d)"), {"d": db_latency})
+    finally:
+        db.close()
+
+
+async def query_async(db_latency: float) -> None:
+    async with AsyncSessionLocal() as db:
+        await db.execute(text("SELECT pg_sleep(:d)"), {"d": db_latency})
+
+
+async def worker(query, client: httpx.AsyncClient, args, bank_latencies: list, stop: asyncio.Event) -> int:
+    done = 0
+    while not stop.is_set():
+        await query(args.db_latency)
+        started = time.perf_counter()
+        await client.get("http://mockbank/accounts")
+        bank_latencies.append(time.perf_counter() - started)
+        done += 1
+    return done
+
+
+async def run(mode: str, args) -> dict:
+    async def bank_handler(request: httpx.Request) -> httpx.Response:
+        await asyncio.sleep(args.bank_latency)
+        return httpx.Response(200, json={"data": {"account": []}})
+
+    query = query_sync if mode == "sync" else query_async
+    lags, bank_latencies = [], []
+    stop = asyncio.Event()
+    async with httpx.AsyncClient(transport=httpx.MockTransport(bank_handler)) as client:
+        probe_task = asyncio.create_task(probe(lags, stop))
+        workers = [asyncio.create_task(worker(query, client, args, bank_latencies, stop)) for _ in range(args.workers)]
+        await asyncio.sleep(args.duration)
+        stop.set()
+        done = sum(await asyncio.gather(*workers))
+        await probe_task
+    return {
+        "lag_p50": statistics.median(lags) * 1000,
+        "lag_p99": percentile(lags, 0.99) * 1000,
+        "lag_max": max(lags) * 1000,
+        "bank_p99": percentile(bank_latencies, 0.99) * 1000,
+        "rps": done / args.duration,
+    }
+
+
+async def main(args) -> None:
+    # Прогрев пулов соединений обоих движков
+    await query_async(0)
+    await query_sync(0)
+
+    print(f"{args.workers} воркеров, БД {args.db_latency * 1000:.0f} мс, банк {args.bank_latency * 1000:.0f} мс, {args.duration} с")
+    print(f"{'сессия':>7} {'lag p50, мс':>12} {'lag p99, мс':>12} {'lag max, мс':>12} {'банк p99, мс':>13} {'итераций/с':>11}")
+    for mode in ("sync", "async"):
+        r = await run(mode, args)
+        print(f"{mode:>7} {r['lag_p50']:>12.1f} {r['lag_p99']:>12.1f} {r['lag_max']:>12.1f} {r['bank_p99']:>13.1f} {r['rps']:>11.0f}")
+
+    await async_engine.dispose()
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Задержка event loop: синхронная vs асинхронная сессия БД.")
+    parser.add_argument("--workers", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность каждого прогона, секунды")
+    parser.add_argument("--db-latency", type=float, default=0.005, help="Длительность запроса к БД, секунды")
+    parser.add_argument("--bank-latency", type=float, default=0.05, help="Задержка mock-банка, секунды")
+    asyncio.run(main(parser.parse_args()))
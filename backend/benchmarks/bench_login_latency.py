@@ -0,0 +1,110 @@
+# finance-app-master/benchmarks/bench_login_latency.py
+"""
+Бенчмарк входа: задержка логина (p50/p99) и задержка параллельных
+"читающих" запросов, когда bcrypt выполняется прямо в event loop
+(как было раньше) и в ограниченном пуле password_hasher.
+
+Читающий запрос имитируется коротким ожиданием I/O (как запрос к БД
+или банку): если event loop занят bcrypt, его задержка растет вместе
+с числом одновременных логинов.
+
+Запуск (из папки backend):
+    python -m benchmarks.bench_login_latency --logins 8 --readers 50 --duration 5
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+from fastapi import HTTPException
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+from security import get_password_hash, verify_password
+from password_hasher import PasswordHasher
+
+
+def percentile(values: list, p: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def login_inline(hashed: str) -> None:
+    verify_password("password", hashed)
+
+
+async def reader(read_latency: float, latencies: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(read_latency)
+        latencies.append(time.perf_counter() - started)
+
+
+async def login_loop(login, hashed: str, latencies: list, rejected: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await login(hashed)
+        except HTTPException:
+            rejected.append(1)
+            await asyncio.sleep(0.05)
+            continue
+        latencies.append(time.perf_counter() - started)
+        # Настоящий обработчик между логинами отдает управление (чтение запроса, ответ)
+        await asyncio.sleep(0)
+
+
+async def run(mode: str, hashed: str, args) -> dict:
+    if mode == "inline":
+        login = login_inline
+        hasher = None
+    else:
+        hasher = PasswordHasher(workers=args.workers, max_queue=args.max_queue)
+
+        async def login(hashed: str) -> None:
+            await hasher.verify_and_update("password", hashed)
+
+    login_latencies, read_latencies, rejected = [], [], []
+    stop = asyncio.Event()
+    tasks = [asyncio.create_task(reader(args.read_latency, read_latencies, stop)) for _ in range(args.readers)]
+    tasks += [asyncio.create_task(login_loop(login, hashed, login_latencies, rejected, stop)) for _ in range(args.logins)]
+    await asyncio.sleep(args.duration)
+    stop.set()
+    await asyncio.gather(*tasks)
+    if hasher:
+        hasher.shutdown()
+    return {
+        "login_p50": statistics.median(login_latencies) * 1000 if login_latencies else 0.0,
+        "login_p99": percentile(login_latencies, 0.99) * 1000,
+        "logins": len(login_latencies),
+        "rejected": len(rejected),
+        "read_p50": statistics.median(read_latencies) * 1000,
+        "read_p99": percentile(read_latencies, 0.99) * 1000,
+    }
+
+
+async def main(args) -> None:
+    hashed = get_password_hash("password")
+    print(f"{args.logins} параллельных логинов, {args.readers} читающих запросов "
+          f"({args.read_latency * 1000:.0f} мс I/O), пул bcrypt: {args.workers} потоков, очередь {args.max_queue}")
+    print(f"{'режим':>7} {'логин p50':>10} {'логин p99':>10} {'логинов':>8} {'503':>5} {'чтение p50':>11} {'чтение p99':>11}")
+    for mode in ("inline", "pool"):
+        r = await run(mode, hashed, args)
+        print(f"{mode:>7} {r['login_p50']:>10.0f} {r['login_p99']:>10.0f} {r['logins']:>8} {r['rejected']:>5} "
+              f"{r['read_p50']:>11.1f} {r['read_p99']:>11.1f}")
+    print("(время в мс)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Задержка логина и чтений: bcrypt в event loop vs в пуле потоков.")
+    parser.add_argument("--logins", type=int, default=8, help="Одновременных логинов")
+    parser.add_argument("--readers", type=int, default=50, help="Одновременных читающих запросов")
+    parser.add_argument("--read-latency", type=float, default=0.005, help="I/O читающего запроса, секунды")
+    parser.add_argument("--duration", type=float, default=5.0, help="Длительность каждого прогона, секунды")
+    parser.add_argument("--workers", type=int, default=2, help="Потоков bcrypt в режиме pool")
+    parser.add_argument("--max-queue", type=int, default=4, help="Длина очереди в режиме pool")
+    asyncio.run(main(parser.parse_args()))
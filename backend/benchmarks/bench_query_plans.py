@@ -0,0 +1,231 @@
+# finance-app-master/benchmarks/bench_query_plans.py
+"""
+Регрессионный бенчмарк планов запросов: заполняет БД большим набором
+данных и проверяет через EXPLAIN ANALYZE, что основные запросы роутеров
+читают таблицы по индексам, а не полным сканированием (Seq Scan).
+
+Проверяемые запросы повторяют эндпоинты: подключения, сохраненные счета,
+согласия на платежи, история платежей (первая страница), автоплатежи
+пользователя, автоплатежи к исполнению, очередь проверки статусов
+платежей и транзакции счета за период.
+
+Все данные создаются и анализируются (ANALYZE) в одной транзакции,
+которая в конце откатывается: база остается в исходном состоянии.
+Нужна запущенная PostgreSQL с примененными миграциями (DATABASE_URL из
+.env или окружения).
+
+Запуск (из папки backend):
+    python -m benchmarks.bench_query_plans --users 2000
+
+Код возврата 1, если хотя бы один запрос читает проверяемую таблицу без индекса.
+"""
+import argparse
+import os
+import sys
+import uuid
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import or_, select, text
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import models
+from database import engine
+from accounts_api import ACCOUNT_PROJECTION
+from transaction_store import _stored_transactions_query
+
+SEED_SQL = (
+    """
+    INSERT INTO users (email, hashed_password, is_admin)
+    SELECT :prefix || g || '@example.com', '-', false FROM generate_series(1, :users) g
+    """,
+    """
+    INSERT INTO connected_banks (user_id, bank_name, bank_client_id, status)
+    SELECT u.id, 'vbank', u.id || '-' || k, 'active'
+    FROM users u, generate_series(1, :connections) k
+    WHERE u.email LIKE :prefix || '%'
+    """,
+    """
+    INSERT INTO accounts (connection_id, api_account_id, status, currency, nickname)
+    SELECT cb.id, 'acc-' || cb.id || '-' || k, 'Enabled', 'RUB', 'Счет ' || k
+    FROM connected_banks cb JOIN users u ON u.id = cb.user_id, generate_series(1, :accounts) k
+    WHERE u.email LIKE :prefix || '%'
+    """,
+    """
+    INSERT INTO payment_consents (user_id, bank_name, bank_client_id, consent_id, status)
+    SELECT u.id, 'vbank', 'client', :prefix || u.id || '-' || k, 'authorized'
+    FROM users u, generate_series(1, :consents) k
+    WHERE u.email LIKE :prefix || '%'
+    """,
+    """
+    INSERT INTO payments (user_id, debtor_account_id, consent_id, bank_payment_id, bank_name, bank_client_id,
+                          status, amount, currency, idempotency_key, created_at)
+    SELECT u.id, acc.id, pc.id, 'p-' || u.id || '-' || k, 'vbank', 'client',
+           CASE WHEN k <= 2 THEN 'acceptedsettlementinprocess' ELSE 'acceptedsettlementcompleted' END,
+           100 + k, 'RUB', :prefix || u.id || '-' || k,
+           now() - k * interval '1 day'
+    FROM users u
+    CROSS JOIN LATERAL (
+        SELECT a.id FROM accounts a JOIN connected_banks cb ON cb.id = a.connection_id
+        WHERE cb.user_id = u.id LIMIT 1
+    ) acc
+    CROSS JOIN LATERAL (SELECT id FROM payment_consents WHERE user_id = u.id LIMIT 1) pc,
+    generate_series(1, :payments) k
+    WHERE u.email LIKE :prefix || '%'
+    """,
+    """
+    INSERT INTO scheduled_payments (user_id, debtor_account_id, creditor_account_id, next_payment_date,
+                                    amount_type, fixed_amount, currency, is_active)
+    SELECT u.id, acc.id, acc.id, current_date + ((u.id * 7 + k * 13) % 730 - 365),
+           'FIXED', 100, 'RUB', (u.id + k) % 4 <> 0
+    FROM users u
+    CROSS JOIN LATERAL (
+        SELECT a.id FROM accounts a JOIN connected_banks cb ON cb.id = a.connection_id
+        WHERE cb.user_id = u.id LIMIT 1
+    ) acc,
+    generate_series(1, :scheduled) k
+    WHERE u.email LIKE :prefix || '%'
+    """,
+    """
+    INSERT INTO transactions (account_id, transaction_id, booking_date_time, amount, currency,
+                              credit_debit_indicator, status, data)
+    SELECT a.id, 't-' || k, now() - k * interval '6 hours', 10, 'RUB',
+           CASE WHEN k % 2 = 0 THEN 'Credit' ELSE 'Debit' END, 'Booked', '{}'::jsonb
+    FROM accounts a
+    JOIN connected_banks cb ON cb.id = a.connection_id
+    JOIN users u ON u.id = cb.user_id,
+    generate_series(1, :transactions) k
+    WHERE u.email LIKE :prefix || '%'
+    """,
+)
+
+ANALYZED_TABLES = ("users", "connected_banks", "accounts", "payment_consents", "payments", "scheduled_payments", "transactions")
+
+
+def router_queries(user_id: int, account_id: int) -> dict:
+    """Запрос -> (statement, таблицы, которые должны читаться по индексу)."""
+    now = datetime.now(timezone.utc)
+    return {
+        "connections": (
+            select(models.ConnectedBank).where(models.ConnectedBank.user_id == user_id),
+            {"connected_banks"},
+        ),
+        "saved accounts": (
+            select(*ACCOUNT_PROJECTION)
+            .join_from(models.Account, models.ConnectedBank)
+            .where(models.ConnectedBank.user_id == user_id),
+            {"connected_banks", "accounts"},
+        ),
+        "payment consents": (
+            select(models.PaymentConsent).where(models.PaymentConsent.user_id == user_id),
+            {"payment_consents"},
+        ),
+        "payment history": (
+            select(models.Payment)
+            .where(models.Payment.user_id == user_id)
+            .order_by(models.Payment.created_at.desc(), models.Payment.id.desc())
+            .limit(51),
+            {"payments"},
+        ),
+        "scheduled payments": (
+            select(models.ScheduledPayment).where(models.ScheduledPayment.user_id == user_id),
+            {"scheduled_payments"},
+        ),
+        "due scheduled payments": (
+            select(models.ScheduledPayment)
+            .where(models.ScheduledPayment.is_active, models.ScheduledPayment.next_payment_date <= date.today())
+            .order_by(models.ScheduledPayment.next_payment_date)
+            .limit(100),
+            {"scheduled_payments"},
+        ),
+        "payment status queue": (
+            select(models.Payment.id)
+            .where(
+                models.Payment.status.not_in(models.FINAL_PAYMENT_STATUSES),
+                or_(models.Payment.next_status_check_at.is_(None), models.Payment.next_status_check_at <= now),
+            )
+            .order_by(models.Payment.next_status_check_at.nulls_first(), models.Payment.id)
+            .limit(100),
+            {"payments"},
+        ),
+        "account transactions": (
+            _stored_transactions_query(account_id, now - timedelta(days=30), now),
+            {"transactions"},
+        ),
+    }
+
+
+def _index_names(plan: dict) -> list:
+    names = [plan["Index Name"]] if "Index Name" in plan else []
+    for child in plan.get("Plans", ()):
+        names += _index_names(child)
+    return names
+
+
+def scan_nodes(plan: dict):
+    """(таблица, тип узла, индексы) для каждого узла плана, читающего таблицу."""
+    if "Relation Name" in plan:
+        # У Bitmap Heap Scan индексы указаны в дочерних Bitmap Index Scan
+        yield plan["Relation Name"], plan["Node Type"], ", ".join(_index_names(plan))
+        return
+    for child in plan.get("Plans", ()):
+        yield from scan_nodes(child)
+
+
+def explain(conn, stmt) -> tuple:
+    compiled = stmt.compile(dialect=engine.dialect, compile_kwargs={"render_postcompile": True})
+    result = conn.exec_driver_sql(f"EXPLAIN (ANALYZE, FORMAT JSON) {compiled}", compiled.params).scalar_one()
+    return list(scan_nodes(result[0]["Plan"])), result[0]["Execution Time"]
+
+
+def main(args) -> int:
+    prefix = f"plan-bench-{uuid.uuid4().hex[:8]}-"
+    params = {
+        "prefix": prefix, "users": args.users, "connections": args.connections, "accounts": args.accounts,
+        "consents": args.consents, "payments": args.payments, "scheduled": args.scheduled,
+        "transactions": args.transactions,
+    }
+    failed = 0
+    with engine.connect() as conn:
+        transaction = conn.begin()
+        try:
+            for sql in SEED_SQL:
+                conn.execute(text(sql), params)
+            for table in ANALYZED_TABLES:
+                conn.execute(text(f"ANALYZE {table}"))
+            user_id = conn.execute(
+                text("SELECT id FROM users WHERE email = :email"), {"email": f"{prefix}{args.users // 2}@example.com"}
+            ).scalar_one()
+            account_id = conn.execute(
+                select(models.Account.id).join(models.ConnectedBank).where(models.ConnectedBank.user_id == user_id).limit(1)
+            ).scalar_one()
+
+            print(f"{args.users} пользователей × {args.connections} подключений × {args.accounts} счетов, "
+                  f"{args.payments} платежей и {args.scheduled} автоплатежей на пользователя, "
+                  f"{args.transactions} транзакций на счет")
+            for name, (stmt, indexed) in router_queries(user_id, account_id).items():
+                nodes, elapsed = explain(conn, stmt)
+                bad = [relation for relation, node_type, _ in nodes if relation in indexed and node_type == "Seq Scan"]
+                missing = indexed - {relation for relation, _, _ in nodes}
+                ok = not bad and not missing
+                failed += not ok
+                scans = ", ".join(
+                    f"{relation}: {node_type}" + (f" ({index})" if index else "") for relation, node_type, index in nodes
+                )
+                print(f"{'OK  ' if ok else 'FAIL'} {name:<24} {elapsed:>8.2f} мс  {scans}")
+        finally:
+            transaction.rollback()
+    engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Проверка, что основные запросы роутеров используют индексы.")
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--connections", type=int, default=2, help="Подключений на пользователя")
+    parser.add_argument("--accounts", type=int, default=2, help="Счетов на подключение")
+    parser.add_argument("--consents", type=int, default=3, help="Согласий на платежи на пользователя")
+    parser.add_argument("--payments", type=int, default=50, help="Платежей на пользователя")
+    parser.add_argument("--scheduled", type=int, default=4, help="Автоплатежей на пользователя")
+    parser.add_argument("--transactions", type=int, default=20, help="Транзакций на счет")
+    sys.exit(main(parser.parse_args()))
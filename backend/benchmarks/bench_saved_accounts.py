@@ -0,0 +1,171 @@
+# finance-app-master/benchmarks/bench_saved_accounts.py
+"""
+Бенчмарк списка сохраненных счетов (GET /users/{user_id}/accounts/)
+в зависимости от числа счетов пользователя.
+
+Сравниваются:
+- subquery — как было: bank_id как column_property, коррелированный
+  подзапрос к banks/connected_banks на каждую строку Account, подключение
+  подгружается лениво при чтении bank_name;
+- orm — bank_id хранится в connected_banks, счета и подключения
+  загружаются ORM-объектами одним JOIN (contains_eager);
+- projection — как сейчас (get_saved_accounts): плоская проекция
+  колонок счета и подключения, без ORM-объектов.
+
+Для каждого варианта выводится и число SQL-запросов на один вызов:
+оно не должно расти вместе с числом счетов.
+
+Нужна запущенная PostgreSQL с примененными миграциями (DATABASE_URL из
+.env или окружения). Бенчмарк создает временного пользователя, банк и
+счета и удаляет их по окончании.
+
+Запуск (из папки backend):
+    python -m benchmarks.bench_saved_accounts --accounts 10 100 1000 5000 --connections 5
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+import uuid
+
+from sqlalchemy import delete, event, insert, select
+from sqlalchemy.orm import contains_eager
+
+sys.path.insert(0, os.path.realpath(os.path.join(os.path.dirname(__file__), '..')))
+
+import models
+from database import SessionLocal, engine
+from accounts_api import get_saved_accounts
+
+# bank_id в том виде, в каком он был column_property модели Account
+OLD_BANK_ID = (
+    select(models.Bank.id)
+    .join(models.ConnectedBank, models.Bank.name == models.ConnectedBank.bank_name)
+    .where(models.ConnectedBank.id == models.Account.connection_id)
+    .correlate_except(models.Bank)
+    .scalar_subquery()
+)
+
+
+def seed(accounts: int, connections: int) -> tuple:
+    tag = uuid.uuid4().hex[:8]
+    with engine.begin() as conn:
+        bank_id = conn.execute(
+            insert(models.Bank).values(name=f"bench-{tag}", client_id="bench", client_secret="bench", base_url="http://bench")
+            .returning(models.Bank.id)
+        ).scalar_one()
+        user_id = conn.execute(
+            insert(models.User).values(email=f"bench-{tag}@example.com", hashed_password="-").returning(models.User.id)
+        ).scalar_one()
+        connection_ids = conn.execute(
+            insert(models.ConnectedBank).returning(models.ConnectedBank.id),
+            [
+                {"user_id": user_id, "bank_name": f"bench-{tag}", "bank_id": bank_id,
+                 "bank_client_id": f"client-{i}", "status": "active"}
+                for i in range(connections)
+            ],
+        ).scalars().all()
+        conn.execute(insert(models.Account), [
+            {"connection_id": connection_ids[i % connections], "api_account_id": f"acc-{i}", "status": "Enabled",
+             "currency": "RUB", "nickname": f"Счет {i}", "balance_data": [{"amount": {"amount": "100.00", "currency": "RUB"}}]}
+            for i in range(accounts)
+        ])
+    return user_id, bank_id, connection_ids
+
+
+def cleanup(user_id: int, bank_id: int, connection_ids: list) -> None:
+    with engine.begin() as conn:
+        conn.execute(delete(models.Account).where(models.Account.connection_id.in_(connection_ids)))
+        conn.execute(delete(models.ConnectedBank).where(models.ConnectedBank.id.in_(connection_ids)))
+        conn.execute(delete(models.User).where(models.User.id == user_id))
+        conn.execute(delete(models.Bank).where(models.Bank.id == bank_id))
+
+
+def list_subquery(db, user_id: int) -> list:
+    rows = (
+        db.query(models.Account, OLD_BANK_ID)
+        .join(models.ConnectedBank)
+        .filter(models.ConnectedBank.user_id == user_id)
+        .all()
+    )
+    return [(account.bank_name, account.bank_client_id, bank_id) for account, bank_id in rows]
+
+
+def list_orm(db, user_id: int) -> list:
+    accounts = (
+        db.query(models.Account)
+        .join(models.Account.connection)
+        .options(contains_eager(models.Account.connection))
+        .filter(models.ConnectedBank.user_id == user_id)
+        .all()
+    )
+    return [(account.bank_name, account.bank_client_id, account.bank_id) for account in accounts]
+
+
+def list_projection(db, user_id: int) -> list:
+    response = get_saved_accounts(user_id, bank_name=None, api_account_id=None, db=db, current_user=None)
+    return [(account["bank_name"], account["bank_client_id"], account["bank_id"]) for account in response["accounts"]]
+
+
+VARIANTS = {"subquery": list_subquery, "orm": list_orm, "projection": list_projection}
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+        event.listen(engine, "before_cursor_execute", self._on_execute)
+
+    def _on_execute(self, *args) -> None:
+        self.count += 1
+
+
+def run_once(fn, user_id: int, counter: QueryCounter) -> tuple:
+    db = SessionLocal()
+    try:
+        before = counter.count
+        result = sorted(fn(db, user_id))
+        return result, counter.count - before
+    finally:
+        db.close()
+
+
+def measure(fn, user_id: int, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        # Новая сессия на каждый прогон, как на каждый HTTP-запрос
+        db = SessionLocal()
+        try:
+            started = time.perf_counter()
+            fn(db, user_id)
+            timings.append(time.perf_counter() - started)
+        finally:
+            db.close()
+    return statistics.median(timings) * 1000
+
+
+def main(args) -> None:
+    counter = QueryCounter()
+    print(f"{args.connections} подключений, медиана из {args.repeat} прогонов (мс), в скобках — SQL-запросов на вызов")
+    print(f"{'счетов':>7}" + "".join(f"{name:>18}" for name in VARIANTS))
+    for accounts in args.accounts:
+        user_id, bank_id, connection_ids = seed(accounts, args.connections)
+        try:
+            cells, expected = [], None
+            for fn in VARIANTS.values():
+                result, queries = run_once(fn, user_id, counter)
+                assert expected is None or result == expected
+                expected = result
+                cells.append(f"{measure(fn, user_id, args.repeat):>12.1f} ({queries:>3})")
+        finally:
+            cleanup(user_id, bank_id, connection_ids)
+        print(f"{accounts:>7}" + "".join(cells))
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Список счетов: bank_id подзапросом vs ORM JOIN vs плоская проекция.")
+    parser.add_argument("--accounts", type=int, nargs="+", default=[10, 100, 1000, 5000], help="Число счетов пользователя")
+    parser.add_argument("--connections", type=int, default=5, help="Число подключений, между которыми делятся счета")
+    parser.add_argument("--repeat", type=int, default=20, help="Прогонов на каждый размер")
+    main(parser.parse_args())
@@ -10,4 +10,179 @@ load_dotenv()
 #     "vbank": {"client_id": CLIENT_ID, "client_secret": CLIENT_SECRET, "base_url": "https://vbank.open.bankingapi.ru", "auto_approve": True},
 #     "abank": {"client_id": CLIENT_ID, "client_secret": CLIENT_SECRET, "base_url": "https://abank.open.bankingapi.ru", "auto_approve": True},
 #     "sbank": {"client_id": CLIENT_ID, "client_secret": CLIENT_SECRET, "base_url": "https://sbank.open.bankingapi.ru", "auto_approve": False}
-# }
\ No newline at end of file
+# }
+
+# --- Исходящие HTTP-соединения к банкам (см. bank_client.py) ---
+def _env_bool(name: str, default: str = "false") -> bool:
+    return os.getenv(name, default).strip().lower() in ("1", "true", "yes", "on")
+
+# Лимиты пула соединений (на КАЖДЫЙ банк отдельно)
+BANK_HTTP_MAX_CONNECTIONS = int(os.getenv("BANK_HTTP_MAX_CONNECTIONS", "100"))
+BANK_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("BANK_HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+BANK_HTTP_KEEPALIVE_EXPIRY = float(os.getenv("BANK_HTTP_KEEPALIVE_EXPIRY", "30"))
+
+# Таймауты (секунды)
+BANK_HTTP_CONNECT_TIMEOUT = float(os.getenv("BANK_HTTP_CONNECT_TIMEOUT", "5"))
+BANK_HTTP_READ_TIMEOUT = float(os.getenv("BANK_HTTP_READ_TIMEOUT", "30"))
+BANK_HTTP_WRITE_TIMEOUT = float(os.getenv("BANK_HTTP_WRITE_TIMEOUT", "10"))
+BANK_HTTP_POOL_TIMEOUT = float(os.getenv("BANK_HTTP_POOL_TIMEOUT", "10"))
+
+# HTTP/2 (требует пакет h2)
+BANK_HTTP2 = _env_bool("BANK_HTTP2")
+
+# Сколько параллельных запросов один воркер может отправить в один банк
+# при "веерных" операциях (балансы по всем счетам, пакетные платежи и т.п.)
+BANK_FANOUT_CONCURRENCY = int(os.getenv("BANK_FANOUT_CONCURRENCY", "8"))
+
+# Ограничение частоты запросов к банку (token bucket, на процесс): запросов в секунду и размер всплеска.
+# 0 — без ограничения
+BANK_RATE_LIMIT = float(os.getenv("BANK_RATE_LIMIT", "20"))
+BANK_RATE_BURST = int(os.getenv("BANK_RATE_BURST", "40"))
+# Дольше этого запрос не ждет своей очереди (или Retry-After банка) — сразу 503
+BANK_RATE_MAX_WAIT = float(os.getenv("BANK_RATE_MAX_WAIT", "5"))
+# Retry-After из ответа банка (429/503) учитывается, но не больше этого значения, секунды
+BANK_RETRY_AFTER_MAX = float(os.getenv("BANK_RETRY_AFTER_MAX", "120"))
+
+# Автоматический выключатель (circuit breaker): после стольких ошибок подряд (сетевые, таймауты, 5xx)
+# запросы к банку отклоняются сразу, а через BANK_BREAKER_RESET_TIMEOUT секунд пропускается один пробный
+BANK_BREAKER_FAILURE_THRESHOLD = int(os.getenv("BANK_BREAKER_FAILURE_THRESHOLD", "5"))
+BANK_BREAKER_RESET_TIMEOUT = float(os.getenv("BANK_BREAKER_RESET_TIMEOUT", "30"))
+
+# --- Кэш токенов доступа к банкам (см. bank_tokens.py) ---
+# За сколько секунд до истечения токен обновляется в фоне
+BANK_TOKEN_REFRESH_BEFORE = float(os.getenv("BANK_TOKEN_REFRESH_BEFORE", "300"))
+# Как часто фоновая задача проверяет, не пора ли обновить токены
+BANK_TOKEN_REFRESH_INTERVAL = float(os.getenv("BANK_TOKEN_REFRESH_INTERVAL", "30"))
+# Общее (между воркерами) хранилище токенов: "postgres" или "memory"
+BANK_TOKEN_STORE = os.getenv("BANK_TOKEN_STORE", "postgres").strip().lower()
+# Аренда выпуска токена одним воркером (postgres): после нее токен выпустит другой воркер, секунды
+BANK_TOKEN_MINT_LEASE = float(os.getenv("BANK_TOKEN_MINT_LEASE", "60"))
+# Сколько остальные воркеры ждут токен, который выпускает другой, секунды
+BANK_TOKEN_WAIT_TIMEOUT = float(os.getenv("BANK_TOKEN_WAIT_TIMEOUT", "10"))
+
+# --- Реестр банков в памяти (см. bank_registry.py) ---
+# Период фоновой перезагрузки (подхватывает изменения, сделанные другими воркерами/скриптами)
+BANK_REGISTRY_RELOAD_INTERVAL = float(os.getenv("BANK_REGISTRY_RELOAD_INTERVAL", "60"))
+# Не чаще, чем раз в N секунд, перезагружать реестр при запросе неизвестного банка
+BANK_REGISTRY_MISS_RELOAD_INTERVAL = float(os.getenv("BANK_REGISTRY_MISS_RELOAD_INTERVAL", "5"))
+
+# --- Загрузка транзакций из банка (см. transactions_api.py) ---
+TRANSACTIONS_PAGE_SIZE = int(os.getenv("TRANSACTIONS_PAGE_SIZE", "100"))
+# Сколько страниц транзакций одновременно запрашивается у банка
+TRANSACTIONS_PREFETCH_PAGES = int(os.getenv("TRANSACTIONS_PREFETCH_PAGES", "4"))
+
+# --- Локальное хранилище транзакций (см. transaction_store.py) ---
+# Не чаще, чем раз в N секунд, синхронизировать транзакции счета с банком
+TRANSACTIONS_SYNC_MIN_INTERVAL = float(os.getenv("TRANSACTIONS_SYNC_MIN_INTERVAL", "60"))
+# На сколько дней назад от водяного знака перезапрашивать транзакции (поздние проводки, смена статуса)
+TRANSACTIONS_SYNC_OVERLAP_DAYS = int(os.getenv("TRANSACTIONS_SYNC_OVERLAP_DAYS", "3"))
+# Размер пачки строк, читаемой из БД при потоковой выдаче транзакций
+TRANSACTIONS_STREAM_BATCH_SIZE = int(os.getenv("TRANSACTIONS_STREAM_BATCH_SIZE", "500"))
+
+# --- История платежей (см. payments_api.get_payment_history) ---
+PAYMENT_HISTORY_PAGE_SIZE = int(os.getenv("PAYMENT_HISTORY_PAGE_SIZE", "50"))
+PAYMENT_HISTORY_MAX_PAGE_SIZE = int(os.getenv("PAYMENT_HISTORY_MAX_PAGE_SIZE", "200"))
+# Максимум платежей в одном запросе POST /users/{user_id}/payments/batch
+PAYMENT_BATCH_MAX_SIZE = int(os.getenv("PAYMENT_BATCH_MAX_SIZE", "100"))
+
+# --- Исполнение автоплатежей (см. scheduled_payment_worker.py) ---
+# Запускать исполнитель в процессе API (можно запускать и отдельными процессами:
+# python scheduled_payment_worker.py — экземпляры не мешают друг другу)
+SCHEDULED_PAYMENTS_WORKER_ENABLED = _env_bool("SCHEDULED_PAYMENTS_WORKER_ENABLED", "true")
+# Как часто искать автоплатежи к исполнению, когда очередь пуста
+SCHEDULED_PAYMENTS_POLL_INTERVAL = float(os.getenv("SCHEDULED_PAYMENTS_POLL_INTERVAL", "60"))
+# Сколько автоплатежей забирать (и блокировать) за раз
+SCHEDULED_PAYMENTS_BATCH_SIZE = int(os.getenv("SCHEDULED_PAYMENTS_BATCH_SIZE", "20"))
+# Сколько платежей пачки отправлять в банки одновременно
+SCHEDULED_PAYMENTS_CONCURRENCY = int(os.getenv("SCHEDULED_PAYMENTS_CONCURRENCY", "4"))
+# Пауза перед повтором после ошибки: удваивается с каждой неудачей, но не больше максимума
+SCHEDULED_PAYMENTS_RETRY_BASE = float(os.getenv("SCHEDULED_PAYMENTS_RETRY_BASE", "300"))
+SCHEDULED_PAYMENTS_RETRY_MAX = float(os.getenv("SCHEDULED_PAYMENTS_RETRY_MAX", "21600"))
+# Аренда забранной пачки (retry_at): если экземпляр упадет, автоплатежи повторятся после нее, секунды
+SCHEDULED_PAYMENTS_CLAIM_LEASE = float(os.getenv("SCHEDULED_PAYMENTS_CLAIM_LEASE", "600"))
+
+# --- Фоновая проверка статусов платежей (см. payment_status_poller.py) ---
+PAYMENT_STATUS_POLLER_ENABLED = _env_bool("PAYMENT_STATUS_POLLER_ENABLED", "true")
+# Как часто искать платежи, которым пора проверить статус, когда очередь пуста
+PAYMENT_STATUS_POLL_INTERVAL = float(os.getenv("PAYMENT_STATUS_POLL_INTERVAL", "15"))
+# Сколько платежей проверять (и обновлять одним UPDATE) за раз
+PAYMENT_STATUS_BATCH_SIZE = int(os.getenv("PAYMENT_STATUS_BATCH_SIZE", "100"))
+# Интервал проверки растет с возрастом платежа: base, 2*base, 4*base... но не больше максимума
+PAYMENT_STATUS_CHECK_BASE = float(os.getenv("PAYMENT_STATUS_CHECK_BASE", "10"))
+PAYMENT_STATUS_CHECK_MAX = float(os.getenv("PAYMENT_STATUS_CHECK_MAX", "3600"))
+# Платежи старше этого (секунды) больше не проверяются в фоне
+PAYMENT_STATUS_MAX_AGE = float(os.getenv("PAYMENT_STATUS_MAX_AGE", str(7 * 24 * 3600)))
+# На сколько секунд взятый в проверку платеж откладывается для других экземпляров (аренда)
+PAYMENT_STATUS_CLAIM_LEASE = float(os.getenv("PAYMENT_STATUS_CLAIM_LEASE", "300"))
+
+# --- Фоновая проверка подтверждения согласий (см. consent_watcher.py) ---
+CONSENT_WATCHER_ENABLED = _env_bool("CONSENT_WATCHER_ENABLED", "true")
+# Как часто искать подключения и согласия на платежи, которые пора проверить
+CONSENT_WATCH_POLL_INTERVAL = float(os.getenv("CONSENT_WATCH_POLL_INTERVAL", "3"))
+CONSENT_WATCH_BATCH_SIZE = int(os.getenv("CONSENT_WATCH_BATCH_SIZE", "50"))
+# Пауза между проверками одного согласия: base, 2*base, 4*base... но не больше максимума
+CONSENT_WATCH_CHECK_BASE = float(os.getenv("CONSENT_WATCH_CHECK_BASE", "3"))
+CONSENT_WATCH_CHECK_MAX = float(os.getenv("CONSENT_WATCH_CHECK_MAX", "60"))
+# После стольких проверок согласие проверяется редко, раз в CONSENT_WATCH_TAIL_INTERVAL,
+# пока клиент снова не начнет ждать его подтверждения (/consent-events/wait)
+CONSENT_WATCH_MAX_CHECKS = int(os.getenv("CONSENT_WATCH_MAX_CHECKS", "150"))
+CONSENT_WATCH_TAIL_INTERVAL = float(os.getenv("CONSENT_WATCH_TAIL_INTERVAL", "600"))
+
+# --- Поток событий о статусах согласий (см. consent_events.py) ---
+# Сколько непрочитанных событий держать на одно SSE-подключение
+CONSENT_EVENTS_QUEUE_SIZE = int(os.getenv("CONSENT_EVENTS_QUEUE_SIZE", "100"))
+# Пауза перед переподключением слушателя LISTEN после потери соединения с БД
+CONSENT_EVENTS_RECONNECT_DELAY = float(os.getenv("CONSENT_EVENTS_RECONNECT_DELAY", "5"))
+# Интервал пустых комментариев в SSE-потоке (держат соединение через прокси)
+CONSENT_EVENTS_HEARTBEAT = float(os.getenv("CONSENT_EVENTS_HEARTBEAT", "15"))
+# Максимальное (и по умолчанию) время ожидания long-poll запроса, секунды
+CONSENT_EVENTS_LONG_POLL_TIMEOUT = float(os.getenv("CONSENT_EVENTS_LONG_POLL_TIMEOUT", "25"))
+
+# --- Фоновая синхронизация счетов (см. account_sync_scheduler.py) ---
+# Бюджет считается в каждом процессе отдельно, поэтому по умолчанию синхронизация
+# в процессах API выключена: ее выполняет один отдельный процесс (make account-sync)
+ACCOUNT_SYNC_ENABLED = _env_bool("ACCOUNT_SYNC_ENABLED", "false")
+# Раз в интервал процесс синхронизирует не больше ACCOUNT_SYNC_BUDGET подключений (бюджет запросов к банкам)
+ACCOUNT_SYNC_INTERVAL = float(os.getenv("ACCOUNT_SYNC_INTERVAL", "60"))
+ACCOUNT_SYNC_BUDGET = int(os.getenv("ACCOUNT_SYNC_BUDGET", "20"))
+# Сколько подключений синхронизировать одновременно
+ACCOUNT_SYNC_CONCURRENCY = int(os.getenv("ACCOUNT_SYNC_CONCURRENCY", "4"))
+# Когда счета считаются устаревшими: для недавно просмотренных подключений и для остальных, секунды
+ACCOUNT_SYNC_STALE_AFTER = float(os.getenv("ACCOUNT_SYNC_STALE_AFTER", "900"))
+ACCOUNT_SYNC_IDLE_STALE_AFTER = float(os.getenv("ACCOUNT_SYNC_IDLE_STALE_AFTER", "21600"))
+# "Недавно просмотренное" подключение — открытое клиентом за это время, секунды
+ACCOUNT_SYNC_RECENT_VIEW = float(os.getenv("ACCOUNT_SYNC_RECENT_VIEW", str(7 * 24 * 3600)))
+# Сколько подключение считается занятым после начала синхронизации (и пауза после неудачи), секунды
+ACCOUNT_SYNC_LEASE = float(os.getenv("ACCOUNT_SYNC_LEASE", "600"))
+# POST /users/{user_id}/accounts/{id}/refresh не запрашивает банк, если счета синхронизированы не раньше, секунды
+ACCOUNT_REFRESH_FRESH_FOR = float(os.getenv("ACCOUNT_REFRESH_FRESH_FOR", "300"))
+
+# --- Пул соединений с БД (см. database.py и db_pool.py) ---
+# Действует на каждый из движков (синхронный и asyncpg) в каждом воркере
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+# Сколько секунд ждать свободное соединение, прежде чем вернуть ошибку
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Проверять соединение перед выдачей (переживает рестарт БД и обрывы по простою)
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", "true")
+# Пересоздавать соединения старше N секунд (-1 — никогда)
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# Соединения, удерживаемые дольше N секунд, попадают в отчет вместе с маршрутом
+DB_POOL_SLOW_HOLD_THRESHOLD = float(os.getenv("DB_POOL_SLOW_HOLD_THRESHOLD", "5"))
+# Период вызова хуков метрик пула, секунды (0 — отключено)
+DB_POOL_METRICS_INTERVAL = float(os.getenv("DB_POOL_METRICS_INTERVAL", "60"))
+
+# --- Хеширование паролей (см. password_hasher.py) ---
+# Стоимость bcrypt; при изменении хеши пересчитываются при следующем входе пользователя
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Потоков для bcrypt (одновременно выполняемых проверок/хеширований)
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Сколько запросов может ждать в очереди; сверх этого — сразу 503
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "32"))
+
+# --- Кэш аутентифицированных пользователей (см. principal_cache.py) ---
+# Сколько секунд пользователь из токена не перечитывается из БД
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_MAX_SIZE = int(os.getenv("PRINCIPAL_CACHE_MAX_SIZE", "10000"))
+# Пауза перед переподключением слушателя отзывов токенов (LISTEN, см. principal_revocations.py)
+PRINCIPAL_REVOCATIONS_RECONNECT_DELAY = float(os.getenv("PRINCIPAL_REVOCATIONS_RECONNECT_DELAY", "5"))
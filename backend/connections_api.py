@@ -1,14 +1,18 @@
 # finance-app-master/connections_api.py
 import httpx
 from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from pydantic import BaseModel
 from typing import Optional
 
 import models
-from database import get_db
+from database import get_async_db
 from deps import user_is_admin_or_self
 from utils import get_bank_token, fetch_accounts, revoke_account_consent, log_response
+from bank_client import bank_clients
+from bank_registry import bank_registry
+from consent_events import notify_consent_event
 
 router = APIRouter(
     prefix="/users/{user_id}/connections",
@@ -22,113 +26,126 @@ class ConnectionRequest(BaseModel):
 @router.get("/", summary="Получить список всех подключений пользователя")
 async def list_connections(
     user_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     bank_name: Optional[str] = None,
     bank_client_id: Optional[str] = None,
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
-    query = db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == user_id)
+    query = select(models.ConnectedBank).where(models.ConnectedBank.user_id == user_id)
     if bank_name:
-        query = query.filter(models.ConnectedBank.bank_name == bank_name)
+        query = query.where(models.ConnectedBank.bank_name == bank_name)
     if bank_client_id:
-        query = query.filter(models.ConnectedBank.bank_client_id == bank_client_id)
-    connections = query.all()
+        query = query.where(models.ConnectedBank.bank_client_id == bank_client_id)
+    connections = (await db.scalars(query)).all()
     return {"count": len(connections), "connections": connections}
 
 @router.post("/", summary="Инициировать подключение")
 async def initiate_connection(
     user_id: int,
     connection_data: ConnectionRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
     bank_name = connection_data.bank_name
     bank_client_id = connection_data.bank_client_id
-    config = db.query(models.Bank).filter(models.Bank.name == bank_name).first()
+    config = await bank_registry.fetch_by_name(bank_name)
     if not config:
         raise HTTPException(status_code=404, detail=f"Bank '{bank_name}' not supported.")
 
-    existing_connection = db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == current_user.id, models.ConnectedBank.bank_name == bank_name, models.ConnectedBank.bank_client_id == bank_client_id).first()
+    existing_connection = await db.scalar(select(models.ConnectedBank).where(models.ConnectedBank.user_id == current_user.id, models.ConnectedBank.bank_name == bank_name, models.ConnectedBank.bank_client_id == bank_client_id).limit(1))
     
     if existing_connection: return {"status": "already_initiated", "message": "Connection has been already initiated.", "connection_id": existing_connection.id}
     
-    bank_access_token = await get_bank_token(bank_name, db)
+    bank_access_token = await get_bank_token(bank_name)
     consent_url = f"{config.base_url}/account-consents/request"
     headers = {"Authorization": f"Bearer {bank_access_token}", "Content-Type": "application/json", "X-Requesting-Bank": config.client_id}
     consent_body = {"client_id": bank_client_id, "permissions": ["ReadAccountsDetail", "ReadBalances", "ReadTransactionsDetail"], "reason": f"Агрегация счетов для {bank_client_id}", "requesting_bank": "FinApp"}
-    async with httpx.AsyncClient() as client: response = await client.post(consent_url, headers=headers, json=consent_body)
+    response = await bank_clients.get(bank_name).post(consent_url, headers=headers, json=consent_body)
     log_response(response)
     if response.status_code != 200: raise HTTPException(status_code=500, detail=f"Failed to create consent request: {response.text}")
     consent_data = response.json()
     if consent_data.get("auto_approved"):
         consent_id = consent_data['consent_id']
-        connection = models.ConnectedBank(user_id=current_user.id, bank_name=bank_name, bank_client_id=bank_client_id, consent_id=consent_id, status="active")
-        db.add(connection); db.commit()
+        connection = models.ConnectedBank(user_id=current_user.id, bank_name=bank_name, bank_id=config.id, bank_client_id=bank_client_id, consent_id=consent_id, status="active")
+        db.add(connection); await db.commit()
         return {"status": "success_auto_approved", "message": "Connection created and auto-approved.", "connection_id": connection.id}
     else:
         request_id = consent_data['request_id']
-        connection = models.ConnectedBank(user_id=current_user.id, bank_name=bank_name, bank_client_id=bank_client_id, request_id=request_id, status="awaitingauthorization")
-        db.add(connection); db.commit()
+        connection = models.ConnectedBank(user_id=current_user.id, bank_name=bank_name, bank_id=config.id, bank_client_id=bank_client_id, request_id=request_id, status="awaitingauthorization")
+        db.add(connection); await db.commit()
         return {"status": "awaiting_authorization", "message": "Connection initiated. Please approve and check status.", "connection_id": connection.id}
 
-@router.post("/{connection_id}", summary="Проверить статус согласия")
-async def check_consent_status(
-    user_id: int,
-    connection_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(user_is_admin_or_self)
-):
-    connection = db.query(models.ConnectedBank).filter(models.ConnectedBank.id == connection_id, models.ConnectedBank.user_id == current_user.id).first()
-    if not connection: raise HTTPException(status_code=404, detail="Connection not found for this user.")
+async def refresh_connection_status(db: AsyncSession, connection: models.ConnectedBank) -> dict:
+    """
+    Проверяет согласие подключения в банке и сохраняет новый статус.
+    Общая часть эндпоинта проверки и фонового consent_watcher.py;
+    об изменении статуса публикуется событие consent_events.
+    """
     if connection.status not in ["awaitingauthorization", "active"]: return {"status": connection.status, "message": f"Consent is in a final state: {connection.status}"}
     
-    config = db.query(models.Bank).filter(models.Bank.name == connection.bank_name).first()
+    config = await bank_registry.fetch_by_name(connection.bank_name)
     if not config:
         raise HTTPException(status_code=500, detail=f"Internal error: Bank config for '{connection.bank_name}' disappeared.")
 
-    bank_access_token = await get_bank_token(connection.bank_name, db)
+    bank_access_token = await get_bank_token(connection.bank_name)
     if connection.status == "awaitingauthorization":
         check_url = f"{config.base_url}/account-consents/{connection.request_id}"
         headers = {"Authorization": f"Bearer {bank_access_token}", "X-Requesting-Bank": config.client_id}
     else:
         check_url = f"{config.base_url}/account-consents/{connection.consent_id}"
         headers = {"Authorization": f"Bearer {bank_access_token}", "x-fapi-interaction-id": config.client_id}
-    async with httpx.AsyncClient() as client: response = await client.get(check_url, headers=headers)
+    response = await bank_clients.get(connection.bank_name).get(check_url, headers=headers)
     log_response(response)
     if response.status_code != 200: raise HTTPException(status_code=500, detail=f"Failed to check consent status: {response.text}")
     consent_data = response.json().get("data", {})
     api_status = consent_data.get("status", "unknown").lower()
     if api_status == "authorized":
-        if connection.status == "awaitingauthorization": connection.consent_id = consent_data['consentId']
-        connection.status = "active"; db.commit()
+        if connection.status == "awaitingauthorization":
+            connection.consent_id = consent_data['consentId']
+            await notify_consent_event(db, connection.user_id, "connection", connection.id, "active")
+        connection.status = "active"; await db.commit()
         accounts_data = await fetch_accounts(bank_access_token, connection.consent_id, connection.bank_client_id, config)
         try:
             name = accounts_data.get("data", {}).get("account", [{}])[0].get("account", [{}])[0].get("name")
-            if name and connection.full_name != name: connection.full_name = name; db.commit()
+            if name and connection.full_name != name: connection.full_name = name; await db.commit()
         except Exception: pass
         return {"status": "success_approved", "message": "Consent is active and data fetched!", "accounts_data": accounts_data}
     elif api_status == "rejected":
-        connection.status = "rejected"; db.commit()
+        await notify_consent_event(db, connection.user_id, "connection", connection.id, "rejected")
+        connection.status = "rejected"; await db.commit()
         return {"status": "rejected", "message": "User has rejected the consent request."}
     else:
-        if connection.status != api_status: connection.status = api_status; db.commit()
+        if connection.status != api_status:
+            await notify_consent_event(db, connection.user_id, "connection", connection.id, api_status)
+            connection.status = api_status; await db.commit()
         return {"status": api_status, "message": f"Consent status is '{api_status}'. Please try again later."}
 
+@router.post("/{connection_id}", summary="Проверить статус согласия")
+async def check_consent_status(
+    user_id: int,
+    connection_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    connection = await db.scalar(select(models.ConnectedBank).where(models.ConnectedBank.id == connection_id, models.ConnectedBank.user_id == current_user.id))
+    if not connection: raise HTTPException(status_code=404, detail="Connection not found for this user.")
+    return await refresh_connection_status(db, connection)
+
 @router.delete("/{connection_id}", summary="Удалить подключение")
 async def delete_connection(
     user_id: int,
     connection_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
-    connection = db.query(models.ConnectedBank).filter(
+    connection = await db.scalar(select(models.ConnectedBank).where(
         models.ConnectedBank.id == connection_id,
         models.ConnectedBank.user_id == current_user.id
-    ).first()
+    ))
     if not connection:
         raise HTTPException(status_code=404, detail="Connection not found for this user.")
     
-    await revoke_account_consent(connection, db)
-    db.delete(connection)
-    db.commit()
+    await revoke_account_consent(connection)
+    await db.delete(connection)
+    await db.commit()
     return {"status": "deleted", "message": "Connection record successfully deleted from the database."}
\ No newline at end of file
@@ -0,0 +1,131 @@
+# finance-app-master/consent_events.py
+import asyncio
+import logging
+from collections import defaultdict
+from typing import Dict, Optional, Set
+
+import asyncpg
+import orjson
+from sqlalchemy import func, select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from database import ASYNC_DATABASE_URL
+from config import CONSENT_EVENTS_QUEUE_SIZE, CONSENT_EVENTS_RECONNECT_DELAY
+
+logger = logging.getLogger("uvicorn")
+
+# Канал PostgreSQL LISTEN/NOTIFY для изменений статусов согласий
+CHANNEL = "consent_events"
+
+
+async def notify_consent_event(db: AsyncSession, user_id: int, kind: str, object_id: int, status: str) -> None:
+    """
+    Публикует изменение статуса подключения (kind="connection") или
+    согласия на платеж (kind="payment_consent") через pg_notify.
+    Вызывается до commit в той же транзакции, что и само изменение:
+    PostgreSQL доставит уведомление слушателям только после коммита.
+    """
+    payload = orjson.dumps({"user_id": user_id, "type": kind, "id": object_id, "status": status}).decode()
+    await db.execute(select(func.pg_notify(CHANNEL, payload)))
+
+
+class ConsentEventHub:
+    """
+    Доставка событий об изменении статусов согласий в открытые SSE-потоки.
+
+    В каждом процессе API одно выделенное соединение asyncpg слушает канал
+    consent_events (LISTEN) и раздает события очередям подписчиков
+    соответствующего пользователя. Поэтому событие, опубликованное
+    в любом процессе (воркере API или отдельном consent_watcher.py),
+    доходит до клиента, подключенного к любому другому. Если подписчик не
+    успевает читать, новые события для него отбрасываются (dropped) —
+    при переподключении клиент все равно получает снимок статусов.
+    """
+
+    def __init__(
+        self,
+        queue_size: int = CONSENT_EVENTS_QUEUE_SIZE,
+        reconnect_delay: float = CONSENT_EVENTS_RECONNECT_DELAY,
+    ):
+        self.queue_size = queue_size
+        self.reconnect_delay = reconnect_delay
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = defaultdict(set)
+        self._listener: Optional[asyncio.Task] = None
+        self._connected = False
+        self.stats = {"received": 0, "delivered": 0, "dropped": 0, "reconnects": 0}
+
+    def subscribe(self, user_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=self.queue_size)
+        self._subscribers[user_id].add(queue)
+        return queue
+
+    def unsubscribe(self, user_id: int, queue: asyncio.Queue) -> None:
+        queues = self._subscribers.get(user_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[user_id]
+
+    def _dispatch(self, connection, pid, channel, payload: str) -> None:
+        self.stats["received"] += 1
+        try:
+            event = orjson.loads(payload)
+        except orjson.JSONDecodeError:
+            logger.warning(f"Malformed consent event: {payload}")
+            return
+        for queue in self._subscribers.get(event.get("user_id"), ()):
+            try:
+                queue.put_nowait(event)
+                self.stats["delivered"] += 1
+            except asyncio.QueueFull:
+                self.stats["dropped"] += 1
+
+    async def _listen_loop(self) -> None:
+        dsn = make_url(ASYNC_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                await connection.add_listener(CHANNEL, self._dispatch)
+                self._connected = True
+                logger.info(f"Listening for consent events on channel '{CHANNEL}'")
+                await closed.wait()
+                logger.warning("Consent events connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Consent events listener failed: {e}")
+            finally:
+                self._connected = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen_loop())
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    def snapshot(self) -> dict:
+        return {
+            "listening": self._connected,
+            "users": len(self._subscribers),
+            "subscribers": sum(len(queues) for queues in self._subscribers.values()),
+            "stats": dict(self.stats),
+        }
+
+
+# Единственный экземпляр на процесс
+consent_events = ConsentEventHub()
@@ -0,0 +1,127 @@
+# finance-app-master/consent_events_api.py
+import asyncio
+from typing import List, Optional
+
+import orjson
+from fastapi import APIRouter, Depends, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+
+import models
+from database import AsyncSessionLocal
+from deps import user_is_admin_or_self
+from consent_events import consent_events
+from consent_watcher import consent_watcher
+from config import CONSENT_EVENTS_HEARTBEAT, CONSENT_EVENTS_LONG_POLL_TIMEOUT
+
+router = APIRouter(
+    prefix="/users/{user_id}/consent-events",
+    tags=["consent_events"]
+)
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {orjson.dumps(data).decode()}\n\n"
+
+
+async def _snapshot(
+    user_id: int,
+    connection_ids: Optional[List[int]] = None,
+    payment_consent_ids: Optional[List[int]] = None,
+) -> list:
+    """Текущие статусы подключений и согласий на платежи пользователя (всех или только перечисленных)."""
+    connections = select(models.ConnectedBank.id, models.ConnectedBank.status).where(models.ConnectedBank.user_id == user_id)
+    consents = select(models.PaymentConsent.id, models.PaymentConsent.status).where(models.PaymentConsent.user_id == user_id)
+    if connection_ids is not None:
+        connections = connections.where(models.ConnectedBank.id.in_(connection_ids))
+    if payment_consent_ids is not None:
+        consents = consents.where(models.PaymentConsent.id.in_(payment_consent_ids))
+    async with AsyncSessionLocal() as db:
+        return [{"type": "connection", "id": id, "status": status} for id, status in await db.execute(connections)] + [
+            {"type": "payment_consent", "id": id, "status": status} for id, status in await db.execute(consents)
+        ]
+
+
+@router.get("/", summary="Поток изменений статусов согласий (SSE)")
+async def stream_consent_events(
+    user_id: int,
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Server-Sent Events вместо опроса эндпоинтов проверки статуса.
+
+    Первое событие `snapshot` — текущие статусы всех подключений и
+    согласий на платежи пользователя, затем событие `status`
+    ({"type": "connection" | "payment_consent", "id", "status"}) на каждое
+    изменение, которое находит consent_watcher.py или ручная проверка.
+    Подписка оформляется до снимка, поэтому изменение между ними не
+    теряется. При разрыве клиент переподключается и снова получает снимок.
+    """
+    async def stream():
+        queue = consent_events.subscribe(user_id)
+        try:
+            yield _sse("snapshot", {"items": await _snapshot(user_id)})
+            while True:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=CONSENT_EVENTS_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    continue
+                # Один и тот же dict получают все подписчики пользователя — не меняем его
+                yield _sse("status", {key: value for key, value in event.items() if key != "user_id"})
+        finally:
+            consent_events.unsubscribe(user_id, queue)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/wait", summary="Дождаться подтверждения согласий (long-poll)")
+async def wait_consent_events(
+    user_id: int,
+    connection_id: List[int] = Query([], description="Подключения, ожидающие подтверждения"),
+    payment_consent_id: List[int] = Query([], description="Согласия на платежи, ожидающие подтверждения"),
+    timeout: float = Query(CONSENT_EVENTS_LONG_POLL_TIMEOUT, gt=0, le=CONSENT_EVENTS_LONG_POLL_TIMEOUT),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Long-poll для клиентов, которые не умеют читать потоковый ответ (SSE).
+
+    Отвечает, как только хотя бы одно из перечисленных подключений или
+    согласий выйдет из статуса awaitingauthorization (или будет удалено),
+    либо через `timeout` секунд. `changed` показывает, что дождались
+    изменения; `items` — текущие статусы перечисленных. Подписка
+    оформляется до чтения статусов, поэтому изменение не теряется
+    и между запросами: клиент повторяет запрос, пока changed=false.
+    Согласия, которые consent_watcher.py уже проверяет редко, снова
+    проверяются часто.
+    """
+    watched = {("connection", id) for id in connection_id} | {("payment_consent", id) for id in payment_consent_id}
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    queue = consent_events.subscribe(user_id)
+    try:
+        await consent_watcher.rearm(user_id, connection_id, payment_consent_id)
+        while True:
+            items = await _snapshot(user_id, connection_id, payment_consent_id)
+            changed = len(items) < len(watched) or any(
+                item["status"] != models.AWAITING_AUTHORIZATION for item in items
+            )
+            if changed:
+                return {"changed": True, "items": items}
+            # Ждем события по одному из перечисленных (остальные пропускаем)
+            while True:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return {"changed": False, "items": items}
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=remaining)
+                except asyncio.TimeoutError:
+                    return {"changed": False, "items": items}
+                if (event.get("type"), event.get("id")) in watched:
+                    break
+    finally:
+        consent_events.unsubscribe(user_id, queue)
@@ -0,0 +1,249 @@
+# finance-app-master/consent_watcher.py
+import asyncio
+import logging
+import signal
+import time
+from datetime import datetime, timezone
+from typing import Awaitable, Callable, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import case, func, or_, select, update
+
+import models
+from database import AsyncSessionLocal
+from bank_client import bank_clients, BankUnavailableError
+from bank_registry import bank_registry
+from connections_api import refresh_connection_status
+from payment_consents_api import refresh_payment_consent_status
+from config import (
+    CONSENT_WATCH_POLL_INTERVAL,
+    CONSENT_WATCH_BATCH_SIZE,
+    CONSENT_WATCH_CHECK_BASE,
+    CONSENT_WATCH_CHECK_MAX,
+    CONSENT_WATCH_MAX_CHECKS,
+    CONSENT_WATCH_TAIL_INTERVAL,
+)
+
+logger = logging.getLogger("uvicorn")
+
+
+class WatchedKind:
+    """Что проверяется: модель, функция проверки в банке и счетчики."""
+
+    def __init__(self, name: str, model, refresh: Callable[..., Awaitable]):
+        self.name = name
+        self.model = model
+        self.refresh = refresh
+        self.checked = 0
+        self.changed = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> dict:
+        return {"checked": self.checked, "changed": self.changed, "failed": self.failed, "last_error": self.last_error}
+
+
+class ConsentWatcher:
+    """
+    Проверяет в банках подключения и согласия на платежи, ожидающие
+    подтверждения клиентом, вместо опроса со стороны приложения.
+
+    Пачка забирается одним UPDATE ... WHERE id IN (SELECT ... FOR UPDATE
+    SKIP LOCKED) RETURNING, который сразу назначает следующую проверку:
+    пауза удваивается с каждой проверкой (base, 2*base, ...) до максимума,
+    а после max_checks проверок согласие проверяется раз в tail_interval —
+    клиент может подтвердить его и позже. Когда клиент снова ждет
+    подтверждения, rearm() возвращает согласие на частые проверки.
+    Так экземпляры в разных процессах не проверяют одно согласие
+    одновременно, а строки не остаются заблокированными на время запросов
+    к банку. Проверка — те же refresh_connection_status и
+    refresh_payment_consent_status, что и у эндпоинтов; изменение статуса
+    они публикуют в consent_events, откуда оно уходит клиенту по SSE.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = CONSENT_WATCH_POLL_INTERVAL,
+        batch_size: int = CONSENT_WATCH_BATCH_SIZE,
+        check_base: float = CONSENT_WATCH_CHECK_BASE,
+        check_max: float = CONSENT_WATCH_CHECK_MAX,
+        max_checks: int = CONSENT_WATCH_MAX_CHECKS,
+        tail_interval: float = CONSENT_WATCH_TAIL_INTERVAL,
+    ):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.check_base = check_base
+        self.check_max = check_max
+        self.max_checks = max_checks
+        self.tail_interval = tail_interval
+        self.kinds = (
+            WatchedKind("connection", models.ConnectedBank, refresh_connection_status),
+            WatchedKind("payment_consent", models.PaymentConsent, refresh_payment_consent_status),
+        )
+        self._runner: Optional[asyncio.Task] = None
+        self.stats = {"runs": 0, "claimed": 0, "last_run_at": None, "last_run_ms": None}
+
+    async def _claim(self, kind: WatchedKind) -> list:
+        model = kind.model
+        due = (
+            select(model.id)
+            .where(
+                model.status == models.AWAITING_AUTHORIZATION,
+                or_(model.next_status_check_at.is_(None), model.next_status_check_at <= func.now()),
+            )
+            .order_by(model.next_status_check_at.nulls_first(), model.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        delay = case(
+            (model.status_checks >= self.max_checks, self.tail_interval),
+            else_=func.least(self.check_base * func.power(2, model.status_checks), self.check_max),
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                update(model)
+                .where(model.id.in_(due.scalar_subquery()))
+                .values(
+                    status_checks=model.status_checks + 1,
+                    next_status_check_at=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, delay),
+                )
+                .returning(model.id, model.bank_name)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        return rows
+
+    async def rearm(self, user_id: int, connection_ids: List[int], payment_consent_ids: List[int]) -> None:
+        """
+        Возвращает на частые проверки (с первой, сразу) ожидающие
+        подтверждения согласия пользователя, которые уже проверяются
+        редко: клиент ждет их подтверждения, значит, оно вероятно скоро.
+        """
+        async with AsyncSessionLocal() as db:
+            for kind, ids in zip(self.kinds, (connection_ids, payment_consent_ids)):
+                if not ids:
+                    continue
+                model = kind.model
+                await db.execute(
+                    update(model)
+                    .where(
+                        model.id.in_(ids),
+                        model.user_id == user_id,
+                        model.status == models.AWAITING_AUTHORIZATION,
+                        model.status_checks >= self.max_checks,
+                        model.next_status_check_at > func.now(),
+                    )
+                    .values(status_checks=0, next_status_check_at=func.now())
+                    .execution_options(synchronize_session=False)
+                )
+            await db.commit()
+
+    async def _check(self, kind: WatchedKind, object_id: int, bank_name: str) -> None:
+        try:
+            async with bank_clients.semaphore(bank_name):
+                async with AsyncSessionLocal() as db:
+                    obj = await db.get(kind.model, object_id)
+                    # Могли удалить или проверить по запросу клиента
+                    if obj is None or obj.status != models.AWAITING_AUTHORIZATION:
+                        return
+                    await kind.refresh(db, obj)
+                    kind.checked += 1
+                    if obj.status != models.AWAITING_AUTHORIZATION:
+                        kind.changed += 1
+        except HTTPException as e:
+            kind.failed += 1
+            kind.last_error = f"{e.status_code}: {e.detail}"
+        except BankUnavailableError as e:
+            kind.failed += 1
+            kind.last_error = str(e)
+        except Exception as e:
+            kind.failed += 1
+            kind.last_error = str(e)
+            logger.error(f"Consent check for {kind.name} {object_id} failed: {e}")
+
+    async def run_once(self) -> int:
+        """Проверяет по одной пачке подключений и согласий на платежи. Возвращает размер большей пачки."""
+        started = time.perf_counter()
+        claimed = [(kind, await self._claim(kind)) for kind in self.kinds]
+        await asyncio.gather(*(
+            self._check(kind, object_id, bank_name) for kind, rows in claimed for object_id, bank_name in rows
+        ))
+
+        self.stats["runs"] += 1
+        self.stats["claimed"] += sum(len(rows) for _, rows in claimed)
+        self.stats["last_run_at"] = datetime.now(timezone.utc)
+        self.stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return max(len(rows) for _, rows in claimed)
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Consent watcher run failed: {e}")
+                processed = 0
+            # Полная пачка — очередь, вероятно, не пуста: берем следующую сразу
+            if processed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._runner is not None,
+            "batch_size": self.batch_size,
+            "check_base_s": self.check_base,
+            "check_max_s": self.check_max,
+            "max_checks": self.max_checks,
+            "tail_interval_s": self.tail_interval,
+            "stats": dict(self.stats),
+            "kinds": {kind.name: kind.snapshot() for kind in self.kinds},
+        }
+
+
+# Единственный экземпляр на процесс
+consent_watcher = ConsentWatcher()
+
+
+async def main() -> None:
+    """Отдельный процесс проверки согласий: python consent_watcher.py"""
+    from bank_tokens import bank_token_cache
+    from database import async_engine
+
+    logging.basicConfig(level=logging.INFO)
+    await bank_clients.start()
+    await bank_registry.start()
+    await bank_token_cache.start()
+    await consent_watcher.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(consent_watcher.poll_interval, 1))
+            except asyncio.TimeoutError:
+                logger.info(f"Consent watcher: {consent_watcher.snapshot()}")
+    finally:
+        await consent_watcher.stop()
+        await bank_token_cache.stop()
+        await bank_registry.stop()
+        await bank_clients.stop()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
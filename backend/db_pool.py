@@ -0,0 +1,225 @@
+# finance-app-master/db_pool.py
+import asyncio
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+from sqlalchemy import event, exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from config import DB_POOL_SLOW_HOLD_THRESHOLD, DB_POOL_METRICS_INTERVAL
+
+logger = logging.getLogger("uvicorn")
+
+# Границы корзин гистограммы ожидания соединения, мс
+WAIT_BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# ASGI scope текущего запроса: по нему соединению приписывается маршрут
+current_request_scope: ContextVar[Optional[dict]] = ContextVar("current_request_scope", default=None)
+
+
+def _route_label(scope: Optional[dict]) -> str:
+    if scope is None:
+        return "background"
+    # Маршрут (шаблон пути) появляется в scope после роутинга
+    route = scope.get("route")
+    path = getattr(route, "path", None) or scope.get("path", "?")
+    return f"{scope.get('method', '')} {path}".strip()
+
+
+class PoolMetrics:
+    """Метрики одного пула: время ожидания соединения и время его удержания."""
+
+    def __init__(self, name: str, slow_hold_threshold: float = DB_POOL_SLOW_HOLD_THRESHOLD):
+        self.name = name
+        self.slow_hold_threshold = slow_hold_threshold
+        self.pool: Optional[QueuePool] = None
+        self._lock = threading.Lock()
+        self._wait_buckets = [0] * (len(WAIT_BUCKETS_MS) + 1)
+        self._wait_count = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+        # id(connection_record) -> (время выдачи, scope запроса)
+        self._held: Dict[int, tuple] = {}
+        self._slow_holds = deque(maxlen=50)
+
+    def observe_wait(self, seconds: float, timed_out: bool = False) -> None:
+        ms = seconds * 1000
+        with self._lock:
+            self._wait_buckets[bisect_left(WAIT_BUCKETS_MS, ms)] += 1
+            self._wait_count += 1
+            self._wait_total += ms
+            self._wait_max = max(self._wait_max, ms)
+            if timed_out:
+                self._timeouts += 1
+
+    def on_checkout(self, dbapi_connection, connection_record, connection_proxy) -> None:
+        with self._lock:
+            self._held[id(connection_record)] = (time.monotonic(), current_request_scope.get())
+
+    def on_checkin(self, dbapi_connection, connection_record) -> None:
+        with self._lock:
+            held = self._held.pop(id(connection_record), None)
+        if held is None:
+            return
+        started, scope = held
+        seconds = time.monotonic() - started
+        if seconds >= self.slow_hold_threshold:
+            route = _route_label(scope)
+            self._slow_holds.append({
+                "route": route,
+                "held_s": round(seconds, 3),
+                "released_at": datetime.now(timezone.utc),
+            })
+            logger.warning(f"DB connection ({self.name}) held for {seconds:.1f}s by {route}")
+
+    def snapshot(self) -> dict:
+        now = time.monotonic()
+        with self._lock:
+            buckets = list(self._wait_buckets)
+            held = list(self._held.values())
+            waits = {
+                "count": self._wait_count,
+                "total_ms": round(self._wait_total, 1),
+                "max_ms": round(self._wait_max, 1),
+                "timeouts": self._timeouts,
+            }
+            slow_holds = list(self._slow_holds)
+
+        # Гистограмма в стиле Prometheus: накопительные счетчики "<= le_ms"
+        histogram, cumulative = [], 0
+        for bound, count in zip((*WAIT_BUCKETS_MS, "+Inf"), buckets):
+            cumulative += count
+            histogram.append({"le_ms": bound, "count": cumulative})
+        waits["histogram"] = histogram
+
+        long_held = sorted(
+            (
+                {"route": _route_label(scope), "held_s": round(now - started, 3)}
+                for started, scope in held
+                if now - started >= self.slow_hold_threshold
+            ),
+            key=lambda item: item["held_s"],
+            reverse=True,
+        )
+
+        pool = self.pool
+        return {
+            "size": pool.size() if pool else None,
+            "checked_out": pool.checkedout() if pool else None,
+            "checked_in": pool.checkedin() if pool else None,
+            "overflow": max(pool.overflow(), 0) if pool else None,
+            "waits": waits,
+            "slow_hold_threshold_s": self.slow_hold_threshold,
+            "long_held": long_held,
+            "recent_slow_holds": slow_holds,
+        }
+
+
+class _TimedGetMixin:
+    """Замеряет, сколько запрос ждал свободное соединение из пула."""
+
+    metrics: Optional[PoolMetrics] = None
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            if self.metrics:
+                self.metrics.observe_wait(time.perf_counter() - started, timed_out=True)
+            raise
+        if self.metrics:
+            self.metrics.observe_wait(time.perf_counter() - started)
+        return connection
+
+
+class InstrumentedQueuePool(_TimedGetMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncQueuePool(_TimedGetMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+class DbPoolMonitor:
+    """Все инструментированные пулы процесса и хуки для выгрузки их метрик."""
+
+    def __init__(self, interval: float = DB_POOL_METRICS_INTERVAL):
+        self.interval = interval
+        self.pools: Dict[str, PoolMetrics] = {}
+        self._hooks: List[Callable[[dict], None]] = []
+        self._reporter: Optional[asyncio.Task] = None
+
+    def instrument(self, name: str, pool: QueuePool) -> PoolMetrics:
+        metrics = PoolMetrics(name)
+        metrics.pool = pool
+        if isinstance(pool, _TimedGetMixin):
+            pool.metrics = metrics
+        event.listen(pool, "checkout", metrics.on_checkout)
+        event.listen(pool, "checkin", metrics.on_checkin)
+        self.pools[name] = metrics
+        return metrics
+
+    def add_hook(self, hook: Callable[[dict], None]) -> None:
+        """
+        Регистрирует хук метрик: раз в DB_POOL_METRICS_INTERVAL секунд он
+        получает snapshot() (например, для экспорта в Prometheus/StatsD).
+        """
+        self._hooks.append(hook)
+
+    def snapshot(self) -> dict:
+        return {name: metrics.snapshot() for name, metrics in self.pools.items()}
+
+    async def _report_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval)
+            stats = self.snapshot()
+            for hook in self._hooks:
+                try:
+                    hook(stats)
+                except Exception as e:
+                    logger.error(f"DB pool metrics hook failed: {e}")
+
+    async def start(self) -> None:
+        if self.interval > 0 and self._reporter is None:
+            self._reporter = asyncio.create_task(self._report_loop())
+
+    async def stop(self) -> None:
+        if self._reporter is not None:
+            self._reporter.cancel()
+            try:
+                await self._reporter
+            except asyncio.CancelledError:
+                pass
+            self._reporter = None
+
+
+# Единственный экземпляр на процесс
+db_pool_monitor = DbPoolMonitor()
+
+
+class DbRouteMiddleware:
+    """
+    ASGI-middleware: запоминает scope запроса в contextvar, чтобы
+    удержанное соединение можно было приписать маршруту.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        token = current_request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request_scope.reset(token)
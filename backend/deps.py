@@ -2,40 +2,80 @@
 from fastapi import Depends, HTTPException, status, Path # <-- Добавьте Path
 from fastapi.security import OAuth2PasswordBearer
 from jose import JWTError, jwt
-from sqlalchemy.orm import Session
+from sqlalchemy import select
 
-from database import get_db
+from database import AsyncSessionLocal
 from models import User
 from security import SECRET_KEY, ALGORITHM
+from principal_cache import Principal, principal_cache
+from principal_revocations import principal_revocations
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
 
-def get_current_user(
-    db: Session = Depends(get_db),
-    token: str = Depends(oauth2_scheme)
-) -> User: 
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+def _decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email: str = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(User).filter(User.email == email).first()
-    if user is None:
+    if payload.get("sub") is None:
         raise credentials_exception
-    return user
+    return payload
+
+
+async def _load_principal(email: str) -> Principal:
+    # Без слушателя отзывов кэш может пропустить отзыв из другого процесса — читаем БД
+    principal = principal_cache.get(email) if principal_revocations.listening else None
+    if principal is None:
+        async with AsyncSessionLocal() as db:
+            user = await db.scalar(select(User).where(User.email == email))
+        if user is None:
+            raise credentials_exception
+        principal = Principal(id=user.id, email=user.email, is_admin=bool(user.is_admin))
+        principal_cache.put(email, principal)
+    return principal
+
+
+async def get_current_user(token: str = Depends(oauth2_scheme)) -> Principal:
+    """
+    Пользователь по JWT. Берется из principal_cache, а при промахе
+    загружается из БД. Это неизменяемая копия (id, email, is_admin):
+    чтобы изменить пользователя, загрузите строку в своей сессии
+    и вызовите principal_cache.invalidate_user().
+    """
+    payload = _decode_token(token)
+    principal = await _load_principal(payload["sub"])
+    if principal_cache.is_revoked(principal.id, payload.get("iat")):
+        raise credentials_exception
+    return principal
+
+
+async def get_token_principal(token: str = Depends(oauth2_scheme)) -> Principal:
+    """
+    Пользователь только по claims токена (user_id, is_admin) — без обращения к БД.
+    Отзывы из других процессов приходят через principal_revocations.py;
+    пока его соединение с БД потеряно, а также для токенов старого формата
+    (без этих claims) пользователь проверяется через get_current_user.
+    """
+    payload = _decode_token(token)
+    user_id, is_admin = payload.get("user_id"), payload.get("is_admin")
+    if user_id is None or is_admin is None or not principal_revocations.listening:
+        return await get_current_user(token)
+    if principal_cache.is_revoked(user_id, payload.get("iat")):
+        raise credentials_exception
+    return Principal(id=user_id, email=payload["sub"], is_admin=bool(is_admin))
 
 # --- НОВАЯ ЗАВИСИМОСТЬ ---
-def user_is_admin_or_self(
+async def user_is_admin_or_self(
     user_id: int = Path(..., description="ID пользователя, к ресурсам которого осуществляется доступ"),
-    current_user: User = Depends(get_current_user)
-) -> User:
+    current_user: Principal = Depends(get_token_principal)
+) -> Principal:
     """
     Проверяет, является ли текущий пользователь администратором
     ИЛИ запрашивает свои собственные ресурсы.
@@ -48,7 +88,7 @@ def user_is_admin_or_self(
     return current_user
 
 # --- НОВАЯ ЗАВИСИМОСТЬ ДЛЯ АДМИНОВ ---
-def get_current_admin_user(current_user: User = Depends(get_current_user)) -> User:
+async def get_current_admin_user(current_user: Principal = Depends(get_token_principal)) -> Principal:
     """
     Проверяет, является ли текущий пользователь администратором.
     Если нет - выбрасывает исключение 403 Forbidden.
@@ -58,4 +98,4 @@ def get_current_admin_user(current_user: User = Depends(get_current_user)) -> Us
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Admin privileges required"
         )
-    return current_user
\ No newline at end of file
+    return current_user
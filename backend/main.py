@@ -1,11 +1,31 @@
 # finance-app-master/main.py
-from fastapi import FastAPI
+import math
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 import models
-from database import engine
+from database import engine, async_engine
+from db_pool import db_pool_monitor, DbRouteMiddleware
+from password_hasher import password_hasher
+from bank_client import bank_clients, BankUnavailableError
+from bank_tokens import bank_token_cache
+from bank_registry import bank_registry
+from scheduled_payment_worker import scheduled_payment_worker
+from payment_status_poller import payment_status_poller
+from consent_events import consent_events
+from principal_revocations import principal_revocations
+from consent_watcher import consent_watcher
+from account_sync_scheduler import account_sync_scheduler
+from config import (
+    SCHEDULED_PAYMENTS_WORKER_ENABLED,
+    PAYMENT_STATUS_POLLER_ENABLED,
+    CONSENT_WATCHER_ENABLED,
+    ACCOUNT_SYNC_ENABLED,
+)
 from auth import router as auth_router
 from user_api import router as user_router
 from banks_api import router as banks_router
@@ -15,17 +35,73 @@ from transactions_api import router as transactions_router
 from payment_consents_api import router as payment_consents_router
 from payments_api import router as payments_router # <--- ДОБАВЛЕН ИМПОРТ
 from scheduled_payments_api import router as scheduled_payments_router # <--- НОВЫЙ ИМПОРТ
+from consent_events_api import router as consent_events_router
+from admin_api import router as admin_router
 
 load_dotenv()
 
 # models.Base.metadata.create_all(bind=engine)
 
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Общие пулы HTTP-соединений к банкам живут все время работы приложения
+    await bank_clients.start()
+    # Снимок таблицы banks в памяти (вместо SELECT в каждом запросе)
+    await bank_registry.start()
+    # Фоновое обновление токенов банков до истечения их срока
+    await bank_token_cache.start()
+    # Периодическая выгрузка метрик пула соединений с БД в зарегистрированные хуки
+    await db_pool_monitor.start()
+    # Отзывы токенов пользователей из других процессов (LISTEN)
+    await principal_revocations.start()
+    # Исполнение наступивших автоплатежей
+    if SCHEDULED_PAYMENTS_WORKER_ENABLED:
+        await scheduled_payment_worker.start()
+    # Фоновое обновление статусов незавершенных платежей
+    if PAYMENT_STATUS_POLLER_ENABLED:
+        await payment_status_poller.start()
+    # Доставка изменений статусов согласий в SSE-потоки клиентов (LISTEN)
+    await consent_events.start()
+    # Фоновая проверка согласий, ожидающих подтверждения
+    if CONSENT_WATCHER_ENABLED:
+        await consent_watcher.start()
+    # Фоновая синхронизация счетов всех активных подключений; обычно — отдельным процессом (make account-sync)
+    if ACCOUNT_SYNC_ENABLED:
+        await account_sync_scheduler.start()
+    yield
+    await account_sync_scheduler.stop()
+    await consent_watcher.stop()
+    await consent_events.stop()
+    await payment_status_poller.stop()
+    await scheduled_payment_worker.stop()
+    await principal_revocations.stop()
+    await db_pool_monitor.stop()
+    await bank_token_cache.stop()
+    await bank_registry.stop()
+    await bank_clients.stop()
+    await async_engine.dispose()
+    password_hasher.shutdown()
+
+
 app = FastAPI(
     title="FinApp API",
     version="1.0.0",
-    description="API для подключения банковских счетов и управления финансовыми данными."
+    description="API для подключения банковских счетов и управления финансовыми данными.",
+    lifespan=lifespan
 )
 
+
+@app.exception_handler(BankUnavailableError)
+async def bank_unavailable_handler(request: Request, exc: BankUnavailableError):
+    # Банк отклонен выключателем или ограничителем частоты (bank_client.py) — без ожидания таймаутов
+    return JSONResponse(
+        status_code=503,
+        content={"detail": str(exc), "bank_name": exc.bank_name},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))},
+    )
+
+
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 origins = [
@@ -39,6 +115,8 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Привязка соединений с БД к маршрутам для /admin/db-pool
+app.add_middleware(DbRouteMiddleware)
 
 app.include_router(auth_router)
 app.include_router(user_router)
@@ -48,4 +126,6 @@ app.include_router(accounts_router)
 app.include_router(transactions_router)
 app.include_router(payment_consents_router)
 app.include_router(payments_router) # <--- ПОДКЛЮЧЕН НОВЫЙ РОУТЕР
-app.include_router(scheduled_payments_router) # <--- ПОДКЛЮЧИТЬ НОВЫЙ РОУТЕР
\ No newline at end of file
+app.include_router(scheduled_payments_router) # <--- ПОДКЛЮЧИТЬ НОВЫЙ РОУТЕР
+app.include_router(consent_events_router)
+app.include_router(admin_router)
@@ -1,12 +1,11 @@
 # finance-app-master/models.py
 import enum
-from sqlalchemy import Column, Integer, String, Boolean, Numeric, Enum, ForeignKey, DateTime, Date
-from sqlalchemy.orm import relationship, column_property
+from sqlalchemy import Column, Integer, String, Boolean, Numeric, Enum, ForeignKey, DateTime, Date, UniqueConstraint, Index
+from sqlalchemy.orm import relationship
 from sqlalchemy.dialects.postgresql import JSONB 
-from sqlalchemy.sql import func 
+from sqlalchemy.sql import func, text
 from database import Base
 from sqlalchemy.ext.associationproxy import association_proxy
-from sqlalchemy.sql import select
 
 class Bank(Base):
     __tablename__ = "banks"
@@ -18,29 +17,75 @@ class Bank(Base):
     auto_approve = Column(Boolean, default=False)
     icon_filename = Column(String, nullable=True)
 
+class BankToken(Base):
+    """Общий для всех воркеров токен доступа к банку (см. bank_tokens.PostgresBankTokenStore)."""
+    __tablename__ = "bank_tokens"
+    bank_name = Column(String, primary_key=True)
+    access_token = Column(String, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+    refresh_at = Column(DateTime, nullable=False)
+    # Аренда выпуска нового токена: до этого момента токен запрашивает у банка один воркер
+    minting_until = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
+
 class User(Base):
     __tablename__ = "users"
     id = Column(Integer, primary_key=True, index=True)
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     is_admin = Column(Boolean, default=False, server_default='f')
-    
+
+
+class TokenRevocation(Base):
+    """
+    Момент отзыва токенов пользователя (см. principal_revocations.py).
+    Без внешнего ключа на users: запись должна пережить удаление пользователя.
+    """
+    __tablename__ = "token_revocations"
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    revoked_at = Column(DateTime(timezone=True), nullable=False, index=True)
+
+# Статус подключения / согласия на платеж, которое ждет подтверждения клиентом в банке
+AWAITING_AUTHORIZATION = "awaitingauthorization"
+
+
 class ConnectedBank(Base):
     __tablename__ = "connected_banks"
+    __table_args__ = (
+        # Очередь consent_watcher.py: только ожидающие подтверждения
+        Index(
+            "ix_connected_banks_awaiting_status_check", "next_status_check_at",
+            postgresql_where=text(f"status = '{AWAITING_AUTHORIZATION}'"),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"))
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
     bank_name = Column(String, index=True)
+    # banks.id по bank_name: заполняется при создании подключения
+    bank_id = Column(Integer, ForeignKey("banks.id"), nullable=True)
     bank_client_id = Column(String, index=True)
     request_id = Column(String, unique=True, nullable=True, index=True)
     consent_id = Column(String, unique=True, nullable=True)
     status = Column(String, default="awaitingauthorization")
     full_name = Column(String, nullable=True)
+    # Фоновая проверка подтверждения (consent_watcher.py)
+    status_checks = Column(Integer, nullable=False, server_default="0")
+    next_status_check_at = Column(DateTime(timezone=True))
+    # Фоновая синхронизация счетов (account_sync_scheduler.py)
+    accounts_synced_at = Column(DateTime(timezone=True))
+    accounts_sync_started_at = Column(DateTime(timezone=True))
+    # Когда клиент последний раз открывал счета подключения (POST .../accounts/{id}/refresh)
+    last_viewed_at = Column(DateTime(timezone=True))
     
     user = relationship("User")
     accounts = relationship("Account", back_populates="connection", cascade="all, delete-orphan")
 
 class Account(Base):
     __tablename__ = "accounts"
+    __table_args__ = (
+        # Нужен для пакетного upsert счетов (INSERT ... ON CONFLICT)
+        UniqueConstraint("connection_id", "api_account_id", name="uq_accounts_connection_api_account"),
+    )
     id = Column(Integer, primary_key=True, index=True)
     connection_id = Column(Integer, ForeignKey("connected_banks.id"), nullable=False)
     
@@ -58,22 +103,55 @@ class Account(Base):
     owner_data = Column(JSONB, nullable=True)
     balance_data = Column(JSONB, nullable=True)
 
+    # Состояние синхронизации транзакций (см. transaction_store.py)
+    transactions_synced_at = Column(DateTime(timezone=True), nullable=True)
+    transactions_watermark = Column(DateTime(timezone=True), nullable=True)
+
     connection = relationship("ConnectedBank", back_populates="accounts")
     
     bank_name = association_proxy("connection", "bank_name")
     bank_client_id = association_proxy("connection", "bank_client_id")
-    bank_id = column_property(
-        select(Bank.id)
-        .join(ConnectedBank, Bank.name == ConnectedBank.bank_name)
-        .where(ConnectedBank.id == connection_id)
-        .correlate_except(Bank)
-        .scalar_subquery()
+    bank_id = association_proxy("connection", "bank_id")
+
+class Transaction(Base):
+    """Транзакция счета, загруженная из банка (локальная копия)."""
+    __tablename__ = "transactions"
+    __table_args__ = (
+        UniqueConstraint("account_id", "transaction_id", name="uq_transactions_account_transaction"),
+        Index("ix_transactions_account_booking", "account_id", "booking_date_time"),
     )
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), nullable=False)
+    transaction_id = Column(String, nullable=False)
+    booking_date_time = Column(DateTime(timezone=True), nullable=False)
+    amount = Column(Numeric(18, 2), nullable=False)
+    currency = Column(String(3))
+    credit_debit_indicator = Column(String, nullable=False)
+    status = Column(String)
+    # Транзакция целиком в формате TransactionDetail
+    data = Column(JSONB, nullable=False)
+
+class TransactionDailyTotal(Base):
+    """Дневные обороты счета (день — по UTC), пересчитываются при синхронизации транзакций."""
+    __tablename__ = "transaction_daily_totals"
+    account_id = Column(Integer, ForeignKey("accounts.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    # Пустая строка, если банк не указал валюту
+    currency = Column(String(3), primary_key=True, server_default="")
+    total_credit = Column(Numeric(18, 2), nullable=False)
+    total_debit = Column(Numeric(18, 2), nullable=False)
 
 class PaymentConsent(Base):
     __tablename__ = "payment_consents"
+    __table_args__ = (
+        # Очередь consent_watcher.py: только ожидающие подтверждения
+        Index(
+            "ix_payment_consents_awaiting_status_check", "next_status_check_at",
+            postgresql_where=text(f"status = '{AWAITING_AUTHORIZATION}'"),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     
     bank_name = Column(String, index=True)
     bank_client_id = Column(String, index=True)
@@ -84,6 +162,9 @@ class PaymentConsent(Base):
     status = Column(String, default="awaitingauthorization")
     
     details = Column(JSONB, nullable=True)
+    # Фоновая проверка подтверждения (consent_watcher.py)
+    status_checks = Column(Integer, nullable=False, server_default="0")
+    next_status_check_at = Column(DateTime(timezone=True))
 
     user = relationship("User")
     # --- vvv НЕДОСТАЮЩАЯ СТРОКА ДОБАВЛЕНА ЗДЕСЬ vvv ---
@@ -91,8 +172,21 @@ class PaymentConsent(Base):
     # --- ^^^ КОНЕЦ ИЗМЕНЕНИЯ ^^^ ---
 
 
+# Статусы платежа (в нижнем регистре), после которых он больше не меняется
+FINAL_PAYMENT_STATUSES = ("acceptedsettlementcompleted", "acceptedcreditsettlementcompleted", "rejected", "cancelled")
+
+
 class Payment(Base):
     __tablename__ = "payments"
+    __table_args__ = (
+        # Keyset-пагинация истории платежей пользователя (created_at DESC, id DESC)
+        Index("ix_payments_user_created", "user_id", "created_at", "id"),
+        # Очередь фоновой проверки статусов: только незавершенные платежи
+        Index(
+            "ix_payments_pending_status_check", "next_status_check_at",
+            postgresql_where=text("status NOT IN (%s)" % ", ".join(f"'{s}'" for s in FINAL_PAYMENT_STATUSES)),
+        ),
+    )
     id = Column(Integer, primary_key=True, index=True)
     
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
@@ -113,6 +207,9 @@ class Payment(Base):
     idempotency_key = Column(String, unique=True, nullable=False)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Фоновая проверка статуса (payment_status_poller.py)
+    status_checked_at = Column(DateTime(timezone=True))
+    next_status_check_at = Column(DateTime(timezone=True))
 
     user = relationship("User")
     debtor_account = relationship("Account")
@@ -134,9 +231,13 @@ class ScheduledPaymentAmountType(enum.Enum):
 
 class ScheduledPayment(Base):
     __tablename__ = "scheduled_payments"
+    __table_args__ = (
+        # Выборка автоплатежей к исполнению: только активные, по дате
+        Index("ix_scheduled_payments_active_next_date", "next_payment_date", postgresql_where=text("is_active")),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
     
     debtor_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False) 
     creditor_account_id = Column(Integer, ForeignKey("accounts.id"), nullable=False) 
@@ -162,6 +263,13 @@ class ScheduledPayment(Base):
     
     is_active = Column(Boolean, default=True, nullable=False)
 
+    # Исполнение (см. scheduled_payment_worker.py)
+    last_executed_at = Column(DateTime(timezone=True), nullable=True)
+    # После неудачи автоплатеж не берется в работу до retry_at (экспоненциальная пауза)
+    retry_at = Column(DateTime(timezone=True), nullable=True)
+    failed_attempts = Column(Integer, nullable=False, default=0, server_default="0")
+    last_error = Column(String, nullable=True)
+
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
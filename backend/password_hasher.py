@@ -0,0 +1,98 @@
+# finance-app-master/password_hasher.py
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from security import get_password_hash, verify_and_update_password
+from config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+
+
+class PasswordHasher:
+    """
+    bcrypt в отдельном ограниченном пуле потоков.
+
+    - Event loop не блокируется: вход одного пользователя не замораживает
+      запросы остальных.
+    - Одновременно выполняется не больше `workers` операций, остальные ждут
+      в очереди длиной не больше `max_queue`.
+    - Сверх очереди запросы сразу получают 503 (admission control):
+      волна подбора паролей не копит бесконечную очередь и не съедает CPU
+      всего воркера.
+    """
+
+    def __init__(self, workers: int = PASSWORD_HASH_WORKERS, max_queue: int = PASSWORD_HASH_MAX_QUEUE):
+        self.workers = max(1, workers)
+        self.max_queue = max(0, max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._pending = 0
+        self._running = 0
+        # _running и stats меняются из потоков пула
+        self._lock = threading.Lock()
+        self.stats = {"completed": 0, "rejected": 0, "rehashed": 0, "max_queue_depth": 0, "total_ms": 0.0, "max_ms": 0.0}
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending - self._running
+
+    def _timed(self, fn, *args):
+        with self._lock:
+            self._running += 1
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._running -= 1
+                self.stats["completed"] += 1
+                self.stats["total_ms"] += elapsed
+                self.stats["max_ms"] = max(self.stats["max_ms"], elapsed)
+
+    async def _submit(self, fn, *args):
+        if self._pending >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent authentication requests, please retry later.",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        self.stats["max_queue_depth"] = max(self.stats["max_queue_depth"], self.queue_depth)
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, self._timed, fn, *args)
+        finally:
+            self._pending -= 1
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        verified, new_hash = await self._submit(verify_and_update_password, plain_password, hashed_password)
+        if new_hash:
+            self.stats["rehashed"] += 1
+        return verified, new_hash
+
+    async def hash(self, password: str) -> str:
+        return await self._submit(get_password_hash, password)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def snapshot(self) -> dict:
+        completed = self.stats["completed"]
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "running": self._running,
+            "queue_depth": self.queue_depth,
+            "stats": {
+                **{key: value for key, value in self.stats.items() if key != "total_ms"},
+                "avg_ms": round(self.stats["total_ms"] / completed, 1) if completed else None,
+                "max_ms": round(self.stats["max_ms"], 1),
+            },
+        }
+
+
+# Единственный экземпляр на процесс
+password_hasher = PasswordHasher()
@@ -1,12 +1,14 @@
 # finance-app-master/payment_consents_api.py
 import httpx
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List
 from decimal import Decimal
 
 import models
-from database import get_db
+from database import get_db, get_async_db
 from deps import user_is_admin_or_self
 from schemas import (
     PaymentConsentInitiate,
@@ -14,6 +16,9 @@ from schemas import (
     PaymentConsentListResponse,
 )
 from utils import get_bank_token, log_response, revoke_payment_consent
+from bank_client import bank_clients
+from bank_registry import bank_registry
+from consent_events import notify_consent_event
 
 router = APIRouter(
     prefix="/users/{user_id}/payment-consents",
@@ -25,15 +30,15 @@ router = APIRouter(
 async def initiate_payment_consent(
     user_id: int,
     consent_data: PaymentConsentInitiate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self),
 ):
     """Создает запрос на согласие для совершения платежа."""
-    bank_config = db.query(models.Bank).filter(models.Bank.name == consent_data.bank_name).first()
+    bank_config = await bank_registry.fetch_by_name(consent_data.bank_name)
     if not bank_config:
         raise HTTPException(status_code=404, detail=f"Bank '{consent_data.bank_name}' not found.")
 
-    bank_access_token = await get_bank_token(consent_data.bank_name, db)
+    bank_access_token = await get_bank_token(consent_data.bank_name)
     
     request_url = f"{bank_config.base_url}/payment-consents/request"
     headers = {
@@ -53,8 +58,8 @@ async def initiate_payment_consent(
         if isinstance(value, Decimal):
             api_body[key] = str(value)
 
-    async with httpx.AsyncClient() as client:
-        response = await client.post(request_url, headers=headers, json=api_body)
+    client = bank_clients.get(bank_config.name)
+    response = await client.post(request_url, headers=headers, json=api_body)
     
     log_response(response)
     if response.status_code != 200:
@@ -74,8 +79,8 @@ async def initiate_payment_consent(
         details=api_body
     )
     db.add(new_consent)
-    db.commit()
-    db.refresh(new_consent)
+    await db.commit()
+    await db.refresh(new_consent)
 
     return new_consent
 
@@ -90,34 +95,25 @@ def list_payment_consents(
     return {"count": len(consents), "consents": consents}
 
 
-@router.post("/{consent_db_id}", response_model=PaymentConsentResponse, summary="Проверить статус согласия на платеж")
-async def check_payment_consent_status(
-    user_id: int,
-    consent_db_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(user_is_admin_or_self),
-):
-    """Проверяет статус ранее инициированного согласия в банке и обновляет его в БД."""
-    consent = db.query(models.PaymentConsent).filter(
-        models.PaymentConsent.id == consent_db_id,
-        models.PaymentConsent.user_id == user_id
-    ).first()
-    if not consent:
-        raise HTTPException(status_code=404, detail="Payment consent not found.")
-    
+async def refresh_payment_consent_status(db: AsyncSession, consent: models.PaymentConsent) -> models.PaymentConsent:
+    """
+    Проверяет статус согласия на платеж в банке и сохраняет его.
+    Общая часть эндпоинта проверки и фонового consent_watcher.py;
+    об изменении статуса публикуется событие consent_events.
+    """
     if consent.status not in ["awaitingauthorization"]:
         return consent # Возвращаем как есть, статус уже финальный
         
-    bank_config = db.query(models.Bank).filter(models.Bank.name == consent.bank_name).first()
+    bank_config = await bank_registry.fetch_by_name(consent.bank_name)
     if not bank_config:
         raise HTTPException(status_code=500, detail="Bank configuration not found.")
 
-    bank_access_token = await get_bank_token(consent.bank_name, db)
+    bank_access_token = await get_bank_token(consent.bank_name)
     check_url = f"{bank_config.base_url}/payment-consents/{consent.request_id}"
     headers = {"Authorization": f"Bearer {bank_access_token}"}
     
-    async with httpx.AsyncClient() as client:
-        response = await client.get(check_url, headers=headers)
+    client = bank_clients.get(bank_config.name)
+    response = await client.get(check_url, headers=headers)
     
     log_response(response)
     if response.status_code != 200:
@@ -129,38 +125,57 @@ async def check_payment_consent_status(
     # --- vvv ГЛАВНОЕ ИЗМЕНЕНИЕ ЗДЕСЬ vvv ---
     # Проверяем, изменился ли статус в API, и обновляем нашу БД.
     if api_status != consent.status:
+        await notify_consent_event(db, consent.user_id, "payment_consent", consent.id, api_status)
         consent.status = api_status  # Обновляем статус (approved, rejected и т.д.)
 
         # Если статус "approved", дополнительно сохраняем consent_id
         if api_status == "approved" and response_data.get("consent_id"):
             consent.consent_id = response_data["consent_id"]
         
-        db.commit()
-        db.refresh(consent)
+        await db.commit()
+        await db.refresh(consent)
     # --- ^^^ КОНЕЦ ИЗМЕНЕНИЯ ^^^ ---
         
     return consent
 
 
+@router.post("/{consent_db_id}", response_model=PaymentConsentResponse, summary="Проверить статус согласия на платеж")
+async def check_payment_consent_status(
+    user_id: int,
+    consent_db_id: int,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(user_is_admin_or_self),
+):
+    """Проверяет статус ранее инициированного согласия в банке и обновляет его в БД."""
+    consent = await db.scalar(select(models.PaymentConsent).where(
+        models.PaymentConsent.id == consent_db_id,
+        models.PaymentConsent.user_id == user_id
+    ))
+    if not consent:
+        raise HTTPException(status_code=404, detail="Payment consent not found.")
+
+    return await refresh_payment_consent_status(db, consent)
+
+
 @router.delete("/{consent_db_id}", summary="Удалить/отозвать согласие на платеж")
 async def delete_payment_consent(
     user_id: int,
     consent_db_id: int,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self),
 ):
     """Отзывает согласие в банке (если возможно) и удаляет его из БД."""
-    consent = db.query(models.PaymentConsent).filter(
+    consent = await db.scalar(select(models.PaymentConsent).where(
         models.PaymentConsent.id == consent_db_id,
         models.PaymentConsent.user_id == user_id
-    ).first()
+    ))
 
     if not consent:
         raise HTTPException(status_code=404, detail="Payment consent not found.")
 
-    await revoke_payment_consent(consent, db)
+    await revoke_payment_consent(consent)
     
-    db.delete(consent)
-    db.commit()
+    await db.delete(consent)
+    await db.commit()
     
     return {"status": "deleted", "message": "Payment consent has been revoked and deleted."}
\ No newline at end of file
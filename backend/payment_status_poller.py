@@ -0,0 +1,273 @@
+# finance-app-master/payment_status_poller.py
+import asyncio
+import logging
+import signal
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import DateTime, Integer, String, case, column, func, or_, select, update, values
+from sqlalchemy.ext.asyncio import AsyncSession
+
+import models
+from database import AsyncSessionLocal
+from bank_client import bank_clients
+from bank_registry import bank_registry
+from payments_api import fetch_payment_status
+from schemas import PaymentStatusResponse
+from config import (
+    PAYMENT_STATUS_POLL_INTERVAL,
+    PAYMENT_STATUS_BATCH_SIZE,
+    PAYMENT_STATUS_CHECK_BASE,
+    PAYMENT_STATUS_CHECK_MAX,
+    PAYMENT_STATUS_MAX_AGE,
+    PAYMENT_STATUS_CLAIM_LEASE,
+)
+
+logger = logging.getLogger("uvicorn")
+
+
+def next_check_delay(age: float, base: float, maximum: float) -> float:
+    """
+    Пауза до следующей проверки платежа возраста age (секунды): base, 2*base,
+    4*base... — наибольшая степень, не превышающая возраст, но не больше maximum.
+    Свежие платежи проверяются часто, зависшие — все реже.
+    """
+    delay = base
+    while delay * 2 <= min(age, maximum):
+        delay *= 2
+    return min(delay, maximum)
+
+
+@dataclass
+class StatusCheck:
+    payment_id: int
+    bank_name: str
+    status: str
+    next_check_at: datetime
+    error: Optional[str] = None
+
+
+class BankStats:
+    def __init__(self):
+        self.checked = 0
+        self.changed = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+
+    def snapshot(self) -> dict:
+        return {"checked": self.checked, "changed": self.changed, "failed": self.failed, "last_error": self.last_error}
+
+
+class PaymentStatusPoller:
+    """
+    Фоновое обновление статусов незавершенных платежей.
+
+    Платежи, которым пора проверить статус (next_status_check_at), забираются
+    пачками короткой транзакцией: UPDATE ... WHERE id IN (SELECT ... FOR
+    UPDATE SKIP LOCKED) сдвигает next_status_check_at на claim_lease
+    (аренда) и сразу коммитится — экземпляры в разных процессах не
+    проверяют один платеж дважды, а строки и соединение с БД не заняты,
+    пока идут запросы в банки. Запросы идут параллельно под общим для
+    процесса лимитом на банк (bank_clients.semaphore), а результаты пачки
+    записываются второй короткой транзакцией, одним
+    UPDATE ... FROM (VALUES ...). Если процесс упадет между ними, платеж
+    проверится снова после истечения аренды. Интервал до следующей проверки растет
+    с возрастом платежа (next_check_delay); платежи старше max_age
+    в фоне больше не проверяются.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = PAYMENT_STATUS_POLL_INTERVAL,
+        batch_size: int = PAYMENT_STATUS_BATCH_SIZE,
+        check_base: float = PAYMENT_STATUS_CHECK_BASE,
+        check_max: float = PAYMENT_STATUS_CHECK_MAX,
+        max_age: float = PAYMENT_STATUS_MAX_AGE,
+        claim_lease: float = PAYMENT_STATUS_CLAIM_LEASE,
+    ):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.check_base = check_base
+        self.check_max = check_max
+        self.max_age = max_age
+        self.claim_lease = claim_lease
+        self._runner: Optional[asyncio.Task] = None
+        self._banks: Dict[str, BankStats] = defaultdict(BankStats)
+        self.stats = {"runs": 0, "checked": 0, "changed": 0, "last_run_at": None, "last_run_ms": None}
+
+    async def _claim(self, now: datetime) -> list:
+        due = (
+            select(models.Payment.id)
+            .where(
+                models.Payment.status.not_in(models.FINAL_PAYMENT_STATUSES),
+                or_(models.Payment.next_status_check_at.is_(None), models.Payment.next_status_check_at <= now),
+                models.Payment.created_at >= now - timedelta(seconds=self.max_age),
+            )
+            .order_by(models.Payment.next_status_check_at.nulls_first(), models.Payment.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                update(models.Payment)
+                .where(models.Payment.id.in_(due.scalar_subquery()))
+                .values(next_status_check_at=now + timedelta(seconds=self.claim_lease))
+                .returning(
+                    models.Payment.id,
+                    models.Payment.bank_name,
+                    models.Payment.bank_client_id,
+                    models.Payment.bank_payment_id,
+                    models.Payment.status,
+                    models.Payment.created_at,
+                )
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        return rows
+
+    async def _check(self, payment, now: datetime) -> StatusCheck:
+        age = (now - payment.created_at).total_seconds()
+        check = StatusCheck(
+            payment.id, payment.bank_name, payment.status,
+            now + timedelta(seconds=next_check_delay(age, self.check_base, self.check_max)),
+        )
+        bank_config = await bank_registry.fetch_by_name(payment.bank_name)
+        if not bank_config:
+            check.error = f"Bank configuration for {payment.bank_name} not found."
+            return check
+        try:
+            async with bank_clients.semaphore(bank_config.name):
+                response = await fetch_payment_status(bank_config, payment.bank_client_id, payment.bank_payment_id)
+            check.status = PaymentStatusResponse.model_validate(response).data.status.lower()
+        except HTTPException as e:
+            check.error = f"{e.status_code}: {e.detail}"
+        except Exception as e:
+            check.error = str(e)
+        return check
+
+    async def _apply(self, db: AsyncSession, checks: List[StatusCheck], now: datetime) -> None:
+        """Записывает результаты всей пачки одним UPDATE."""
+        checked = values(
+            column("id", Integer), column("status", String), column("next_check_at", DateTime(timezone=True)),
+            name="checked",
+        ).data([(check.payment_id, check.status, check.next_check_at) for check in checks])
+        await db.execute(
+            update(models.Payment)
+            .where(
+                models.Payment.id == checked.c.id,
+                # Пока шел запрос в банк, статус мог стать окончательным (ручная проверка)
+                models.Payment.status.not_in(models.FINAL_PAYMENT_STATUSES),
+            )
+            .values(
+                status=checked.c.status,
+                # updated_at — время изменения статуса, а не проверки
+                updated_at=case((models.Payment.status != checked.c.status, func.now()), else_=models.Payment.updated_at),
+                status_checked_at=now,
+                next_status_check_at=checked.c.next_check_at,
+            )
+            .execution_options(synchronize_session=False)
+        )
+
+    async def run_once(self) -> int:
+        """Проверяет одну пачку платежей. Возвращает число проверенных."""
+        started = time.perf_counter()
+        now = datetime.now(timezone.utc)
+        checks: List[StatusCheck] = []
+        payments = await self._claim(now)
+        if payments:
+            # Без открытой транзакции: запросы в банки могут ждать ограничителя частоты или таймаута
+            checks = await asyncio.gather(*(self._check(payment, now) for payment in payments))
+            async with AsyncSessionLocal() as db:
+                await self._apply(db, checks, now)
+                await db.commit()
+
+        for payment, check in zip(payments, checks):
+            stats = self._banks[check.bank_name]
+            stats.checked += 1
+            if check.error:
+                stats.failed += 1
+                stats.last_error = check.error
+                logger.warning(f"Payment {check.payment_id} status check failed: {check.error}")
+            elif check.status != payment.status:
+                stats.changed += 1
+                self.stats["changed"] += 1
+        self.stats["runs"] += 1
+        self.stats["checked"] += len(payments)
+        self.stats["last_run_at"] = datetime.now(timezone.utc)
+        self.stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return len(payments)
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Payment status poll failed: {e}")
+                processed = 0
+            # Полная пачка — очередь, вероятно, не пуста: берем следующую сразу
+            if processed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._runner is not None,
+            "batch_size": self.batch_size,
+            "check_base_s": self.check_base,
+            "check_max_s": self.check_max,
+            "stats": dict(self.stats),
+            "banks": {name: stats.snapshot() for name, stats in self._banks.items()},
+        }
+
+
+# Единственный экземпляр на процесс
+payment_status_poller = PaymentStatusPoller()
+
+
+async def main() -> None:
+    """Отдельный процесс проверки статусов: python payment_status_poller.py"""
+    from bank_tokens import bank_token_cache
+    from database import async_engine
+
+    logging.basicConfig(level=logging.INFO)
+    await bank_clients.start()
+    await bank_registry.start()
+    await bank_token_cache.start()
+    await payment_status_poller.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(payment_status_poller.poll_interval, 1))
+            except asyncio.TimeoutError:
+                logger.info(f"Payment status poller: {payment_status_poller.snapshot()}")
+    finally:
+        await payment_status_poller.stop()
+        await bank_token_cache.stop()
+        await bank_registry.stop()
+        await bank_clients.stop()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
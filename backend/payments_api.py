@@ -1,12 +1,20 @@
 # finance-app-master/payments_api.py
+import asyncio
+import base64
 import httpx
+import orjson
 import uuid
-from fastapi import APIRouter, Depends, HTTPException, Path
-from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime
+from decimal import Decimal
+from fastapi import APIRouter, Depends, HTTPException, Path, Query
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, contains_eager
+from typing import List, Optional
 
 import models
-from database import get_db
+from database import AsyncSessionLocal, get_db, get_async_db
 from deps import user_is_admin_or_self
 from schemas import (
     PaymentInitiate,
@@ -14,8 +22,13 @@ from schemas import (
     PaymentStatusResponse,
     PaymentResponse,
     PaymentListResponse,
+    BatchPaymentRequest,
+    BatchPaymentResponse,
 )
-from utils import get_bank_token, log_response
+from utils import get_bank_token, log_response, logger
+from bank_client import bank_clients, BankUnavailableError
+from bank_registry import bank_registry, BankInfo
+from config import PAYMENT_HISTORY_PAGE_SIZE, PAYMENT_HISTORY_MAX_PAGE_SIZE, PAYMENT_BATCH_MAX_SIZE
 
 router = APIRouter(
     prefix="/users/{user_id}/payments",
@@ -23,58 +36,41 @@ router = APIRouter(
 )
 
 
-@router.post(
-    "/",
-    response_model=PaymentStatusResponse,
-    summary="Совершить платеж на внешний счет"
-)
-async def create_payment(
-    user_id: int,
-    payment_data: PaymentInitiate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(user_is_admin_or_self)
-):
-    """
-    Инициирует разовый платеж на внешний счет, используя ранее полученное и
-    авторизованное согласие на платеж. После успеха сохраняет запись в историю.
-    """
-    # 1. Найти счет списания и проверить, что он принадлежит пользователю
-    debtor_account = db.query(models.Account).join(models.ConnectedBank).filter(
-        models.Account.id == payment_data.debtor_account_id,
-        models.ConnectedBank.user_id == user_id
-    ).first()
-    if not debtor_account:
-        raise HTTPException(status_code=404, detail="Debtor account not found or access denied.")
+async def _get_user_account(db: AsyncSession, user_id: int, account_id: int):
+    """Счет пользователя вместе с подключением (bank_name, bank_client_id) — одним запросом."""
+    return await db.scalar(
+        select(models.Account)
+        .join(models.Account.connection)
+        .options(contains_eager(models.Account.connection))
+        .where(models.Account.id == account_id, models.ConnectedBank.user_id == user_id)
+    )
+
+
+def _owner_identification(account: models.Account):
+    """Номер счета и имя владельца из сохраненных owner_data."""
+    if account.owner_data and isinstance(account.owner_data, list):
+        return account.owner_data[0].get("identification"), account.owner_data[0].get("name")
+    return None, None
 
-    # 2. Найти согласие на платеж и проверить его
-    consent = db.query(models.PaymentConsent).filter(
-        models.PaymentConsent.id == payment_data.payment_consent_id,
-        models.PaymentConsent.user_id == user_id
-    ).first()
-    if not consent:
-        raise HTTPException(status_code=404, detail="Payment consent not found.")
-    
-    if consent.status != 'approved':
-        raise HTTPException(status_code=400, detail=f"Consent is not approved. Current status: {consent.status}")
-        
-    if not consent.consent_id:
-        raise HTTPException(status_code=400, detail="API Consent ID is missing for this consent record.")
-    
-    # 3. Проверить, что счет и согласие относятся к одному и тому же банку
-    if debtor_account.bank_name != consent.bank_name:
-        raise HTTPException(status_code=400, detail="Account and consent must belong to the same bank.")
 
-    # 4. Получить конфигурацию банка и токен
-    bank_config = db.query(models.Bank).filter(models.Bank.name == debtor_account.bank_name).first()
+async def send_payment(
+    debtor_account: models.Account,
+    consent: models.PaymentConsent,
+    amount: Decimal,
+    currency: str,
+    creditor_account: dict,
+    comment: str,
+    idempotency_key: str,
+) -> dict:
+    """Отправляет платеж в банк счета списания (без записи в БД). Ошибки банка — HTTPException."""
+    # Получить конфигурацию банка и токен
+    bank_config = await bank_registry.fetch_by_name(debtor_account.bank_name)
     if not bank_config:
         raise HTTPException(status_code=500, detail=f"Bank configuration for {debtor_account.bank_name} not found.")
 
-    bank_access_token = await get_bank_token(bank_config.name, db)
-    
-    # 5. Сформировать тело запроса для API банка
-    debtor_account_number = None
-    if debtor_account.owner_data and isinstance(debtor_account.owner_data, list) and debtor_account.owner_data:
-        debtor_account_number = debtor_account.owner_data[0].get("identification")
+    bank_access_token = await get_bank_token(bank_config.name)
+
+    debtor_account_number, _ = _owner_identification(debtor_account)
     if not debtor_account_number:
         raise HTTPException(status_code=500, detail="Could not determine debtor account number from stored data.")
 
@@ -82,26 +78,20 @@ async def create_payment(
         "data": {
             "initiation": {
                 "instructedAmount": {
-                    "amount": str(payment_data.amount),
-                    "currency": payment_data.currency,
+                    "amount": str(amount),
+                    "currency": currency,
                 },
                 "debtorAccount": {
                     "schemeName": "RU.CBR.PAN",
                     "identification": debtor_account_number,
                 },
-                "creditorAccount": {
-                    "schemeName": "RU.CBR.PAN",
-                    "identification": payment_data.creditor_account,
-                    "bank_code": payment_data.creditor_bank_code,
-                    "name": payment_data.creditor_name,
-                },
-                "comment": payment_data.reference,
+                "creditorAccount": {"schemeName": "RU.CBR.PAN", **creditor_account},
+                "comment": comment,
             }
         }
     }
-    
-    # 6. Сформировать заголовки
-    idempotency_key = str(uuid.uuid4())
+
+    # Сформировать заголовки
     headers = {
         "Authorization": f"Bearer {bank_access_token}",
         "X-Requesting-Bank": bank_config.client_id,
@@ -114,46 +104,184 @@ async def create_payment(
     
     params = {"client_id": debtor_account.connection.bank_client_id}
     
-    # 7. Отправить запрос
+    # Отправить запрос
     payment_url = f"{bank_config.base_url}/payments"
-    bank_response_json = {}
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(payment_url, headers=headers, params=params, json=api_body)
-            log_response(response)
-            response.raise_for_status()
-            bank_response_json = response.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code, detail=f"Bank API error: {e.response.text}")
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail=f"Could not connect to bank API: {e}")
-
-    # 8. Сохранение платежа в БД
-    if bank_response_json:
-        bank_payment_data = bank_response_json.get("data", {})
-        new_payment = models.Payment(
-            user_id=user_id,
-            debtor_account_id=payment_data.debtor_account_id,
-            consent_id=payment_data.payment_consent_id,
-            bank_payment_id=bank_payment_data.get("paymentId"),
-            status=bank_payment_data.get("status", "pending").lower(),
-            amount=payment_data.amount,
-            currency=payment_data.currency,
-            creditor_details={
-                "name": payment_data.creditor_name,
-                "account": payment_data.creditor_account,
-                "bank_code": payment_data.creditor_bank_code,
-            },
-            idempotency_key=idempotency_key,
-            bank_name=debtor_account.bank_name,
-            bank_client_id=debtor_account.connection.bank_client_id,
-        )
+    client = bank_clients.get(bank_config.name)
+    try:
+        response = await client.post(payment_url, headers=headers, params=params, json=api_body)
+        log_response(response)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=f"Bank API error: {e.response.text}")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Could not connect to bank API: {e}")
+
+
+def _payment_record(
+    user_id: int,
+    debtor_account: models.Account,
+    consent: models.PaymentConsent,
+    amount: Decimal,
+    currency: str,
+    creditor_details: dict,
+    idempotency_key: str,
+    bank_response_json: dict,
+) -> Optional[models.Payment]:
+    """Запись истории для отправленного платежа (None, если банк вернул пустой ответ)."""
+    if not bank_response_json:
+        return None
+    bank_payment_data = bank_response_json.get("data", {})
+    return models.Payment(
+        user_id=user_id,
+        debtor_account_id=debtor_account.id,
+        consent_id=consent.id,
+        bank_payment_id=bank_payment_data.get("paymentId"),
+        status=bank_payment_data.get("status", "pending").lower(),
+        amount=amount,
+        currency=currency,
+        creditor_details=creditor_details,
+        idempotency_key=idempotency_key,
+        bank_name=debtor_account.bank_name,
+        bank_client_id=debtor_account.connection.bank_client_id,
+    )
+
+
+def _external_creditor(creditor_name: str, creditor_account: str, creditor_bank_code: str):
+    """(creditorAccount для API банка, creditor_details для истории) внешнего получателя."""
+    return (
+        {"identification": creditor_account, "bank_code": creditor_bank_code, "name": creditor_name},
+        {"name": creditor_name, "account": creditor_account, "bank_code": creditor_bank_code},
+    )
+
+
+def _internal_creditor(debtor_account: models.Account, creditor_account: models.Account):
+    """(creditorAccount для API банка, creditor_details для истории) своего счета зачисления."""
+    creditor_account_number, creditor_name = _owner_identification(creditor_account)
+    if not _owner_identification(debtor_account)[0] or not creditor_account_number or not creditor_name:
+        raise HTTPException(status_code=500, detail="Could not determine account numbers or owner name from stored data.")
+    return (
+        {"identification": creditor_account_number, "bank_code": creditor_account.bank_name, "name": creditor_name},
+        {
+            "internal_account_id": creditor_account.id,
+            "name": creditor_name,
+            "account": creditor_account_number,
+            "bank_code": creditor_account.bank_name,
+        },
+    )
+
+
+async def submit_payment(
+    db: AsyncSession,
+    user_id: int,
+    debtor_account: models.Account,
+    consent: models.PaymentConsent,
+    amount: Decimal,
+    currency: str,
+    creditor_account: dict,
+    comment: str,
+    creditor_details: dict,
+    idempotency_key: Optional[str] = None,
+) -> dict:
+    """
+    Отправляет платеж в банк счета списания и сохраняет его в историю.
+
+    Общая часть эндпоинтов платежей и исполнения автоплатежей
+    (scheduled_payment_worker.py). Счет должен быть загружен вместе
+    с подключением, согласие — проверено вызывающим кодом.
+    `idempotency_key` по умолчанию случайный; повторная отправка с тем же
+    ключом не создает второй платеж ни в банке, ни в нашей БД.
+    """
+    idempotency_key = idempotency_key or str(uuid.uuid4())
+    bank_response_json = await send_payment(
+        debtor_account, consent, amount, currency, creditor_account, comment, idempotency_key
+    )
+
+    # Сохранение платежа в БД
+    new_payment = _payment_record(
+        user_id, debtor_account, consent, amount, currency, creditor_details, idempotency_key, bank_response_json
+    )
+    if new_payment:
         db.add(new_payment)
-        db.commit()
+        await db.commit()
 
     return bank_response_json
 
 
+async def submit_internal_transfer(
+    db: AsyncSession,
+    user_id: int,
+    debtor_account: models.Account,
+    creditor_account: models.Account,
+    consent: models.PaymentConsent,
+    amount: Decimal,
+    currency: str,
+    reference: str,
+    idempotency_key: Optional[str] = None,
+) -> dict:
+    """Перевод между двумя счетами пользователя (см. submit_payment)."""
+    creditor, creditor_details = _internal_creditor(debtor_account, creditor_account)
+    return await submit_payment(
+        db, user_id, debtor_account, consent, amount, currency,
+        creditor_account=creditor,
+        comment=reference,
+        creditor_details=creditor_details,
+        idempotency_key=idempotency_key,
+    )
+
+
+def _check_consent(consent: Optional[models.PaymentConsent], not_found_detail: str) -> None:
+    if not consent:
+        raise HTTPException(status_code=404, detail=not_found_detail)
+    if consent.status != 'approved':
+        raise HTTPException(status_code=400, detail=f"Consent is not approved. Current status: {consent.status}")
+    if not consent.consent_id:
+        raise HTTPException(status_code=400, detail="API Consent ID is missing for this consent record.")
+
+
+@router.post(
+    "/",
+    response_model=PaymentStatusResponse,
+    summary="Совершить платеж на внешний счет"
+)
+async def create_payment(
+    user_id: int,
+    payment_data: PaymentInitiate,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Инициирует разовый платеж на внешний счет, используя ранее полученное и
+    авторизованное согласие на платеж. После успеха сохраняет запись в историю.
+    """
+    # 1. Найти счет списания и проверить, что он принадлежит пользователю
+    debtor_account = await _get_user_account(db, user_id, payment_data.debtor_account_id)
+    if not debtor_account:
+        raise HTTPException(status_code=404, detail="Debtor account not found or access denied.")
+
+    # 2. Найти согласие на платеж и проверить его
+    consent = await db.scalar(select(models.PaymentConsent).where(
+        models.PaymentConsent.id == payment_data.payment_consent_id,
+        models.PaymentConsent.user_id == user_id
+    ))
+    _check_consent(consent, "Payment consent not found.")
+    
+    # 3. Проверить, что счет и согласие относятся к одному и тому же банку
+    if debtor_account.bank_name != consent.bank_name:
+        raise HTTPException(status_code=400, detail="Account and consent must belong to the same bank.")
+
+    # 4. Отправить платеж и сохранить его в историю
+    creditor, creditor_details = _external_creditor(
+        payment_data.creditor_name, payment_data.creditor_account, payment_data.creditor_bank_code
+    )
+    return await submit_payment(
+        db, user_id, debtor_account, consent, payment_data.amount, payment_data.currency,
+        creditor_account=creditor,
+        comment=payment_data.reference,
+        creditor_details=creditor_details,
+    )
+
+
 @router.post(
     "/internal-transfer",
     response_model=PaymentStatusResponse,
@@ -162,7 +290,7 @@ async def create_payment(
 async def create_internal_transfer(
     user_id: int,
     transfer_data: InternalTransferInitiate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
     """
@@ -170,122 +298,209 @@ async def create_internal_transfer(
     После успеха сохраняет запись в историю.
     """
     # 1. Найти счета
-    debtor_account = db.query(models.Account).join(models.ConnectedBank).filter(
-        models.Account.id == transfer_data.debtor_account_id,
-        models.ConnectedBank.user_id == user_id
-    ).first()
-    creditor_account = db.query(models.Account).join(models.ConnectedBank).filter(
-        models.Account.id == transfer_data.creditor_account_id,
-        models.ConnectedBank.user_id == user_id
-    ).first()
+    debtor_account = await _get_user_account(db, user_id, transfer_data.debtor_account_id)
+    creditor_account = await _get_user_account(db, user_id, transfer_data.creditor_account_id)
 
     if not debtor_account or not creditor_account:
         raise HTTPException(status_code=404, detail="One or both accounts not found or access denied.")
     
     # 2. Найти согласие
-    consent = db.query(models.PaymentConsent).filter(
+    consent = await db.scalar(select(models.PaymentConsent).where(
         models.PaymentConsent.id == transfer_data.payment_consent_id,
         models.PaymentConsent.user_id == user_id,
         models.PaymentConsent.bank_name == debtor_account.bank_name
-    ).first()
-    if not consent:
-        raise HTTPException(status_code=404, detail="Payment consent for the debtor bank not found.")
-    if consent.status != 'approved':
-        raise HTTPException(status_code=400, detail=f"Consent is not approved. Current status: {consent.status}")
-    if not consent.consent_id:
-        raise HTTPException(status_code=400, detail="API Consent ID is missing for this consent record.")
+    ))
+    _check_consent(consent, "Payment consent for the debtor bank not found.")
 
-    # 3. Получить конфигурацию банка-отправителя
-    bank_config = db.query(models.Bank).filter(models.Bank.name == debtor_account.bank_name).first()
-    if not bank_config:
-        raise HTTPException(status_code=500, detail=f"Bank configuration for {debtor_account.bank_name} not found.")
+    # 3. Отправить перевод и сохранить его в историю
+    return await submit_internal_transfer(
+        db, user_id, debtor_account, creditor_account, consent,
+        transfer_data.amount, transfer_data.currency, transfer_data.reference,
+    )
 
-    bank_access_token = await get_bank_token(bank_config.name, db)
-    
-    # 4. Собрать данные для API
-    debtor_account_number = None
-    if debtor_account.owner_data and isinstance(debtor_account.owner_data, list) and debtor_account.owner_data:
-        debtor_account_number = debtor_account.owner_data[0].get("identification")
-    creditor_account_number = None
-    creditor_name = None
-    if creditor_account.owner_data and isinstance(creditor_account.owner_data, list) and creditor_account.owner_data:
-        creditor_account_number = creditor_account.owner_data[0].get("identification")
-        creditor_name = creditor_account.owner_data[0].get("name")
-    if not debtor_account_number or not creditor_account_number or not creditor_name:
-        raise HTTPException(status_code=500, detail="Could not determine account numbers or owner name from stored data.")
 
-    api_body = {
-        "data": {
-            "initiation": {
-                "instructedAmount": {
-                    "amount": str(transfer_data.amount),
-                    "currency": transfer_data.currency,
-                },
-                "debtorAccount": { "schemeName": "RU.CBR.PAN", "identification": debtor_account_number },
-                "creditorAccount": {
-                    "schemeName": "RU.CBR.PAN",
-                    "identification": creditor_account_number,
-                    "bank_code": creditor_account.bank_name,
-                    "name": creditor_name,
-                },
-                "comment": transfer_data.reference,
-            }
-        }
-    }
+async def _save_batch_payments(db: AsyncSession, accepted: list) -> None:
+    """
+    Сохраняет записи истории пачки одним коммитом, а если он не удался —
+    по одной, чтобы ошибка одной записи не теряла остальные.
+    accepted — пары (платеж, результат позиции).
+    """
+    db.add_all([payment for payment, _ in accepted])
+    try:
+        await db.commit()
+        return
+    except SQLAlchemyError as e:
+        await db.rollback()
+        logger.warning(f"Saving batch payments in one commit failed, saving one by one: {e}")
+    for payment, result in accepted:
+        db.add(payment)
+        try:
+            await db.commit()
+        except SQLAlchemyError as e:
+            await db.rollback()
+            logger.error(f"Batch payment {payment.idempotency_key} was submitted but not recorded: {e}")
+            result["payment"] = None
+            result["error"] = f"Payment was submitted but could not be recorded: {e}"
 
-    # 5. Сформировать заголовки
-    idempotency_key = str(uuid.uuid4())
-    headers = {
-        "Authorization": f"Bearer {bank_access_token}",
-        "X-Requesting-Bank": bank_config.client_id,
-        "x-payment-consent-id": consent.consent_id,
-        "X-Idempotency-Key": idempotency_key,
-        "X-Fapi-Interaction-Id": idempotency_key,
-        "Content-Type": "application/json",
-        "Accept": "application/json"
+
+@router.post(
+    "/batch",
+    response_model=BatchPaymentResponse,
+    summary="Пакетная отправка платежей"
+)
+async def create_payment_batch(
+    user_id: int,
+    batch: BatchPaymentRequest,
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Отправляет пачку платежей (внешних и переводов между своими счетами).
+
+    Счета, согласия и ранее отправленные платежи всей пачки загружаются
+    тремя запросами, платежи уходят в банки параллельно под общим лимитом
+    на банк, а записи истории принятых банком платежей сохраняются одним
+    коммитом (если он не удался — по одной), в том числе когда другие
+    позиции не удались или запрос прервался. Результат — по каждой
+    позиции: ошибка одной позиции не отменяет остальные.
+    Позиция с idempotency_key, который уже был отправлен, повторно не
+    отправляется и возвращается со статусом duplicate.
+    """
+    items = batch.payments
+    if len(items) > PAYMENT_BATCH_MAX_SIZE:
+        raise HTTPException(status_code=400, detail=f"Batch is limited to {PAYMENT_BATCH_MAX_SIZE} payments.")
+    keys = [item.idempotency_key or str(uuid.uuid4()) for item in items]
+
+    # 1. Все нужные счета, согласия и уже отправленные платежи — по одному запросу
+    account_ids = {item.debtor_account_id for item in items} | {
+        item.creditor_account_id for item in items if item.creditor_account_id is not None
+    }
+    accounts = {
+        account.id: account
+        for account in await db.scalars(
+            select(models.Account)
+            .join(models.Account.connection)
+            .options(contains_eager(models.Account.connection))
+            .where(models.Account.id.in_(account_ids), models.ConnectedBank.user_id == user_id)
+        )
+    }
+    consents = {
+        consent.id: consent
+        for consent in await db.scalars(select(models.PaymentConsent).where(
+            models.PaymentConsent.id.in_({item.payment_consent_id for item in items}),
+            models.PaymentConsent.user_id == user_id,
+        ))
+    }
+    existing = {
+        payment.idempotency_key: payment
+        for payment in await db.scalars(select(models.Payment).where(models.Payment.idempotency_key.in_(keys)))
     }
-    
-    params = {"client_id": debtor_account.connection.bank_client_id}
 
-    # 6. Отправить запрос
-    payment_url = f"{bank_config.base_url}/payments"
-    bank_response_json = {}
-    async with httpx.AsyncClient() as client:
+    results = [{"index": index, "idempotency_key": key} for index, key in enumerate(keys)]
+
+    def fail(result: dict, e: HTTPException) -> None:
+        result.update(status="failed", error_code=e.status_code, error=str(e.detail))
+
+    # 2. Проверка позиций (без обращений к БД)
+    prepared = []
+    for item, result in zip(items, results):
+        key = result["idempotency_key"]
         try:
-            response = await client.post(payment_url, headers=headers, params=params, json=api_body)
-            log_response(response)
-            response.raise_for_status()
-            bank_response_json = response.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code, detail=f"Bank API error: {e.response.text}")
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail=f"Could not connect to bank API: {e}")
-            
-    # 7. Сохранить платеж в БД
-    if bank_response_json:
-        bank_payment_data = bank_response_json.get("data", {})
-        new_payment = models.Payment(
-            user_id=user_id,
-            debtor_account_id=transfer_data.debtor_account_id,
-            consent_id=transfer_data.payment_consent_id,
-            bank_payment_id=bank_payment_data.get("paymentId"),
-            status=bank_payment_data.get("status", "pending").lower(),
-            amount=transfer_data.amount,
-            currency=transfer_data.currency,
-            creditor_details={
-                "internal_account_id": transfer_data.creditor_account_id,
-                "name": creditor_name,
-                "account": creditor_account_number,
-                "bank_code": creditor_account.bank_name,
-            },
-            idempotency_key=idempotency_key,
-            bank_name=debtor_account.bank_name,
-            bank_client_id=debtor_account.connection.bank_client_id,
-        )
-        db.add(new_payment)
-        db.commit()
+            if key in existing:
+                if existing[key].user_id != user_id:
+                    raise HTTPException(status_code=409, detail="Idempotency key is already used.")
+                result.update(status="duplicate", payment=existing[key])
+                continue
+            debtor_account = accounts.get(item.debtor_account_id)
+            if not debtor_account:
+                raise HTTPException(status_code=404, detail="Debtor account not found or access denied.")
+            consent = consents.get(item.payment_consent_id)
+            _check_consent(consent, "Payment consent not found.")
+            if debtor_account.bank_name != consent.bank_name:
+                raise HTTPException(status_code=400, detail="Account and consent must belong to the same bank.")
+            if item.creditor_account_id is not None:
+                creditor_account = accounts.get(item.creditor_account_id)
+                if not creditor_account:
+                    raise HTTPException(status_code=404, detail="Creditor account not found or access denied.")
+                creditor, creditor_details = _internal_creditor(debtor_account, creditor_account)
+                comment = item.reference or "Перевод между своими счетами"
+            else:
+                creditor, creditor_details = _external_creditor(
+                    item.creditor_name, item.creditor_account, item.creditor_bank_code
+                )
+                comment = item.reference or ""
+        except HTTPException as e:
+            fail(result, e)
+            continue
+        prepared.append((item, result, debtor_account, consent, creditor, creditor_details, comment))
+
+    # 3. Отправка в банки параллельно, не больше bank_clients.semaphore запросов на банк.
+    # Ошибка позиции остается в ее результате и не прерывает остальные
+    async def send(item, result, debtor_account, consent, creditor, creditor_details, comment):
+        try:
+            async with bank_clients.semaphore(debtor_account.bank_name):
+                bank_response_json = await send_payment(
+                    debtor_account, consent, item.amount, item.currency, creditor, comment, result["idempotency_key"]
+                )
+        except HTTPException as e:
+            fail(result, e)
+            return None
+        except BankUnavailableError as e:
+            # Банк временно недоступен (выключатель или ограничитель частоты): отклоняется только эта позиция
+            result.update(status="failed", error_code=503, error=str(e), retry_after=e.retry_after)
+            return None
+        except Exception as e:
+            logger.error(f"Batch payment {result['idempotency_key']} failed: {e}")
+            fail(result, HTTPException(status_code=502, detail=f"Could not submit payment: {e}"))
+            return None
+        result["status"] = "submitted"
+        try:
+            payment = _payment_record(
+                user_id, debtor_account, consent, item.amount, item.currency, creditor_details,
+                result["idempotency_key"], bank_response_json,
+            )
+        except Exception as e:
+            # Банк платеж принял — это не ошибка отправки, повторять его нельзя
+            logger.error(f"Batch payment {result['idempotency_key']} was submitted but not recorded: {e}")
+            result["error"] = f"Payment was submitted but could not be recorded: {e}"
+            return None
+        result["payment"] = payment
+        return payment
+
+    async def submit_and_save() -> None:
+        outcomes = await asyncio.gather(*(send(*args) for args in prepared), return_exceptions=True)
+        accepted = []
+        for args, outcome in zip(prepared, outcomes):
+            if isinstance(outcome, BaseException):
+                # Например, отмена задачи: был ли запрос в банк, неизвестно
+                fail(args[1], HTTPException(status_code=500, detail=f"Payment submission was interrupted: {outcome!r}"))
+            elif outcome is not None:
+                accepted.append((outcome, args[1]))
+        # 4. Записи истории принятых банком платежей — в своей сессии
+        if accepted:
+            async with AsyncSessionLocal() as save_db:
+                await _save_batch_payments(save_db, accepted)
+
+    # Отмена запроса (разрыв соединения) не должна терять уже принятые банком платежи
+    await asyncio.shield(asyncio.ensure_future(submit_and_save()))
+
+    submitted = sum(result["status"] == "submitted" for result in results)
+    failed = sum(result["status"] == "failed" for result in results)
+    return {"count": len(results), "submitted": submitted, "failed": failed, "results": results}
 
-    return bank_response_json
+
+def _encode_history_cursor(payment: models.Payment) -> str:
+    # Курсор — позиция последнего платежа страницы в порядке (created_at DESC, id DESC)
+    raw = orjson.dumps([payment.created_at.isoformat(), payment.id])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_history_cursor(cursor: str):
+    try:
+        created_at, payment_id = orjson.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        return datetime.fromisoformat(created_at), int(payment_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor.")
 
 
 @router.get(
@@ -295,14 +510,64 @@ async def create_internal_transfer(
 )
 def get_payment_history(
     user_id: int,
+    limit: int = Query(PAYMENT_HISTORY_PAGE_SIZE, ge=1, le=PAYMENT_HISTORY_MAX_PAGE_SIZE, description="Размер страницы"),
+    cursor: Optional[str] = Query(None, description="next_cursor из предыдущей страницы"),
+    status: Optional[List[str]] = Query(None, description="Фильтр по статусу (можно несколько)"),
+    bank_name: Optional[str] = Query(None, description="Фильтр по банку списания"),
+    created_from: Optional[datetime] = Query(None, description="Создан не раньше (ISO 8601)"),
+    created_to: Optional[datetime] = Query(None, description="Создан раньше (ISO 8601)"),
+    amount_min: Optional[Decimal] = Query(None, description="Сумма не меньше"),
+    amount_max: Optional[Decimal] = Query(None, description="Сумма не больше"),
+    include_totals: bool = Query(False, description="Добавить итоги по всем подходящим платежам"),
     db: Session = Depends(get_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
     """
-    Возвращает список всех платежей, инициированных пользователем через API.
+    Возвращает платежи, инициированные пользователем через API, от новых к старым,
+    страницами по `limit`. Следующая страница запрашивается с `cursor=next_cursor`
+    и теми же фильтрами; ее стоимость не зависит от длины истории
+    (индекс ix_payments_user_created).
     """
-    payments = db.query(models.Payment).filter(models.Payment.user_id == user_id).order_by(models.Payment.created_at.desc()).all()
-    return {"count": len(payments), "payments": payments}
+    filters = [models.Payment.user_id == user_id]
+    if status:
+        filters.append(models.Payment.status.in_(status))
+    if bank_name:
+        filters.append(models.Payment.bank_name == bank_name)
+    if created_from:
+        filters.append(models.Payment.created_at >= created_from)
+    if created_to:
+        filters.append(models.Payment.created_at < created_to)
+    if amount_min is not None:
+        filters.append(models.Payment.amount >= amount_min)
+    if amount_max is not None:
+        filters.append(models.Payment.amount <= amount_max)
+
+    query = select(models.Payment).where(*filters)
+    if cursor:
+        query = query.where(tuple_(models.Payment.created_at, models.Payment.id) < tuple_(*_decode_history_cursor(cursor)))
+    # Лишняя строка показывает, есть ли следующая страница
+    payments = db.scalars(
+        query.order_by(models.Payment.created_at.desc(), models.Payment.id.desc()).limit(limit + 1)
+    ).all()
+
+    next_cursor = None
+    if len(payments) > limit:
+        payments = payments[:limit]
+        next_cursor = _encode_history_cursor(payments[-1])
+
+    totals = None
+    if include_totals:
+        totals = [
+            {"currency": currency, "count": count, "total_amount": total}
+            for currency, count, total in db.execute(
+                select(models.Payment.currency, func.count(), func.sum(models.Payment.amount))
+                .where(*filters)
+                .group_by(models.Payment.currency)
+                .order_by(models.Payment.currency)
+            )
+        ]
+
+    return {"count": len(payments), "payments": payments, "next_cursor": next_cursor, "totals": totals}
 
 
 @router.post(
@@ -313,16 +578,16 @@ def get_payment_history(
 async def refresh_payment_status(
     user_id: int,
     payment_db_id: int = Path(..., description="ID платежа в НАШЕЙ базе данных"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
     """
     Запрашивает у банка актуальный статус платежа и обновляет его в нашей БД.
     """
-    payment = db.query(models.Payment).filter(
+    payment = await db.scalar(select(models.Payment).where(
         models.Payment.id == payment_db_id,
         models.Payment.user_id == user_id
-    ).first()
+    ))
     if not payment:
         raise HTTPException(status_code=404, detail="Payment not found.")
 
@@ -348,8 +613,8 @@ async def refresh_payment_status(
     new_status = updated_status_data.data.status.lower()
     if payment.status != new_status:
         payment.status = new_status
-        db.commit()
-        db.refresh(payment)
+        await db.commit()
+        await db.refresh(payment)
     # --- ^^^ КОНЕЦ ИЗМЕНЕНИЯ ^^^ ---
         
     return payment
@@ -365,26 +630,31 @@ async def get_payment_status(
     bank_name: str = Path(..., description="Символьное имя банка (vbank, abank, etc.)"),
     bank_client_id: str = Path(..., description="ID клиента в банке"),
     payment_id: str = Path(..., description="ID платежа, полученный от банка"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
     """
     Получает актуальный статус ранее созданного платежа из API банка.
     """
-    connection = db.query(models.ConnectedBank).filter(
+    connection = await db.scalar(select(models.ConnectedBank).where(
         models.ConnectedBank.user_id == user_id,
         models.ConnectedBank.bank_name == bank_name,
         models.ConnectedBank.bank_client_id == bank_client_id,
         models.ConnectedBank.status == "active"
-    ).first()
+    ).limit(1))
     if not connection:
         raise HTTPException(status_code=403, detail="Active connection for this bank and client ID not found.")
 
-    bank_config = db.query(models.Bank).filter(models.Bank.name == bank_name).first()
+    bank_config = await bank_registry.fetch_by_name(bank_name)
     if not bank_config:
         raise HTTPException(status_code=500, detail=f"Bank configuration for {bank_name} not found.")
-    
-    bank_access_token = await get_bank_token(bank_config.name, db)
+
+    return await fetch_payment_status(bank_config, bank_client_id, payment_id)
+
+
+async def fetch_payment_status(bank_config: BankInfo, bank_client_id: str, payment_id: str) -> dict:
+    """Запрос статуса платежа в API банка (без проверок доступа). Ошибки банка — HTTPException."""
+    bank_access_token = await get_bank_token(bank_config.name)
 
     status_url = f"{bank_config.base_url}/payments/{payment_id}"
     headers = {
@@ -393,13 +663,13 @@ async def get_payment_status(
     }
     params = { "client_id": bank_client_id }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(status_url, headers=headers, params=params)
-            log_response(response)
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            raise HTTPException(status_code=e.response.status_code, detail=f"Bank API error: {e.response.text}")
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail=f"Could not connect to bank API: {e}")
\ No newline at end of file
+    client = bank_clients.get(bank_config.name)
+    try:
+        response = await client.get(status_url, headers=headers, params=params)
+        log_response(response)
+        response.raise_for_status()
+        return response.json()
+    except httpx.HTTPStatusError as e:
+        raise HTTPException(status_code=e.response.status_code, detail=f"Bank API error: {e.response.text}")
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail=f"Could not connect to bank API: {e}")
\ No newline at end of file
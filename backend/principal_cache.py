@@ -0,0 +1,90 @@
+# finance-app-master/principal_cache.py
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from config import PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_MAX_SIZE
+from security import ACCESS_TOKEN_EXPIRE_MINUTES
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Аутентифицированный пользователь: неизменяемая копия нужных полей User."""
+    id: int
+    email: str
+    is_admin: bool
+
+
+class PrincipalCache:
+    """
+    Кэш пользователей по subject (email) токена: TTL + LRU с ограниченным размером.
+
+    Дополнительно хранит карту отзыва: после изменения или удаления
+    пользователя (email, права администратора) все токены, выпущенные
+    до этого момента, перестают приниматься — в том числе те, по которым
+    права проверяются только по claims, без обращения к БД.
+    В другие процессы отзыв доходит через principal_revocations.py
+    (таблица token_revocations + LISTEN/NOTIFY).
+    """
+
+    def __init__(self, ttl: float = PRINCIPAL_CACHE_TTL, max_size: int = PRINCIPAL_CACHE_MAX_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        # subject -> (principal, время истечения записи)
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # user_id -> момент отзыва (time.time())
+        self._revoked_at: Dict[int, float] = {}
+        # Кэш читают и sync-эндпоинты из пула потоков
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, subject: str) -> Optional[Principal]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(subject)
+            if entry is None or entry[1] <= now:
+                if entry is not None:
+                    del self._entries[subject]
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(subject)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def put(self, subject: str, principal: Principal) -> None:
+        with self._lock:
+            self._entries[subject] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(subject)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate_user(self, user_id: int, revoked_at: Optional[float] = None) -> None:
+        """
+        Сбрасывает кэш пользователя и отзывает его токены, выпущенные
+        до revoked_at (по умолчанию — до текущего момента).
+        """
+        now = time.time()
+        revoked_at = now if revoked_at is None else revoked_at
+        with self._lock:
+            for subject in [s for s, (principal, _) in self._entries.items() if principal.id == user_id]:
+                del self._entries[subject]
+            self._revoked_at[user_id] = max(self._revoked_at.get(user_id, 0.0), revoked_at)
+            # Токены старше срока жизни и так не примутся — такие отметки не нужны
+            horizon = now - ACCESS_TOKEN_EXPIRE_MINUTES * 60
+            for uid in [uid for uid, revoked in self._revoked_at.items() if revoked < horizon]:
+                del self._revoked_at[uid]
+            self.stats["invalidations"] += 1
+
+    def is_revoked(self, user_id: int, issued_at: Optional[float]) -> bool:
+        revoked_at = self._revoked_at.get(user_id)
+        return revoked_at is not None and (issued_at or 0) < revoked_at
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {"size": len(self._entries), "revoked_users": len(self._revoked_at), "stats": dict(self.stats)}
+
+
+# Единственный экземпляр на процесс
+principal_cache = PrincipalCache()
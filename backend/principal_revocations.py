@@ -0,0 +1,143 @@
+# finance-app-master/principal_revocations.py
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+import asyncpg
+import orjson
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+import models
+from database import ASYNC_DATABASE_URL
+from principal_cache import principal_cache
+from security import ACCESS_TOKEN_EXPIRE_MINUTES
+from config import PRINCIPAL_REVOCATIONS_RECONNECT_DELAY
+
+logger = logging.getLogger("uvicorn")
+
+# Канал PostgreSQL LISTEN/NOTIFY для отзыва токенов пользователей
+CHANNEL = "principal_revocations"
+
+
+def revoke_user_tokens(db: Session, user_id: int) -> float:
+    """
+    Отзывает все выпущенные до этого момента токены пользователя во всех
+    процессах API: сохраняет момент отзыва в token_revocations и
+    публикует его через pg_notify. Вызывается до commit в той же
+    транзакции, что и изменение (или удаление) пользователя: при откате
+    отзыва не будет. Возвращает момент отзыва (time.time()) — после
+    коммита его можно сразу применить в своем процессе:
+    principal_cache.invalidate_user(user_id, revoked_at).
+    """
+    revoked_at = time.time()
+    stmt = insert(models.TokenRevocation).values(
+        user_id=user_id, revoked_at=datetime.fromtimestamp(revoked_at, timezone.utc)
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[models.TokenRevocation.user_id],
+        set_={"revoked_at": stmt.excluded.revoked_at},
+    ))
+    # Отзывы старше срока жизни токена больше ни на что не влияют
+    db.execute(delete(models.TokenRevocation).where(
+        models.TokenRevocation.revoked_at < func.now() - func.make_interval(0, 0, 0, 0, 0, ACCESS_TOKEN_EXPIRE_MINUTES)
+    ))
+    payload = orjson.dumps({"user_id": user_id, "revoked_at": revoked_at}).decode()
+    db.execute(select(func.pg_notify(CHANNEL, payload)))
+    return revoked_at
+
+
+class PrincipalRevocationListener:
+    """
+    Применяет отзывы токенов из других процессов к principal_cache.
+
+    Выделенное соединение asyncpg слушает канал principal_revocations
+    (LISTEN). После каждого (пере)подключения перечитывается таблица
+    token_revocations за срок жизни токена, поэтому отзывы, сделанные,
+    пока соединения не было, тоже применяются.
+    """
+
+    def __init__(self, reconnect_delay: float = PRINCIPAL_REVOCATIONS_RECONNECT_DELAY):
+        self.reconnect_delay = reconnect_delay
+        self._listener: Optional[asyncio.Task] = None
+        self._connected = False
+        self._loaded = asyncio.Event()
+        self.stats = {"received": 0, "loaded": 0, "reconnects": 0}
+
+    def _dispatch(self, connection, pid, channel, payload: str) -> None:
+        self.stats["received"] += 1
+        try:
+            event = orjson.loads(payload)
+            principal_cache.invalidate_user(int(event["user_id"]), float(event["revoked_at"]))
+        except (orjson.JSONDecodeError, KeyError, TypeError, ValueError):
+            logger.warning(f"Malformed principal revocation: {payload}")
+
+    async def _load(self, connection) -> None:
+        rows = await connection.fetch(
+            "SELECT user_id, extract(epoch FROM revoked_at) AS revoked_at FROM token_revocations "
+            "WHERE revoked_at > now() - make_interval(mins => $1)",
+            ACCESS_TOKEN_EXPIRE_MINUTES,
+        )
+        for row in rows:
+            principal_cache.invalidate_user(row["user_id"], float(row["revoked_at"]))
+        self.stats["loaded"] += len(rows)
+
+    async def _listen_loop(self) -> None:
+        dsn = make_url(ASYNC_DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                closed = asyncio.Event()
+                connection.add_termination_listener(lambda _: closed.set())
+                # Сначала подписка, затем чтение таблицы: отзыв между ними не теряется
+                await connection.add_listener(CHANNEL, self._dispatch)
+                await self._load(connection)
+                self._connected = True
+                self._loaded.set()
+                logger.info(f"Listening for principal revocations on channel '{CHANNEL}'")
+                await closed.wait()
+                logger.warning("Principal revocations connection lost")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Principal revocations listener failed: {e}")
+            finally:
+                self._connected = False
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            self.stats["reconnects"] += 1
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def start(self) -> None:
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen_loop())
+            # Не принимать запросы, пока не прочитаны уже сделанные отзывы (но и не зависать без БД)
+            try:
+                await asyncio.wait_for(self._loaded.wait(), timeout=self.reconnect_delay)
+            except asyncio.TimeoutError:
+                logger.warning("Principal revocations are not loaded yet, continuing startup")
+
+    async def stop(self) -> None:
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+
+    @property
+    def listening(self) -> bool:
+        return self._connected
+
+    def snapshot(self) -> dict:
+        return {"listening": self._connected, "stats": dict(self.stats)}
+
+
+# Единственный экземпляр на процесс
+principal_revocations = PrincipalRevocationListener()
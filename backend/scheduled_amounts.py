@@ -0,0 +1,153 @@
+# finance-app-master/scheduled_amounts.py
+from collections import defaultdict
+from dataclasses import dataclass
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+
+import models
+from bank_registry import bank_registry
+from transaction_store import sync_account_transactions, get_daily_turnover
+from utils import logger
+
+ZERO = Decimal("0")
+
+
+@dataclass
+class ScheduledAmount:
+    amount: Optional[Decimal]
+    currency: Optional[str]
+    error: Optional[str] = None
+
+
+def amount_from_turnover(schedule: models.ScheduledPayment, total_credit: Decimal, total_debit: Decimal) -> Decimal:
+    """Сумма по оборотам за период — так же, как в предпросмотре клиента."""
+    if schedule.amount_type == models.ScheduledPaymentAmountType.TOTAL_DEBIT:
+        amount = total_debit
+    elif schedule.amount_type == models.ScheduledPaymentAmountType.NET_DEBIT:
+        amount = total_debit - total_credit
+    else:
+        if schedule.minimum_payment_percentage is None:
+            raise ValueError("Minimum payment percentage is not set.")
+        amount = (total_debit - total_credit) * schedule.minimum_payment_percentage / 100
+    return max(amount, ZERO).quantize(Decimal("0.01"))
+
+
+def merge_windows(periods: Iterable[Tuple[date, date]]) -> List[Tuple[date, date]]:
+    """Объединяет пересекающиеся и соседние периоды [начало, конец]."""
+    windows: List[Tuple[date, date]] = []
+    for start, end in sorted(periods):
+        if windows and start <= windows[-1][1] + timedelta(days=1):
+            windows[-1] = (windows[-1][0], max(windows[-1][1], end))
+        else:
+            windows.append((start, end))
+    return windows
+
+
+class WindowTurnover:
+    """Дневные обороты счета за окно с префиксными суммами: итог любого подпериода за O(1)."""
+
+    def __init__(self, first_day: date, last_day: date, daily: Dict[date, Tuple[Decimal, Decimal]]):
+        self.first_day = first_day
+        self._credit = [ZERO]
+        self._debit = [ZERO]
+        day = first_day
+        while day <= last_day:
+            credit, debit = daily.get(day, (ZERO, ZERO))
+            self._credit.append(self._credit[-1] + credit)
+            self._debit.append(self._debit[-1] + debit)
+            day += timedelta(days=1)
+
+    def contains(self, start: date, end: date) -> bool:
+        return self.first_day <= start and (end - self.first_day).days < len(self._credit) - 1
+
+    def totals(self, start: date, end: date) -> Tuple[Decimal, Decimal]:
+        lo, hi = (start - self.first_day).days, (end - self.first_day).days + 1
+        return self._credit[hi] - self._credit[lo], self._debit[hi] - self._debit[lo]
+
+
+async def compute_amounts(
+    db: AsyncSession,
+    schedules: Sequence[models.ScheduledPayment],
+    sync: bool = True,
+) -> Dict[int, ScheduledAmount]:
+    """
+    Суммы для пачки автоплатежей.
+
+    Автоплатежи TOTAL_DEBIT / NET_DEBIT / MINIMUM_PAYMENT группируются по
+    счету, чьи обороты они используют (счет-получатель, например кредитная
+    карта). Каждый такой счет синхронизируется с банком один раз, а его
+    дневные обороты читаются один раз на окно — объединение пересекающихся
+    периодов всех автоплатежей счета. Если синхронизация не удалась, суммы
+    автоплатежей этого счета возвращаются с ошибкой, а не по устаревшим данным.
+    Период — дни [period_start_date, period_end_date] по UTC, как в
+    эндпоинте оборотов.
+    """
+    results: Dict[int, ScheduledAmount] = {}
+    by_account: Dict[int, List[models.ScheduledPayment]] = defaultdict(list)
+    for schedule in schedules:
+        if schedule.amount_type == models.ScheduledPaymentAmountType.FIXED:
+            results[schedule.id] = ScheduledAmount(schedule.fixed_amount, schedule.currency)
+        elif not schedule.period_start_date or not schedule.period_end_date:
+            results[schedule.id] = ScheduledAmount(None, schedule.currency, "Calculation period is not set.")
+        else:
+            by_account[schedule.creditor_account_id].append(schedule)
+    if not by_account:
+        return results
+
+    accounts = {
+        account.id: account
+        for account in await db.scalars(
+            select(models.Account)
+            .join(models.Account.connection)
+            .options(contains_eager(models.Account.connection))
+            .where(models.Account.id.in_(by_account))
+        )
+    }
+
+    for account_id, account_schedules in by_account.items():
+        account = accounts.get(account_id)
+        error = None
+        if account is None:
+            error = "Creditor account not found."
+        elif sync:
+            connection = account.connection
+            bank = await bank_registry.fetch_by_name(connection.bank_name)
+            if bank and connection.status == "active" and connection.consent_id:
+                try:
+                    await sync_account_transactions(db, account, connection, bank)
+                except HTTPException as e:
+                    error = f"Transactions sync failed: {e.detail}"
+                except Exception as e:
+                    logger.error(f"Transactions sync for account {account_id} failed: {e}")
+                    error = f"Transactions sync failed: {e}"
+        if error:
+            for schedule in account_schedules:
+                results[schedule.id] = ScheduledAmount(None, schedule.currency, error)
+            continue
+
+        windows = [
+            WindowTurnover(first_day, last_day, await get_daily_turnover(db, account_id, first_day, last_day))
+            for first_day, last_day in merge_windows(
+                (schedule.period_start_date, schedule.period_end_date) for schedule in account_schedules
+            )
+        ]
+        for schedule in account_schedules:
+            # Ошибка одного автоплатежа (например, некорректные параметры) не должна мешать остальным
+            try:
+                start, end = schedule.period_start_date, schedule.period_end_date
+                window = next(window for window in windows if window.contains(start, end))
+                total_credit, total_debit = window.totals(start, end)
+                results[schedule.id] = ScheduledAmount(
+                    amount_from_turnover(schedule, total_credit, total_debit),
+                    schedule.currency or account.currency,
+                )
+            except Exception as e:
+                logger.error(f"Amount calculation for scheduled payment {schedule.id} failed: {e}")
+                results[schedule.id] = ScheduledAmount(None, schedule.currency or account.currency, f"Amount calculation failed: {e}")
+    return results
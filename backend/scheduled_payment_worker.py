@@ -0,0 +1,383 @@
+# finance-app-master/scheduled_payment_worker.py
+import asyncio
+import calendar
+import logging
+import signal
+import time
+from collections import defaultdict, deque
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from fastapi import HTTPException
+from sqlalchemy import or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+
+import models
+from database import AsyncSessionLocal
+from bank_registry import bank_registry
+from payments_api import submit_internal_transfer
+from scheduled_amounts import ScheduledAmount, compute_amounts
+from config import (
+    SCHEDULED_PAYMENTS_POLL_INTERVAL,
+    SCHEDULED_PAYMENTS_BATCH_SIZE,
+    SCHEDULED_PAYMENTS_CONCURRENCY,
+    SCHEDULED_PAYMENTS_RETRY_BASE,
+    SCHEDULED_PAYMENTS_RETRY_MAX,
+    SCHEDULED_PAYMENTS_CLAIM_LEASE,
+)
+
+logger = logging.getLogger("uvicorn")
+
+# Окно, за которое считается пропускная способность
+THROUGHPUT_WINDOW = 300
+
+
+# --- Расписание ---
+def _add_months(day: date, months: int) -> date:
+    month_index = day.month - 1 + months
+    year, month = day.year + month_index // 12, month_index % 12 + 1
+    # 31 января + 1 месяц = последний день февраля
+    return date(year, month, min(day.day, calendar.monthrange(year, month)[1]))
+
+
+def add_recurrence(day: date, recurrence_type: models.RecurrenceType, interval: int) -> date:
+    if recurrence_type == models.RecurrenceType.DAYS:
+        return day + timedelta(days=interval)
+    if recurrence_type == models.RecurrenceType.WEEKS:
+        return day + timedelta(weeks=interval)
+    if recurrence_type == models.RecurrenceType.MONTHS:
+        return _add_months(day, interval)
+    return _add_months(day, 12 * interval)
+
+
+def advance_schedule(schedule: models.ScheduledPayment, today: date) -> None:
+    """
+    Переносит автоплатеж на следующую дату после сегодняшней (вместе с
+    периодом расчета суммы). Пропущенные за время простоя даты не
+    исполняются задним числом. Разовый автоплатеж деактивируется.
+    """
+    if schedule.recurrence_type is None or not schedule.recurrence_interval:
+        schedule.is_active = False
+        return
+    while schedule.next_payment_date <= today:
+        step = (schedule.recurrence_type, schedule.recurrence_interval)
+        schedule.next_payment_date = add_recurrence(schedule.next_payment_date, *step)
+        if schedule.period_start_date:
+            schedule.period_start_date = add_recurrence(schedule.period_start_date, *step)
+        if schedule.period_end_date:
+            schedule.period_end_date = add_recurrence(schedule.period_end_date, *step)
+
+
+def idempotency_key_for(schedule: models.ScheduledPayment) -> str:
+    """Один ключ на автоплатеж и дату: повторная попытка не спишет деньги второй раз."""
+    return f"scheduled-{schedule.id}-{schedule.next_payment_date.isoformat()}"
+
+
+# --- Исполнение ---
+@dataclass
+class ExecutionResult:
+    outcome: str  # executed | skipped | failed
+    bank_name: str
+    error: Optional[str] = None
+
+
+class BankStats:
+    def __init__(self):
+        self.executed = 0
+        self.skipped = 0
+        self.failed = 0
+        self.last_error: Optional[str] = None
+        # Задержка исполнения от начала дня платежа, секунды (последние 100)
+        self.lags = deque(maxlen=100)
+
+    def snapshot(self) -> dict:
+        lags = list(self.lags)
+        return {
+            "executed": self.executed,
+            "skipped": self.skipped,
+            "failed": self.failed,
+            "last_error": self.last_error,
+            "lag_avg_s": round(sum(lags) / len(lags), 1) if lags else None,
+            "lag_max_s": round(max(lags), 1) if lags else None,
+        }
+
+
+class ScheduledPaymentWorker:
+    """
+    Исполняет автоплатежи, у которых наступила next_payment_date.
+
+    Пачка забирается короткой транзакцией: UPDATE ... WHERE id IN (SELECT
+    ... FOR UPDATE SKIP LOCKED) сдвигает retry_at на claim_lease (аренда)
+    и сразу коммитится. Несколько экземпляров (воркеры API и отдельные
+    процессы) работают параллельно, не получая одну и ту же строку, а
+    строки не остаются заблокированными, пока идут запросы к банкам
+    (пользователь может изменить или удалить автоплатеж). Результаты
+    записываются второй короткой транзакцией; если автоплатеж за это время
+    удалили, выключили или перенесли, он только освобождается. Если процесс
+    упадет, пачка повторится после истечения аренды.
+
+    Каждый платеж отправляется через общий путь
+    payments_api.submit_internal_transfer в отдельной сессии с ключом
+    идемпотентности, построенным по автоплатежу и дате, — поэтому сбой
+    между отправкой и переносом даты (или повтор после аренды) не приводит
+    к двойному списанию.
+    """
+
+    def __init__(
+        self,
+        poll_interval: float = SCHEDULED_PAYMENTS_POLL_INTERVAL,
+        batch_size: int = SCHEDULED_PAYMENTS_BATCH_SIZE,
+        concurrency: int = SCHEDULED_PAYMENTS_CONCURRENCY,
+        retry_base: float = SCHEDULED_PAYMENTS_RETRY_BASE,
+        retry_max: float = SCHEDULED_PAYMENTS_RETRY_MAX,
+        claim_lease: float = SCHEDULED_PAYMENTS_CLAIM_LEASE,
+    ):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.concurrency = max(1, concurrency)
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.claim_lease = claim_lease
+        self._runner: Optional[asyncio.Task] = None
+        self._banks: Dict[str, BankStats] = defaultdict(BankStats)
+        self._completed = deque()
+        self.stats = {"runs": 0, "claimed": 0, "last_run_at": None, "last_run_ms": None}
+
+    async def _claim(self, today: date) -> List[models.ScheduledPayment]:
+        now = datetime.now(timezone.utc)
+        due = (
+            select(models.ScheduledPayment.id)
+            .where(
+                models.ScheduledPayment.is_active,
+                models.ScheduledPayment.next_payment_date <= today,
+                or_(models.ScheduledPayment.retry_at.is_(None), models.ScheduledPayment.retry_at <= now),
+            )
+            .order_by(models.ScheduledPayment.next_payment_date, models.ScheduledPayment.id)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        async with AsyncSessionLocal() as db:
+            schedules = (await db.scalars(
+                update(models.ScheduledPayment)
+                .where(models.ScheduledPayment.id.in_(due.scalar_subquery()))
+                .values(retry_at=now + timedelta(seconds=self.claim_lease))
+                .returning(models.ScheduledPayment)
+                .execution_options(synchronize_session=False)
+            )).all()
+            await db.commit()
+        return sorted(schedules, key=lambda schedule: (schedule.next_payment_date, schedule.id))
+
+    async def _apply(
+        self,
+        db: AsyncSession,
+        claimed: List[models.ScheduledPayment],
+        results: List[ExecutionResult],
+        today: date,
+    ) -> None:
+        """Записывает результаты пачки в текущие строки автоплатежей."""
+        current = {
+            schedule.id: schedule
+            for schedule in await db.scalars(
+                select(models.ScheduledPayment)
+                .where(models.ScheduledPayment.id.in_([schedule.id for schedule in claimed]))
+                .with_for_update()
+            )
+        }
+        for schedule, result in zip(claimed, results):
+            row = current.get(schedule.id)
+            if row is None:
+                continue
+            # Пока шли запросы к банкам, автоплатеж выключили или перенесли: только снимаем аренду
+            if not row.is_active or row.next_payment_date != schedule.next_payment_date:
+                row.retry_at = None
+                continue
+            self._record(row, result, today)
+
+    async def _execute(self, schedule: models.ScheduledPayment, amount: ScheduledAmount) -> ExecutionResult:
+        bank_name = "unknown"
+        idempotency_key = idempotency_key_for(schedule)
+        try:
+            async with AsyncSessionLocal() as db:
+                # Платеж уже отправлен, но дата не была перенесена (сбой после отправки)
+                if await db.scalar(select(models.Payment.id).where(models.Payment.idempotency_key == idempotency_key)):
+                    return ExecutionResult("executed", bank_name)
+
+                accounts = {
+                    account.id: account
+                    for account in await db.scalars(
+                        select(models.Account)
+                        .join(models.Account.connection)
+                        .options(contains_eager(models.Account.connection))
+                        .where(
+                            models.Account.id.in_((schedule.debtor_account_id, schedule.creditor_account_id)),
+                            models.ConnectedBank.user_id == schedule.user_id,
+                        )
+                    )
+                }
+                debtor_account = accounts.get(schedule.debtor_account_id)
+                creditor_account = accounts.get(schedule.creditor_account_id)
+                if not debtor_account or not creditor_account:
+                    return ExecutionResult("failed", bank_name, "Debtor or creditor account not found.")
+                bank_name = debtor_account.bank_name
+
+                consent = await db.scalar(
+                    select(models.PaymentConsent)
+                    .where(
+                        models.PaymentConsent.user_id == schedule.user_id,
+                        models.PaymentConsent.bank_name == bank_name,
+                        models.PaymentConsent.status == "approved",
+                        models.PaymentConsent.consent_id.is_not(None),
+                    )
+                    .order_by(models.PaymentConsent.id.desc())
+                    .limit(1)
+                )
+                if not consent:
+                    return ExecutionResult("failed", bank_name, f"No approved payment consent for bank '{bank_name}'.")
+
+                if amount.error:
+                    return ExecutionResult("failed", bank_name, amount.error)
+                if not amount.amount or amount.amount <= 0:
+                    return ExecutionResult("skipped", bank_name)
+
+                await submit_internal_transfer(
+                    db, schedule.user_id, debtor_account, creditor_account, consent,
+                    amount.amount, amount.currency or debtor_account.currency,
+                    f"Автоплатеж #{schedule.id} за {schedule.next_payment_date.isoformat()}",
+                    idempotency_key=idempotency_key,
+                )
+            return ExecutionResult("executed", bank_name)
+        except HTTPException as e:
+            return ExecutionResult("failed", bank_name, str(e.detail))
+        except Exception as e:
+            logger.exception(f"Scheduled payment {schedule.id} failed")
+            return ExecutionResult("failed", bank_name, str(e) or type(e).__name__)
+
+    def _record(self, schedule: models.ScheduledPayment, result: ExecutionResult, today: date) -> None:
+        now = datetime.now(timezone.utc)
+        stats = self._banks[result.bank_name]
+        if result.outcome == "failed":
+            stats.failed += 1
+            stats.last_error = result.error
+            schedule.failed_attempts = (schedule.failed_attempts or 0) + 1
+            # Показатель ограничен: иначе при долгой череде неудач 2 ** n переполнит float
+            delay = min(self.retry_base * 2 ** min(schedule.failed_attempts - 1, 30), self.retry_max)
+            schedule.retry_at = now + timedelta(seconds=delay)
+            schedule.last_error = (result.error or "")[:500]
+            logger.warning(f"Scheduled payment {schedule.id} failed (attempt {schedule.failed_attempts}): {result.error}")
+            return
+
+        if result.outcome == "executed":
+            stats.executed += 1
+            # Задержка от начала (локального) дня платежа
+            stats.lags.append(time.time() - datetime.combine(schedule.next_payment_date, datetime.min.time()).timestamp())
+            schedule.last_executed_at = now
+            self._completed.append(time.monotonic())
+        else:
+            stats.skipped += 1
+        schedule.failed_attempts = 0
+        schedule.retry_at = None
+        schedule.last_error = None
+        advance_schedule(schedule, today)
+
+    async def run_once(self) -> int:
+        """Забирает и исполняет одну пачку. Возвращает число обработанных автоплатежей."""
+        started = time.perf_counter()
+        today = date.today()
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def execute(schedule: models.ScheduledPayment, amount: ScheduledAmount) -> ExecutionResult:
+            async with semaphore:
+                return await self._execute(schedule, amount)
+
+        schedules = await self._claim(today)
+        if schedules:
+            # Без открытой транзакции пачки: синхронизация счетов и платежи идут в свои сессии
+            async with AsyncSessionLocal() as amounts_db:
+                amounts = await compute_amounts(amounts_db, schedules)
+            results = await asyncio.gather(*(execute(schedule, amounts[schedule.id]) for schedule in schedules))
+            async with AsyncSessionLocal() as db:
+                await self._apply(db, schedules, results, today)
+                await db.commit()
+
+        self.stats["runs"] += 1
+        self.stats["claimed"] += len(schedules)
+        self.stats["last_run_at"] = datetime.now(timezone.utc)
+        self.stats["last_run_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return len(schedules)
+
+    async def _run_loop(self) -> None:
+        while True:
+            try:
+                processed = await self.run_once()
+            except Exception as e:
+                logger.error(f"Scheduled payments run failed: {e}")
+                processed = 0
+            # Полная пачка — очередь, вероятно, не пуста: берем следующую сразу
+            if processed < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def start(self) -> None:
+        if self._runner is None:
+            self._runner = asyncio.create_task(self._run_loop())
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def snapshot(self) -> dict:
+        horizon = time.monotonic() - THROUGHPUT_WINDOW
+        while self._completed and self._completed[0] < horizon:
+            self._completed.popleft()
+        return {
+            "running": self._runner is not None,
+            "batch_size": self.batch_size,
+            "concurrency": self.concurrency,
+            "stats": dict(self.stats),
+            "throughput_per_min": round(len(self._completed) * 60 / THROUGHPUT_WINDOW, 2),
+            "banks": {name: stats.snapshot() for name, stats in self._banks.items()},
+        }
+
+
+# Единственный экземпляр на процесс
+scheduled_payment_worker = ScheduledPaymentWorker()
+
+
+async def main() -> None:
+    """Отдельный процесс-исполнитель: python scheduled_payment_worker.py"""
+    from bank_client import bank_clients
+    from bank_tokens import bank_token_cache
+    from database import async_engine
+
+    logging.basicConfig(level=logging.INFO)
+    await bank_clients.start()
+    await bank_registry.start()
+    await bank_token_cache.start()
+    await scheduled_payment_worker.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        while not stop.is_set():
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=max(scheduled_payment_worker.poll_interval, 1))
+            except asyncio.TimeoutError:
+                logger.info(f"Scheduled payments: {scheduled_payment_worker.snapshot()}")
+    finally:
+        await scheduled_payment_worker.stop()
+        await bank_token_cache.stop()
+        await bank_registry.stop()
+        await bank_clients.stop()
+        await async_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,17 +1,22 @@
 # finance-app-master/scheduled_payments_api.py
 
-from fastapi import APIRouter, Depends, HTTPException
+from datetime import date
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List
+from typing import List, Optional
 
 import models
-from database import get_db
+from database import get_db, get_async_db
 from deps import user_is_admin_or_self
+from scheduled_amounts import compute_amounts
 from schemas import (
     ScheduledPaymentCreate,
     ScheduledPaymentUpdate,
     ScheduledPaymentResponse,
-    ScheduledPaymentListResponse
+    ScheduledPaymentListResponse,
+    ScheduledPaymentPreviewResponse,
 )
 
 router = APIRouter(
@@ -65,6 +70,46 @@ def get_scheduled_payments(
     payments = db.query(models.ScheduledPayment).filter(models.ScheduledPayment.user_id == user_id).all()
     return {"count": len(payments), "payments": payments}
 
+@router.get("/preview", response_model=ScheduledPaymentPreviewResponse, summary="Предпросмотр сумм автоплатежей")
+async def preview_scheduled_payments(
+    user_id: int,
+    due_by: Optional[date] = Query(None, description="Только автоплатежи с датой не позже указанной"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Рассчитывает суммы активных автоплатежей так же, как при исполнении
+    (scheduled_amounts.compute_amounts), но без обращения к банкам и без
+    записи в БД: по транзакциям, уже сохраненным в локальном хранилище.
+    Перед исполнением счета синхронизируются, поэтому итоговая сумма
+    может отличаться, если с тех пор появились новые проводки.
+    """
+    query = select(models.ScheduledPayment).where(
+        models.ScheduledPayment.user_id == user_id,
+        models.ScheduledPayment.is_active,
+    )
+    if due_by:
+        query = query.where(models.ScheduledPayment.next_payment_date <= due_by)
+    schedules = (await db.scalars(query.order_by(models.ScheduledPayment.next_payment_date, models.ScheduledPayment.id))).all()
+
+    amounts = await compute_amounts(db, schedules, sync=False)
+    payments = [
+        {
+            "id": schedule.id,
+            "debtor_account_id": schedule.debtor_account_id,
+            "creditor_account_id": schedule.creditor_account_id,
+            "next_payment_date": schedule.next_payment_date,
+            "amount_type": schedule.amount_type.value,
+            "period_start_date": schedule.period_start_date,
+            "period_end_date": schedule.period_end_date,
+            "amount": amounts[schedule.id].amount,
+            "currency": amounts[schedule.id].currency,
+            "error": amounts[schedule.id].error,
+        }
+        for schedule in schedules
+    ]
+    return {"count": len(payments), "payments": payments}
+
 ### НОВЫЙ ЭНДПОИНТ ДЛЯ ОБНОВЛЕНИЯ (PUT) ###
 @router.put("/{payment_id}", response_model=ScheduledPaymentResponse, summary="Изменить автоплатеж")
 def update_scheduled_payment(
@@ -92,6 +137,9 @@ def update_scheduled_payment(
     if final_amount_type == 'fixed':
         update_dict['period_start_date'] = None
         update_dict['period_end_date'] = None
+    final_percentage = update_dict.get('minimum_payment_percentage', db_payment.minimum_payment_percentage)
+    if final_amount_type == 'minimum_payment' and final_percentage is None:
+        raise HTTPException(status_code=422, detail='minimum_payment_percentage is required for "minimum_payment" amount type.')
         
     # Преобразование enums
     if 'amount_type' in update_dict and update_dict['amount_type'] is not None:
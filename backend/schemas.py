@@ -78,7 +78,8 @@ class AccountSchema(BaseModel):
     # Поля, которые мы добавим вручную в эндпоинте
     bank_client_id: str
     bank_name: str
-    bank_id: int  # <-- ДОБАВЬТЕ ЭТО ПОЛЕ
+    # NULL у подключений к банку, которого уже нет в таблице banks (миграция не смогла заполнить)
+    bank_id: Optional[int] = None
     
     class Config:
         from_attributes = True
@@ -237,11 +238,71 @@ class PaymentResponse(BaseModel):
     class Config:
         from_attributes = True
 
+class PaymentTotals(BaseModel):
+    currency: str
+    count: int
+    total_amount: Decimal
+
 class PaymentListResponse(BaseModel):
     count: int
     payments: List[PaymentResponse]
+    # Курсор следующей страницы истории (None — страниц больше нет)
+    next_cursor: Optional[str] = None
+    # Итоги по всем платежам, подходящим под фильтры (по валютам), если запрошены
+    totals: Optional[List[PaymentTotals]] = None
 # --- ^^^ КОНЕЦ НОВЫХ СХЕМ ^^^ ---
 
+# --- Пакетная отправка платежей ---
+class BatchPaymentItem(BaseModel):
+    payment_consent_id: int = Field(..., description="ID нашего согласия на платеж в БД")
+    debtor_account_id: int = Field(..., description="ID счета списания в нашей БД")
+    # Перевод между своими счетами — creditor_account_id, внешний платеж — реквизиты получателя
+    creditor_account_id: Optional[int] = Field(None, description="ID счета зачисления в нашей БД")
+    creditor_name: Optional[str] = None
+    creditor_account: Optional[str] = None
+    creditor_bank_code: Optional[str] = None
+    amount: Decimal = Field(..., max_digits=10, decimal_places=2, example=150.50)
+    currency: str = Field(..., example="RUB")
+    reference: Optional[str] = None
+    # Повтор позиции с тем же ключом не создает второй платеж
+    idempotency_key: Optional[str] = Field(None, max_length=128)
+
+    @model_validator(mode='after')
+    def validate_creditor(self) -> 'BatchPaymentItem':
+        external = (self.creditor_name, self.creditor_account, self.creditor_bank_code)
+        if self.creditor_account_id is None and not all(external):
+            raise ValueError('Either creditor_account_id or creditor_name, creditor_account and creditor_bank_code are required.')
+        if self.creditor_account_id is not None and any(external):
+            raise ValueError('creditor_account_id cannot be combined with external creditor details.')
+        return self
+
+class BatchPaymentRequest(BaseModel):
+    payments: List[BatchPaymentItem] = Field(..., min_length=1)
+
+    @model_validator(mode='after')
+    def validate_unique_keys(self) -> 'BatchPaymentRequest':
+        keys = [item.idempotency_key for item in self.payments if item.idempotency_key]
+        if len(keys) != len(set(keys)):
+            raise ValueError('idempotency_key must be unique within the batch.')
+        return self
+
+class BatchPaymentResult(BaseModel):
+    index: int
+    # submitted — отправлен сейчас, duplicate — уже был отправлен с этим ключом, failed — ошибка
+    status: str
+    idempotency_key: str
+    payment: Optional[PaymentResponse] = None
+    error_code: Optional[int] = None
+    error: Optional[str] = None
+    # Для error_code 503: через сколько секунд можно повторить позицию
+    retry_after: Optional[float] = None
+
+class BatchPaymentResponse(BaseModel):
+    count: int
+    submitted: int
+    failed: int
+    results: List[BatchPaymentResult]
+
 # vvv НОВЫЙ ENUM vvv
 class RecurrenceTypeEnum(str, enum.Enum):
     DAYS = "days"
@@ -317,10 +378,20 @@ class ScheduledPaymentUpdate(ScheduledPaymentBase):
     fixed_amount: Optional[Decimal] = Field(None, max_digits=10, decimal_places=2)
     minimum_payment_percentage: Optional[Decimal] = Field(None, max_digits=5, decimal_places=2)
 
+    @model_validator(mode='after')
+    def validate_percentage(self) -> 'ScheduledPaymentUpdate':
+        # Без смены типа суммы процент только меняется, но не сбрасывается
+        if 'minimum_payment_percentage' in self.model_fields_set and self.amount_type is None:
+            if self.minimum_payment_percentage is None or self.minimum_payment_percentage <= 0:
+                raise ValueError('minimum_payment_percentage must be positive.')
+        return self
+
 class ScheduledPaymentResponse(ScheduledPaymentCore):
     id: int
     user_id: int
     currency: Optional[str] = None
+    last_executed_at: Optional[datetime] = None
+    last_error: Optional[str] = None
     created_at: datetime
     updated_at: Optional[datetime] = None
 
@@ -329,4 +400,21 @@ class ScheduledPaymentResponse(ScheduledPaymentCore):
         
 class ScheduledPaymentListResponse(BaseModel):
     count: int
-    payments: List[ScheduledPaymentResponse]
\ No newline at end of file
+    payments: List[ScheduledPaymentResponse]
+
+class ScheduledPaymentPreview(BaseModel):
+    id: int
+    debtor_account_id: int
+    creditor_account_id: int
+    next_payment_date: date
+    amount_type: ScheduledPaymentAmountTypeEnum
+    period_start_date: Optional[date] = None
+    period_end_date: Optional[date] = None
+    # Сумма, которая была бы списана сейчас (None — если ее не удалось рассчитать)
+    amount: Optional[Decimal] = None
+    currency: Optional[str] = None
+    error: Optional[str] = None
+
+class ScheduledPaymentPreviewResponse(BaseModel):
+    count: int
+    payments: List[ScheduledPaymentPreview]
\ No newline at end of file
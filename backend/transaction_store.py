@@ -0,0 +1,522 @@
+# finance-app-master/transaction_store.py
+import asyncio
+import httpx
+import orjson
+from contextlib import aclosing
+from datetime import date, datetime, timezone, time, timedelta
+from decimal import Decimal, InvalidOperation
+from typing import Annotated, Optional, List, Dict, AsyncIterator, Iterator, Tuple
+
+from sqlalchemy import func, case, delete, literal_column, select
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import TypeAdapter, ValidationError, WrapValidator
+
+import models
+from database import SessionLocal
+from bank_client import bank_clients
+from bank_registry import BankInfo
+from schemas import TransactionDetail
+from utils import get_bank_token, logger
+from config import (
+    TRANSACTIONS_PAGE_SIZE,
+    TRANSACTIONS_PREFETCH_PAGES,
+    TRANSACTIONS_SYNC_MIN_INTERVAL,
+    TRANSACTIONS_SYNC_OVERLAP_DAYS,
+    TRANSACTIONS_STREAM_BATCH_SIZE,
+)
+
+# Сколько строк отправлять в одном INSERT (ограничение числа параметров Postgres)
+UPSERT_CHUNK_SIZE = 1000
+
+
+def period_bounds(from_dt: Optional[datetime], to_dt: Optional[datetime]) -> Tuple[Optional[datetime], Optional[datetime]]:
+    """
+    Границы периода в UTC: начало как есть, конец — до конца дня `to_dt` включительно.
+    """
+    from_utc = from_dt.replace(tzinfo=timezone.utc) if from_dt and from_dt.tzinfo is None else from_dt
+    to_utc_inclusive = None
+    if to_dt:
+        end_of_day = datetime.combine(to_dt.date(), time.max)
+        to_utc_inclusive = end_of_day.replace(tzinfo=timezone.utc) if end_of_day.tzinfo is None else end_of_day.astimezone(timezone.utc)
+    return from_utc, to_utc_inclusive
+
+
+# --- ЗАГРУЗКА ТРАНЗАКЦИЙ ИЗ БАНКА ---
+async def iter_bank_transaction_pages(
+    client: httpx.AsyncClient,
+    transactions_url: str,
+    headers: dict,
+    base_params: dict,
+    prefetch: int = TRANSACTIONS_PREFETCH_PAGES,
+) -> AsyncIterator[List[dict]]:
+    """
+    Запрашивает страницы транзакций, держа в полете до `prefetch` страниц
+    одновременно, и отдает их строго по порядку (page=1, 2, 3...).
+
+    Каждая отданная страница содержит только строки с еще не встречавшимся
+    transactionId. Загрузка останавливается на первой пустой или полностью
+    повторяющейся странице; страницы, запрошенные "на вырост", отменяются.
+    """
+    seen_ids = set()
+    in_flight: Dict[int, asyncio.Task] = {}
+    next_page = 1
+
+    def request_next_page():
+        nonlocal next_page
+        params = base_params.copy()
+        params["page"] = next_page
+        in_flight[next_page] = asyncio.create_task(client.get(transactions_url, headers=headers, params=params))
+        next_page += 1
+
+    try:
+        for _ in range(max(1, prefetch)):
+            request_next_page()
+
+        page = 1
+        while True:
+            response = await in_flight.pop(page)
+            response.raise_for_status()
+            transactions_on_page = orjson.loads(response.content).get("data", {}).get("transaction", [])
+
+            new_rows = []
+            for trans_data in transactions_on_page:
+                transaction_id = trans_data.get("transactionId")
+                if transaction_id and transaction_id not in seen_ids:
+                    seen_ids.add(transaction_id)
+                    new_rows.append(trans_data)
+
+            if not new_rows:
+                break
+
+            yield new_rows
+            request_next_page()
+            page += 1
+    finally:
+        # Лишние (уже ненужные) страницы отбрасываем
+        for task in in_flight.values():
+            task.cancel()
+        await asyncio.gather(*in_flight.values(), return_exceptions=True)
+
+
+def _keep_invalid(value, handler):
+    # Ошибка строки не прерывает валидацию всей страницы, а возвращается на ее месте
+    try:
+        return handler(value)
+    except ValidationError as e:
+        return e
+
+
+_TRANSACTION_LIST = TypeAdapter(List[Annotated[TransactionDetail, WrapValidator(_keep_invalid)]])
+
+
+def validate_transactions(rows: List[dict]) -> Tuple[List[TransactionDetail], Dict[int, List[dict]]]:
+    """
+    Валидирует страницу транзакций за один проход (TypeAdapter списка).
+
+    Возвращает валидные транзакции и ошибки невалидных строк
+    в виде {индекс строки: [ошибки pydantic]}.
+    """
+    transactions: List[TransactionDetail] = []
+    invalid: Dict[int, List[dict]] = {}
+    for index, item in enumerate(_TRANSACTION_LIST.validate_python(rows)):
+        if isinstance(item, ValidationError):
+            invalid[index] = item.errors(include_url=False, include_input=False)
+        else:
+            transactions.append(item)
+    return transactions, invalid
+
+
+def _describe_invalid(rows: List[dict], invalid: Dict[int, List[dict]]) -> List[str]:
+    descriptions = []
+    for index, errors in invalid.items():
+        fields = ", ".join(f"{'.'.join(map(str, error['loc']))}: {error['msg']}" for error in errors)
+        descriptions.append(f"{rows[index].get('transactionId')} ({fields})")
+    return descriptions
+
+
+# --- НОВАЯ ЕДИНАЯ ФУНКЦИЯ ДЛЯ ПОЛУЧЕНИЯ ВСЕХ ТРАНЗАКЦИЙ ---
+async def get_all_transactions_for_period(
+    bank_access_token: str,
+    bank_config: BankInfo,
+    connection: models.ConnectedBank,
+    api_account_id: str,
+    from_dt: Optional[datetime],
+    to_dt: Optional[datetime],
+    prefetch: int = TRANSACTIONS_PREFETCH_PAGES,
+) -> List[TransactionDetail]:
+    """
+    Надежно и ОПТИМИЗИРОВАННО получает все транзакции за период.
+    """
+    transactions_url = f"{bank_config.base_url}/accounts/{api_account_id}/transactions"
+    headers = {
+        "Authorization": f"Bearer {bank_access_token}",
+        "X-Requesting-Bank": bank_config.client_id,
+        "X-Consent-Id": connection.consent_id,
+        "Accept": "application/json"
+    }
+    
+    # --- ГЛАВНОЕ ИЗМЕНЕНИЕ: Возвращаем передачу дат в API банка ---
+    base_params = {"limit": TRANSACTIONS_PAGE_SIZE}
+    if from_dt:
+        base_params["from_booking_date_time"] = from_dt.isoformat()
+    if to_dt:
+        # Для to_dt передаем саму дату, а для нашей внутренней фильтрации
+        # будем использовать конец дня.
+        base_params["to_booking_date_time"] = to_dt.isoformat()
+    # --- КОНЕЦ ИЗМЕНЕНИЯ ---
+
+    from_utc, to_utc_inclusive = period_bounds(from_dt, to_dt)
+
+    all_transactions: List[TransactionDetail] = []
+    invalid_rows: List[str] = []
+
+    client = bank_clients.get(connection.bank_name)
+    try:
+        # Дедупликация по transactionId выполняется внутри iter_bank_transaction_pages
+        async with aclosing(iter_bank_transaction_pages(client, transactions_url, headers, base_params, prefetch)) as pages:
+            async for transactions_on_page in pages:
+                transactions, invalid = validate_transactions(transactions_on_page)
+                if invalid:
+                    invalid_rows.extend(_describe_invalid(transactions_on_page, invalid))
+
+                for transaction in transactions:
+                    # Внутренняя фильтрация остаётся как дополнительная проверка
+                    is_in_date_range = True
+                    if from_utc and transaction.bookingDateTime < from_utc:
+                        is_in_date_range = False
+                    if to_utc_inclusive and transaction.bookingDateTime > to_utc_inclusive:
+                        is_in_date_range = False
+
+                    if is_in_date_range:
+                        all_transactions.append(transaction)
+    except (httpx.RequestError, httpx.HTTPStatusError) as e:
+        raise Exception(f"Failed to fetch transactions from {connection.bank_name}: {e}")
+
+    if invalid_rows:
+        # Одно сообщение на всю загрузку, а не по строке на каждую ошибку
+        logger.warning(
+            f"Skipped {len(invalid_rows)} invalid transactions from {connection.bank_name} "
+            f"for account {api_account_id}: {'; '.join(invalid_rows[:10])}"
+            + (" ..." if len(invalid_rows) > 10 else "")
+        )
+
+    return all_transactions
+
+
+# --- ЛОКАЛЬНОЕ ХРАНИЛИЩЕ ТРАНЗАКЦИЙ ---
+def _to_row(account_id: int, transaction: TransactionDetail) -> Optional[dict]:
+    try:
+        amount = Decimal(transaction.amount.amount)
+    except InvalidOperation:
+        logger.warning(f"Skipping transaction {transaction.transactionId}: invalid amount '{transaction.amount.amount}'")
+        return None
+    booked = transaction.bookingDateTime
+    if booked.tzinfo is None:
+        booked = booked.replace(tzinfo=timezone.utc)
+    return {
+        "account_id": account_id,
+        "transaction_id": transaction.transactionId,
+        "booking_date_time": booked,
+        "amount": amount,
+        "currency": transaction.amount.currency,
+        "credit_debit_indicator": transaction.creditDebitIndicator.lower(),
+        "status": transaction.status,
+        "data": transaction.model_dump(mode="json"),
+    }
+
+
+def _utc_day(column):
+    """Календарный день (UTC) для колонки timestamptz."""
+    return func.date(func.timezone("UTC", column))
+
+
+def _utc_midnight(day: date) -> datetime:
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+async def save_transactions(db: AsyncSession, account_id: int, transactions: List[TransactionDetail]) -> int:
+    """
+    Сохраняет транзакции (upsert по (account_id, transaction_id)) и
+    пересчитывает дневные обороты за затронутые дни.
+    Возвращает количество НОВЫХ транзакций. Коммит — на вызывающей стороне.
+    """
+    rows = [row for row in (_to_row(account_id, t) for t in transactions) if row]
+    created = 0
+    touched_days = set()
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+        touched_days.update(row["booking_date_time"].astimezone(timezone.utc).date() for row in chunk)
+        # Дата проводки уже известной транзакции могла измениться — старый день тоже пересчитываем
+        touched_days.update((await db.execute(
+            select(_utc_day(models.Transaction.booking_date_time)).distinct().where(
+                models.Transaction.account_id == account_id,
+                models.Transaction.transaction_id.in_([row["transaction_id"] for row in chunk]),
+            )
+        )).scalars())
+
+        stmt = insert(models.Transaction).values(chunk)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[models.Transaction.account_id, models.Transaction.transaction_id],
+            # Меняться у уже известной транзакции может статус (pending -> booked) и прочие детали
+            set_={
+                "booking_date_time": stmt.excluded.booking_date_time,
+                "amount": stmt.excluded.amount,
+                "currency": stmt.excluded.currency,
+                "credit_debit_indicator": stmt.excluded.credit_debit_indicator,
+                "status": stmt.excluded.status,
+                "data": stmt.excluded.data,
+            },
+        ).returning(literal_column("xmax = 0"))
+        created += sum(1 for inserted in (await db.execute(stmt)).scalars() if inserted)
+
+    await refresh_daily_totals(db, account_id, touched_days)
+    return created
+
+
+async def refresh_daily_totals(db: AsyncSession, account_id: int, days) -> None:
+    """
+    Пересчитывает дневные обороты счета за указанные дни (UTC) по таблице transactions.
+    Пересчет идет только по затронутым дням, поэтому стоит O(новых транзакций), а не O(истории).
+    """
+    days = sorted(days)
+    if not days:
+        return
+
+    await db.execute(delete(models.TransactionDailyTotal).where(
+        models.TransactionDailyTotal.account_id == account_id,
+        models.TransactionDailyTotal.day.in_(days),
+    ))
+
+    day = _utc_day(models.Transaction.booking_date_time)
+    currency = func.coalesce(models.Transaction.currency, "")
+    indicator = models.Transaction.credit_debit_indicator
+    totals = select(
+        models.Transaction.account_id,
+        day,
+        currency,
+        func.coalesce(func.sum(case((indicator == "credit", models.Transaction.amount), else_=0)), 0),
+        func.coalesce(func.sum(case((indicator == "debit", models.Transaction.amount), else_=0)), 0),
+    ).where(
+        models.Transaction.account_id == account_id,
+        # Диапазон по booking_date_time позволяет использовать индекс (account_id, booking_date_time)
+        models.Transaction.booking_date_time >= _utc_midnight(days[0]),
+        models.Transaction.booking_date_time < _utc_midnight(days[-1] + timedelta(days=1)),
+        day.in_(days),
+    ).group_by(models.Transaction.account_id, day, currency)
+
+    stmt = insert(models.TransactionDailyTotal).from_select(
+        ["account_id", "day", "currency", "total_credit", "total_debit"], totals
+    )
+    # Параллельная синхронизация того же счета могла успеть вставить эти дни
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            models.TransactionDailyTotal.account_id,
+            models.TransactionDailyTotal.day,
+            models.TransactionDailyTotal.currency,
+        ],
+        set_={"total_credit": stmt.excluded.total_credit, "total_debit": stmt.excluded.total_debit},
+    )
+    await db.execute(stmt)
+
+
+async def sync_account_transactions(
+    db: AsyncSession,
+    account: models.Account,
+    connection: models.ConnectedBank,
+    bank_config: BankInfo,
+    force: bool = False,
+) -> int:
+    """
+    Инкрементально подтягивает из банка новые транзакции счета.
+
+    Загружается только период начиная с водяного знака счета
+    (максимальной известной даты проводки) минус небольшое перекрытие —
+    на случай поздно проведенных операций. Первая синхронизация загружает
+    всю историю. Чаще, чем раз в TRANSACTIONS_SYNC_MIN_INTERVAL секунд,
+    банк не опрашивается (если не указан force).
+    Возвращает количество новых транзакций.
+    """
+    now = datetime.now(timezone.utc)
+    synced_at = account.transactions_synced_at
+    if not force and synced_at and now - synced_at < timedelta(seconds=TRANSACTIONS_SYNC_MIN_INTERVAL):
+        return 0
+
+    from_dt = None
+    if account.transactions_watermark:
+        from_dt = account.transactions_watermark - timedelta(days=TRANSACTIONS_SYNC_OVERLAP_DAYS)
+
+    bank_access_token = await get_bank_token(connection.bank_name)
+    transactions = await get_all_transactions_for_period(
+        bank_access_token=bank_access_token,
+        bank_config=bank_config,
+        connection=connection,
+        api_account_id=account.api_account_id,
+        from_dt=from_dt,
+        to_dt=None,
+    )
+
+    created = await save_transactions(db, account.id, transactions)
+    account.transactions_watermark = await db.scalar(
+        select(func.max(models.Transaction.booking_date_time)).where(models.Transaction.account_id == account.id)
+    )
+    account.transactions_synced_at = now
+    await db.commit()
+
+    if created:
+        logger.info(f"Synced {created} new transactions for account {account.id} (from {from_dt or 'the beginning'})")
+    return created
+
+
+def _stored_transactions_query(account_id: int, from_dt: Optional[datetime], to_dt: Optional[datetime]):
+    from_utc, to_utc_inclusive = period_bounds(from_dt, to_dt)
+    stmt = select(models.Transaction.data).where(models.Transaction.account_id == account_id)
+    if from_utc:
+        stmt = stmt.where(models.Transaction.booking_date_time >= from_utc)
+    if to_utc_inclusive:
+        stmt = stmt.where(models.Transaction.booking_date_time <= to_utc_inclusive)
+    return stmt.order_by(models.Transaction.booking_date_time.desc(), models.Transaction.id.desc())
+
+
+async def get_stored_transactions(
+    db: AsyncSession,
+    account_id: int,
+    from_dt: Optional[datetime],
+    to_dt: Optional[datetime],
+) -> List[dict]:
+    """Транзакции счета за период из БД (новые сверху), в формате TransactionDetail."""
+    return list((await db.execute(_stored_transactions_query(account_id, from_dt, to_dt))).scalars())
+
+
+def stream_stored_transactions(
+    account_id: int,
+    from_dt: Optional[datetime],
+    to_dt: Optional[datetime],
+    fmt: str = "ndjson",
+    batch_size: int = TRANSACTIONS_STREAM_BATCH_SIZE,
+) -> Iterator[bytes]:
+    """
+    Отдает транзакции счета за период по частям, не собирая их в память.
+
+    Строки читаются серверным курсором пачками по `batch_size` и сразу
+    сериализуются: повторной валидации нет — транзакции проверены схемой
+    TransactionDetail один раз, при сохранении.
+    fmt="ndjson" — по одной транзакции на строку;
+    fmt="json"   — тот же документ, что и у обычного эндпоинта
+    ({"data": {"transaction": [...]}}), записываемый по частям.
+
+    Генератор синхронный и открывает собственную сессию: StreamingResponse
+    выполняет его в пуле потоков уже после выхода из обработчика запроса.
+    """
+    db = SessionLocal()
+    try:
+        stmt = _stored_transactions_query(account_id, from_dt, to_dt)
+        rows = db.execute(stmt.execution_options(yield_per=batch_size)).scalars()
+        if fmt == "ndjson":
+            for data in rows:
+                yield orjson.dumps(data) + b"\n"
+            return
+
+        yield b'{"data":{"transaction":['
+        separator = b""
+        for data in rows:
+            yield separator + orjson.dumps(data)
+            separator = b","
+        yield b"]}}"
+    finally:
+        db.close()
+
+
+async def _exact_turnover(
+    db: AsyncSession,
+    account_id: int,
+    start: Optional[datetime],
+    end: Optional[datetime],
+) -> Tuple[Decimal, Decimal, Optional[str]]:
+    """Точные обороты по транзакциям за [start, end)."""
+    indicator = models.Transaction.credit_debit_indicator
+    stmt = select(
+        func.coalesce(func.sum(case((indicator == "credit", models.Transaction.amount), else_=0)), 0),
+        func.coalesce(func.sum(case((indicator == "debit", models.Transaction.amount), else_=0)), 0),
+        func.max(models.Transaction.currency),
+    ).where(models.Transaction.account_id == account_id)
+    if start:
+        stmt = stmt.where(models.Transaction.booking_date_time >= start)
+    if end:
+        stmt = stmt.where(models.Transaction.booking_date_time < end)
+    total_credit, total_debit, currency = (await db.execute(stmt)).one()
+    return Decimal(total_credit), Decimal(total_debit), currency
+
+
+async def _rollup_turnover(
+    db: AsyncSession,
+    account_id: int,
+    first_day: Optional[date],
+    end_day: Optional[date],
+) -> Tuple[Decimal, Decimal, Optional[str]]:
+    """Обороты по дневным итогам за дни [first_day, end_day)."""
+    totals = models.TransactionDailyTotal
+    stmt = select(
+        func.coalesce(func.sum(totals.total_credit), 0),
+        func.coalesce(func.sum(totals.total_debit), 0),
+        func.max(func.nullif(totals.currency, "")),
+    ).where(totals.account_id == account_id)
+    if first_day:
+        stmt = stmt.where(totals.day >= first_day)
+    if end_day:
+        stmt = stmt.where(totals.day < end_day)
+    total_credit, total_debit, currency = (await db.execute(stmt)).one()
+    return Decimal(total_credit), Decimal(total_debit), currency
+
+
+async def get_daily_turnover(
+    db: AsyncSession,
+    account_id: int,
+    first_day: date,
+    last_day: date,
+) -> Dict[date, Tuple[Decimal, Decimal]]:
+    """Поступления и списания по дням (UTC) за [first_day, last_day] — одним запросом."""
+    totals = models.TransactionDailyTotal
+    rows = await db.execute(
+        select(totals.day, func.sum(totals.total_credit), func.sum(totals.total_debit))
+        .where(totals.account_id == account_id, totals.day >= first_day, totals.day <= last_day)
+        .group_by(totals.day)
+    )
+    return {day: (Decimal(credit), Decimal(debit)) for day, credit, debit in rows}
+
+
+async def get_stored_turnover(
+    db: AsyncSession,
+    account_id: int,
+    from_dt: Optional[datetime],
+    to_dt: Optional[datetime],
+) -> Tuple[Decimal, Decimal, Optional[str]]:
+    """
+    Сумма поступлений, сумма списаний и валюта за период.
+
+    Полные дни периода суммируются по таблице дневных оборотов,
+    неполные крайние дни — точно, по самим транзакциям.
+    """
+    from_utc, to_utc_inclusive = period_bounds(from_dt, to_dt)
+    start = from_utc.astimezone(timezone.utc) if from_utc else None
+    end = to_utc_inclusive.astimezone(timezone.utc) + timedelta(microseconds=1) if to_utc_inclusive else None
+
+    # Полные дни: [first_full, end_full)
+    first_full = None
+    if start:
+        first_full = start.date() if start.time() == time.min else start.date() + timedelta(days=1)
+    end_full = end.date() if end else None
+
+    if first_full and end_full and first_full >= end_full:
+        return await _exact_turnover(db, account_id, start, end)
+
+    parts = [await _rollup_turnover(db, account_id, first_full, end_full)]
+    if start and start < _utc_midnight(first_full):
+        parts.append(await _exact_turnover(db, account_id, start, _utc_midnight(first_full)))
+    if end and _utc_midnight(end_full) < end:
+        parts.append(await _exact_turnover(db, account_id, _utc_midnight(end_full), end))
+
+    total_credit = sum((part[0] for part in parts), Decimal("0"))
+    total_debit = sum((part[1] for part in parts), Decimal("0"))
+    currency = next((part[2] for part in parts if part[2]), None)
+    return total_credit, total_debit, currency
@@ -1,17 +1,28 @@
 # finance-app-master/backend/transactions_api.py
 
-import httpx
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import Optional, List
-from datetime import datetime, timezone, time
-from decimal import Decimal
+import logging
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import contains_eager
+from typing import Optional, Tuple
+from datetime import datetime
 
 import models
-from database import get_db
+from database import get_async_db
 from deps import user_is_admin_or_self
-from utils import get_bank_token
-from schemas import TransactionListResponse, TurnoverResponse, TransactionDetail
+from bank_registry import bank_registry, BankInfo
+from bank_client import BankUnavailableError, DEGRADED_HEADER
+from schemas import TransactionListResponse, TurnoverResponse
+from transaction_store import (
+    sync_account_transactions,
+    get_stored_transactions,
+    stream_stored_transactions,
+    get_stored_turnover,
+)
+
+logger = logging.getLogger("uvicorn")
 
 router = APIRouter(
     prefix="/users/{user_id}/banks/{bank_id}/accounts",
@@ -19,92 +30,59 @@ router = APIRouter(
 )
 
 
-# --- НОВАЯ ЕДИНАЯ ФУНКЦИЯ ДЛЯ ПОЛУЧЕНИЯ ВСЕХ ТРАНЗАКЦИЙ ---
-async def _get_all_transactions_for_period(
-    bank_access_token: str,
-    bank_config: models.Bank,
-    connection: models.ConnectedBank,
-    api_account_id: str,
-    from_dt: Optional[datetime],
-    to_dt: Optional[datetime],
-) -> List[TransactionDetail]:
+async def _find_account(db: AsyncSession, user_id: int, bank_name: str, api_account_id: str) -> Optional[models.Account]:
+    # Подключение загружается тем же запросом: ленивая загрузка в async-сессии невозможна
+    return await db.scalar(
+        select(models.Account)
+        .join(models.Account.connection)
+        .options(contains_eager(models.Account.connection))
+        .where(
+            models.Account.api_account_id == api_account_id,
+            models.ConnectedBank.user_id == user_id,
+            models.ConnectedBank.bank_name == bank_name,
+        )
+        .limit(1)
+    )
+
+
+async def _sync_transactions(db: AsyncSession, db_account: models.Account, bank: BankInfo) -> bool:
     """
-    Надежно и ОПТИМИЗИРОВАННО получает все транзакции за период.
+    Подтягивает из банка новые транзакции счета. Если банк недоступен
+    (выключатель или ограничитель частоты в bank_client.py), возвращает
+    False: ответ строится по уже сохраненным транзакциям.
+    """
+    try:
+        await sync_account_transactions(db, db_account, db_account.connection, bank)
+    except BankUnavailableError as e:
+        logger.warning(f"Serving stored transactions for account {db_account.id}: {e}")
+        return False
+    except HTTPException:
+        # Ответы банка (например, 403 или 404) передаются клиенту как есть
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=502, detail=str(e))
+    return True
+
+
+async def _get_synced_account(db: AsyncSession, user_id: int, bank_id: int, api_account_id: str) -> Tuple[models.Account, bool]:
     """
-    transactions_url = f"{bank_config.base_url}/accounts/{api_account_id}/transactions"
-    headers = {
-        "Authorization": f"Bearer {bank_access_token}",
-        "X-Requesting-Bank": bank_config.client_id,
-        "X-Consent-Id": connection.consent_id,
-        "Accept": "application/json"
-    }
+    Находит счет пользователя с активным согласием и подтягивает
+    из банка его новые транзакции (см. transaction_store.py).
+    Второе значение — False, если банк недоступен и синхронизации не было.
+    """
+    bank = await bank_registry.fetch_by_id(bank_id)
+    if not bank:
+        raise HTTPException(status_code=404, detail="Bank with the specified ID not found.")
     
-    # --- ГЛАВНОЕ ИЗМЕНЕНИЕ: Возвращаем передачу дат в API банка ---
-    base_params = {"limit": 100}
-    if from_dt:
-        base_params["from_booking_date_time"] = from_dt.isoformat()
-    if to_dt:
-        # Для to_dt передаем саму дату, а для нашей внутренней фильтрации
-        # будем использовать конец дня.
-        base_params["to_booking_date_time"] = to_dt.isoformat()
-    # --- КОНЕЦ ИЗМЕНЕНИЯ ---
-
-    from_utc = from_dt.replace(tzinfo=timezone.utc) if from_dt and from_dt.tzinfo is None else from_dt
-    to_utc_inclusive = None
-    if to_dt:
-        end_of_day = datetime.combine(to_dt.date(), time.max)
-        to_utc_inclusive = end_of_day.replace(tzinfo=timezone.utc) if end_of_day.tzinfo is None else end_of_day.astimezone(timezone.utc)
-
-    all_transactions: List[TransactionDetail] = []
-    processed_transaction_ids = set()
-    page = 1
-
-    async with httpx.AsyncClient(timeout=30.0) as client:
-        while True:
-            current_params = base_params.copy()
-            current_params["page"] = page
-            
-            try:
-                response = await client.get(transactions_url, headers=headers, params=current_params)
-                response.raise_for_status()
-                response_data = response.json()
-                transactions_on_page = response_data.get("data", {}).get("transaction", [])
-                
-                if not transactions_on_page:
-                    break
-                
-                num_processed_before = len(processed_transaction_ids)
-
-                for trans_data in transactions_on_page:
-                    try:
-                        transaction_id = trans_data.get("transactionId")
-                        if not transaction_id or transaction_id in processed_transaction_ids:
-                            continue
-                        
-                        transaction = TransactionDetail(**trans_data)
-
-                        # Внутренняя фильтрация остаётся как дополнительная проверка
-                        is_in_date_range = True
-                        if from_utc and transaction.bookingDateTime < from_utc:
-                            is_in_date_range = False
-                        if to_utc_inclusive and transaction.bookingDateTime > to_utc_inclusive:
-                            is_in_date_range = False
-                        
-                        if is_in_date_range:
-                            processed_transaction_ids.add(transaction_id)
-                            all_transactions.append(transaction)
-                            
-                    except Exception:
-                        continue
-                
-                if len(processed_transaction_ids) == num_processed_before:
-                    break
-
-                page += 1
-            except (httpx.RequestError, httpx.HTTPStatusError) as e:
-                raise Exception(f"Failed to fetch transactions from {connection.bank_name}: {e}")
-
-    return all_transactions
+    db_account = await _find_account(db, user_id, bank.name, api_account_id)
+
+    if not db_account:
+        raise HTTPException(status_code=403, detail="Active connection with consent is required.")
+    connection = db_account.connection
+    if connection.status != "active" or not connection.consent_id:
+        raise HTTPException(status_code=403, detail="Active connection with consent is required.")
+
+    return db_account, await _sync_transactions(db, db_account, bank)
 
 
 # --- ОБНОВЛЕННАЯ ФУНКЦИЯ get_transactions ---
@@ -117,39 +95,56 @@ async def get_transactions(
     user_id: int,
     bank_id: int,
     api_account_id: str,
+    response: Response,
     from_booking_date_time: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
     to_booking_date_time: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
-    bank = db.query(models.Bank).filter(models.Bank.id == bank_id).first()
-    if not bank:
-        raise HTTPException(status_code=404, detail="Bank with the specified ID not found.")
-    
-    connection = db.query(models.ConnectedBank).join(models.Account).filter(
-        models.Account.api_account_id == api_account_id,
-        models.ConnectedBank.user_id == user_id,
-        models.ConnectedBank.bank_name == bank.name
-    ).first()
-
-    if not connection or connection.status != "active" or not connection.consent_id:
-        raise HTTPException(status_code=403, detail="Active connection with consent is required.")
+    """
+    Транзакции отдаются из локального хранилища; перед этим из банка
+    подтягиваются только новые проводки (см. transaction_store.py).
+    Пока банк недоступен, отдаются уже сохраненные транзакции
+    с заголовком X-Bank-Degraded.
+    Для больших периодов используйте /transactions/stream.
+    """
+    db_account, synced = await _get_synced_account(db, user_id, bank_id, api_account_id)
+    if not synced:
+        response.headers[DEGRADED_HEADER] = db_account.connection.bank_name
+    transactions = await get_stored_transactions(db, db_account.id, from_booking_date_time, to_booking_date_time)
+    return {"data": {"transaction": transactions}}
 
-    bank_access_token = await get_bank_token(connection.bank_name, db)
 
-    try:
-        all_transactions = await _get_all_transactions_for_period(
-            bank_access_token=bank_access_token,
-            bank_config=bank,
-            connection=connection,
-            api_account_id=api_account_id,
-            from_dt=from_booking_date_time,
-            to_dt=to_booking_date_time,
-        )
-        transactions_as_dicts = [t.model_dump() for t in all_transactions]
-        return {"data": {"transaction": transactions_as_dicts}}
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=str(e))
+@router.get(
+    "/{api_account_id}/transactions/stream",
+    summary="Потоковая выдача транзакций за период (NDJSON или JSON)"
+)
+async def stream_transactions(
+    user_id: int,
+    bank_id: int,
+    api_account_id: str,
+    from_booking_date_time: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
+    to_booking_date_time: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
+    format: str = Query("ndjson", pattern="^(ndjson|json)$", description="ndjson — транзакция на строку; json — как у /transactions"),
+    db: AsyncSession = Depends(get_async_db),
+    current_user: models.User = Depends(user_is_admin_or_self)
+):
+    """
+    Те же транзакции, что и у /transactions, но ответ пишется по частям
+    прямо из курсора БД: память не растет с длиной периода, а первые байты
+    уходят клиенту сразу после синхронизации.
+    """
+    db_account, synced = await _get_synced_account(db, user_id, bank_id, api_account_id)
+    account_id, bank_name = db_account.id, db_account.connection.bank_name
+    # Поток читает БД своим соединением: сессию запроса возвращаем в пул сразу,
+    # а не после окончания выгрузки (иначе она висит idle in transaction)
+    await db.close()
+    media_type = "application/x-ndjson" if format == "ndjson" else "application/json"
+    return StreamingResponse(
+        stream_stored_transactions(account_id, from_booking_date_time, to_booking_date_time, fmt=format),
+        media_type=media_type,
+        headers=None if synced else {DEGRADED_HEADER: bank_name},
+    )
 
 
 # --- ОБНОВЛЕННАЯ ФУНКЦИЯ get_account_turnover ---
@@ -162,51 +157,30 @@ async def get_account_turnover(
     user_id: int,
     bank_id: int,
     api_account_id: str,
+    response: Response,
     from_booking_date_time: Optional[datetime] = Query(None, description="Начало периода в формате ISO 8601"),
     to_booking_date_time: Optional[datetime] = Query(None, description="Конец периода в формате ISO 8601"),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
     current_user: models.User = Depends(user_is_admin_or_self)
 ):
-    bank = db.query(models.Bank).filter(models.Bank.id == bank_id).first()
+    bank = await bank_registry.fetch_by_id(bank_id)
     if not bank:
         raise HTTPException(status_code=404, detail="Bank with the specified ID not found.")
     
-    db_account = db.query(models.Account).join(models.ConnectedBank).filter(
-        models.Account.api_account_id == api_account_id,
-        models.ConnectedBank.user_id == user_id,
-        models.ConnectedBank.bank_name == bank.name
-    ).first()
+    db_account = await _find_account(db, user_id, bank.name, api_account_id)
     
     if not db_account:
         raise HTTPException(status_code=404, detail="Account not found for the specified bank or access denied.")
 
-    bank_access_token = await get_bank_token(db_account.connection.bank_name, db)
+    # Без активного согласия считаем по уже сохраненным транзакциям
+    connection = db_account.connection
+    if connection.status == "active" and connection.consent_id:
+        if not await _sync_transactions(db, db_account, bank):
+            response.headers[DEGRADED_HEADER] = bank.name
 
-    try:
-        all_transactions = await _get_all_transactions_for_period(
-            bank_access_token=bank_access_token,
-            bank_config=bank,
-            connection=db_account.connection,
-            api_account_id=api_account_id,
-            from_dt=from_booking_date_time,
-            to_dt=to_booking_date_time,
-        )
-    except Exception as e:
-        raise HTTPException(status_code=502, detail=str(e))
-        
-    total_credit = Decimal("0.0")
-    total_debit = Decimal("0.0")
-    currency = None
-
-    for transaction in all_transactions:
-        if currency is None and transaction.amount.currency:
-            currency = transaction.amount.currency
-        
-        amount_decimal = Decimal(transaction.amount.amount)
-        if transaction.creditDebitIndicator.lower() == 'credit':
-            total_credit += amount_decimal
-        elif transaction.creditDebitIndicator.lower() == 'debit':
-            total_debit += amount_decimal
+    total_credit, total_debit, currency = await get_stored_turnover(
+        db, db_account.id, from_booking_date_time, to_booking_date_time
+    )
 
     return TurnoverResponse(
         account_id=api_account_id,
@@ -215,4 +189,4 @@ async def get_account_turnover(
         currency=currency or db_account.currency or "N/A",
         period_from=from_booking_date_time,
         period_to=to_booking_date_time
-    )
\ No newline at end of file
+    )
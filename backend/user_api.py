@@ -8,6 +8,8 @@ from models import User
 from schemas import UserResponse, UserListResponse, UserCreate, UserUpdateAdmin
 from deps import get_current_user, get_current_admin_user
 from utils import revoke_account_consent, revoke_payment_consent
+from principal_cache import principal_cache
+from principal_revocations import revoke_user_tokens
 import asyncio
 
 
@@ -43,9 +45,15 @@ def update_my_email(
         existing = db.query(User).filter(User.email == user_update_data.email).first()
         if existing:
             raise HTTPException(status_code=400, detail="Email already in use")
-        current_user.email = user_update_data.email
+        # current_user загружен другой (асинхронной) сессией — меняем строку в своей
+        user = db.get(User, current_user.id)
+        user.email = user_update_data.email
+        # Кэш и ранее выпущенные токены хранят старый email
+        revoked_at = revoke_user_tokens(db, user.id)
         db.commit()
-        db.refresh(current_user)
+        db.refresh(user)
+        principal_cache.invalidate_user(user.id, revoked_at)
+        return user
     return current_user
 
 
@@ -60,16 +68,18 @@ async def delete_my_account( # <-- Меняем на async def
     payment_consents = db.query(models.PaymentConsent).filter(models.PaymentConsent.user_id == current_user.id).all()
 
     # 2. Создаем задачи на асинхронный отзыв всего в банках
-    account_tasks = [revoke_account_consent(conn, db) for conn in connections]
-    payment_tasks = [revoke_payment_consent(p_consent, db) for p_consent in payment_consents]
+    account_tasks = [revoke_account_consent(conn) for conn in connections]
+    payment_tasks = [revoke_payment_consent(p_consent) for p_consent in payment_consents]
     
     await asyncio.gather(*account_tasks, *payment_tasks)
     
     # 3. Удаляем все связанные данные из НАШЕЙ БД
     db.query(models.PaymentConsent).filter(models.PaymentConsent.user_id == current_user.id).delete()
     db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == current_user.id).delete()
-    db.delete(current_user)
+    db.query(User).filter(User.id == current_user.id).delete()
+    revoked_at = revoke_user_tokens(db, current_user.id)
     db.commit()
+    principal_cache.invalidate_user(current_user.id, revoked_at)
     return {"status": "deleted", "message": "Your account has been deleted"}
     # --- ^^^ КОНЕЦ ОБНОВЛЕННОЙ ЛОГИКИ ^^^ ---
 
@@ -84,6 +94,9 @@ def update_user_by_admin(
     if not target_user:
         raise HTTPException(status_code=404, detail="User not found")
 
+    # Поля, которые хранят закэшированный principal и claims токена
+    principal_before = (target_user.email, target_user.is_admin)
+
     if user_update_data.email:
         if user_update_data.email != target_user.email:
             existing = db.query(User).filter(User.email == user_update_data.email).first()
@@ -94,8 +107,15 @@ def update_user_by_admin(
     if user_update_data.is_admin is not None:
         target_user.is_admin = user_update_data.is_admin
 
+    # Смена email или прав администратора: токены с прежними claims больше не действуют.
+    # Если они не изменились, пользователь остается в системе
+    revoked_at = None
+    if (target_user.email, target_user.is_admin) != principal_before:
+        revoked_at = revoke_user_tokens(db, target_user.id)
     db.commit()
     db.refresh(target_user)
+    if revoked_at is not None:
+        principal_cache.invalidate_user(target_user.id, revoked_at)
     return target_user
 
 
@@ -116,14 +136,16 @@ async def delete_user_by_admin(
     connections = db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == target_user.id).all()
     payment_consents = db.query(models.PaymentConsent).filter(models.PaymentConsent.user_id == target_user.id).all()
     
-    account_tasks = [revoke_account_consent(conn, db) for conn in connections]
-    payment_tasks = [revoke_payment_consent(p_consent, db) for p_consent in payment_consents]
+    account_tasks = [revoke_account_consent(conn) for conn in connections]
+    payment_tasks = [revoke_payment_consent(p_consent) for p_consent in payment_consents]
     
     await asyncio.gather(*account_tasks, *payment_tasks)
     
     db.query(models.PaymentConsent).filter(models.PaymentConsent.user_id == target_user.id).delete()
     db.query(models.ConnectedBank).filter(models.ConnectedBank.user_id == target_user.id).delete()
     db.delete(target_user)
+    revoked_at = revoke_user_tokens(db, target_user.id)
     db.commit()
+    principal_cache.invalidate_user(target_user.id, revoked_at)
     return {"status": "deleted", "message": f"User {target_user.email} has been deleted."}
     # --- ^^^ КОНЕЦ ОБНОВЛЕННОЙ ЛОГИКИ ^^^ ---
\ No newline at end of file
@@ -14,6 +14,7 @@ class AccountsProvider with ChangeNotifier {
 
   List<BankWithAccounts> _banksWithAccounts = [];
   bool _isRefreshing = false;
+  bool _isWatchingConsents = false;
   String? _errorMessage;
   bool _isDisposed = false;
 
@@ -54,6 +55,7 @@ class AccountsProvider with ChangeNotifier {
 
     _isRefreshing = true;
     _errorMessage = null;
+    final List<int> pendingConnectionIds = [];
     if (isInitialLoad) {
       if (_isDisposed) return;
       notifyListeners();
@@ -65,7 +67,8 @@ class AccountsProvider with ChangeNotifier {
       if (_isDisposed) return;
       final connections = connectionsProvider.connections;
 
-      // 2. Запускаем фоновое обновление данных для каждого подключения
+      // 2. Запускаем фоновое обновление данных для каждого активного подключения.
+      // Ожидающие подтверждения проверяет сервер (consent_watcher) — их не опрашиваем.
       final List<Future<void>> allTasks = [];
       for (final conn in connections) {
         if (conn.status == 'active') {
@@ -77,13 +80,7 @@ class AccountsProvider with ChangeNotifier {
             ),
           );
         } else if (conn.status == 'awaitingauthorization') {
-          allTasks.add(
-            _apiService.checkConsentStatus(
-              authProvider!.token!,
-              authProvider!.userId!,
-              conn.id,
-            ),
-          );
+          pendingConnectionIds.add(conn.id);
         }
       }
       await Future.wait(allTasks, eagerError: false);
@@ -94,8 +91,42 @@ class AccountsProvider with ChangeNotifier {
       _errorMessage = e.toString();
     } finally {
       _isRefreshing = false;
-      if (_isDisposed) return;
-      notifyListeners();
+      if (!_isDisposed) notifyListeners();
+    }
+    if (_isDisposed) return;
+
+    // 3. Ждем подтверждения ожидающих подключений (без await: в фоне)
+    _watchPendingConnections(connectionsProvider, pendingConnectionIds);
+  }
+
+  Future<void> _watchPendingConnections(
+    ConnectionsProvider connectionsProvider,
+    List<int> connectionIds,
+  ) async {
+    if (_isWatchingConsents || connectionIds.isEmpty) return;
+    _isWatchingConsents = true;
+    bool changed = false;
+    try {
+      // Каждый запрос висит на сервере, пока статус не изменится (или до таймаута)
+      while (!changed &&
+          !_isDisposed &&
+          authProvider != null &&
+          authProvider!.isAuthenticated) {
+        changed = await _apiService.waitForConsentChanges(
+          authProvider!.token!,
+          authProvider!.userId!,
+          connectionIds: connectionIds,
+        );
+      }
+    } catch (e) {
+      // Ожидание возобновится при следующем обновлении данных
+      _errorMessage = e.toString();
+      if (!_isDisposed) notifyListeners();
+    } finally {
+      _isWatchingConsents = false;
+    }
+    if (changed && !_isDisposed) {
+      await refreshAllData(connectionsProvider: connectionsProvider);
     }
   }
 }
@@ -195,6 +195,34 @@ class ApiService {
     }
   }
 
+  // Long-poll: ждет, пока сервер (consent_watcher) не обнаружит подтверждение
+  // или отказ по одному из подключений. true — статус изменился.
+  Future<bool> waitForConsentChanges(
+    String token,
+    int userId, {
+    List<int> connectionIds = const [],
+    List<int> paymentConsentIds = const [],
+  }) async {
+    final uri = Uri.parse('$API_BASE_URL/users/$userId/consent-events/wait')
+        .replace(
+          queryParameters: {
+            'connection_id': connectionIds.map((id) => id.toString()).toList(),
+            'payment_consent_id': paymentConsentIds
+                .map((id) => id.toString())
+                .toList(),
+          },
+        );
+    final response = await http.get(
+      uri,
+      headers: {'Authorization': 'Bearer $token'},
+    );
+    if (response.statusCode != 200) {
+      throw Exception('Failed to wait for consent changes: ${response.body}');
+    }
+    final body = json.decode(utf8.decode(response.bodyBytes));
+    return body['changed'] == true;
+  }
+
   Future<Account> updateAccountDates({
     required int userId,
     required int accountId,